@@ -0,0 +1,80 @@
+'''Пропускная способность разбора csv: split по строкам, цикл по csv.reader и блочный разбор из `_csv`.
+Каждый вариант, как и генераторы конвертера, собирает из записи словарь.
+
+Запуск из каталога `app`:
+    python -m benchmarks.csv_engine --rows 10000000
+'''
+from pathlib import Path
+import argparse
+import csv
+import tempfile
+import time
+from src.plugins.converter.objects._csv import iter_rows, make_writer
+
+def legacy_split(path:Path):
+    'Построчный split, как в csv_read_gen до перехода на `_csv`. Поля в кавычках разбираются неверно.'
+    rows = 0
+    with path.open('r', encoding='utf-8') as file:
+        headers = file.readline().strip().split(',')
+        while True:
+            line = file.readline()
+            if line == '':
+                break
+            dict(zip(headers, line.strip().split(',')))
+            rows += 1
+    return rows
+
+def csv_module(path:Path):
+    rows = 0
+    with path.open('r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        headers = next(reader)
+        for row in reader:
+            dict(zip(headers, row))
+            rows += 1
+    return rows
+
+def block_engine(path:Path):
+    rows = 0
+    headers = None
+    with path.open('r', encoding='utf-8', newline='') as file:
+        for batch in iter_rows(file):
+            if headers is None:
+                headers = batch.pop(0)
+            for row in batch:
+                dict(zip(headers, row))
+            rows += len(batch)
+    return rows
+
+def make_csv(path:Path, rows:int, quoted:bool):
+    with path.open('w', encoding='utf-8', newline='') as file:
+        writer = make_writer(file)
+        writer.writerow(['id', 'name', 'city', 'amount', 'comment'])
+        batch = []
+        for num in range(rows):
+            comment = f'note, with comma\nand "quotes" {num}' if quoted and num % 10 == 0 else f'note {num}'
+            batch.append((num, f'user_{num}', 'Moscow', num * 1.5, comment))
+            if len(batch) == 100000:
+                writer.writerows(batch)
+                batch = []
+        writer.writerows(batch)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for quoted in (False, True):
+            path = Path(tmp) / f'data_{"quoted" if quoted else "plain"}.csv'
+            make_csv(path, args.rows, quoted)
+            size = path.stat().st_size / 1024 / 1024
+            for name, func in (('split', legacy_split), ('csv.reader', csv_module), ('blocks', block_engine)):
+                started = time.perf_counter()
+                rows = func(path)
+                elapsed = time.perf_counter() - started
+                status = 'ok' if rows == args.rows else f'записей {rows}, ожидалось {args.rows}'
+                print(f'{path.name:16} {name:10} {elapsed:7.2f}s {rows / elapsed / 1e6:6.2f}M строк/с {size / elapsed:7.1f}MB/s {status}')
+            path.unlink()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''Генератор синтетических таблиц для бенчмарков конвертера.
+
+Колонки чередуют типы: целые, дробные, строки заданной ширины и даты. Значения зависят только от `seed`,
+поэтому одинаковые параметры дают одинаковые файлы на любой машине.
+
+Запуск из каталога `app`:
+    python -m benchmarks.datasets --rows 1000000 --cols 20 --width 16 --format csv --format json --out data
+'''
+from pathlib import Path
+from datetime import date, timedelta
+from typing import Iterator
+import argparse
+import random
+from src.plugins.converter.objects._types import table_batch
+from src.plugins.converter.objects._compression import file_type
+from src.plugins.converter.objects.optimized_table import OptimizedTable
+
+KINDS = ('int', 'float', 'str', 'date')
+BATCH_SIZE = 10000
+_ALPHABET = 'abcdefghijklmnopqrstuvwxyzабвгдеёжзийклмнопрстуфхцчшщъыьэюя0123456789 '
+
+def columns(cols:int) -> list[str]:
+    return [f'{KINDS[num % len(KINDS)]}_{num}' for num in range(cols)]
+
+def batches(rows:int, cols:int, width:int, seed:int=0, batch_size:int=BATCH_SIZE) -> Iterator[table_batch]:
+    'Строки таблицы пачками словарей, как их отдают читатели оптимизированного режима.'
+    rnd = random.Random(seed)
+    names = columns(cols)
+    # Небольшой словарь строк: генерация не должна занимать больше времени, чем сама конвертация
+    words = [''.join(rnd.choices(_ALPHABET, k=width)) for _ in range(1024)]
+    started = date(2020, 1, 1)
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for num in range(offset, min(offset + batch_size, rows)):
+            row = {}
+            for index, name in enumerate(names):
+                match KINDS[index % len(KINDS)]:
+                    case 'int':
+                        row[name] = rnd.randrange(-10**9, 10**9)
+                    case 'float':
+                        row[name] = round(rnd.uniform(-1e6, 1e6), 4)
+                    case 'str':
+                        row[name] = words[rnd.randrange(len(words))]
+                    case 'date':
+                        row[name] = (started + timedelta(days=num % 3650)).isoformat()
+            batch.append(row)
+        yield batch
+
+def generate(path:Path, rows:int, cols:int, width:int, seed:int=0) -> Path:
+    'Пишет таблицу в `path`, формат и сжатие определяются по расширению.'
+    OptimizedTable(batches=batches(rows, cols, width, seed)).save(path, file_type(path))
+    return path
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cols', type=int, default=20)
+    parser.add_argument('--width', type=int, default=16, help='Длина строковых значений')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', action='append', dest='formats', help='Формат файла, можно указать несколько раз')
+    parser.add_argument('--out', type=Path, default=Path('.'))
+    args = parser.parse_args()
+    args.out.mkdir(parents=True, exist_ok=True)
+    for fmt in args.formats or ['csv', 'json', 'xlsx']:
+        path = generate(args.out / f'dataset_{args.rows}x{args.cols}.{fmt}', args.rows, args.cols, args.width, args.seed)
+        print(f'{path} {path.stat().st_size / 1024 / 1024:.1f}MB')
+
+if __name__ == '__main__':
+    main()
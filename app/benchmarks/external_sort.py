@@ -0,0 +1,45 @@
+'''Внешняя сортировка оптимизированного режима: время и пиковый RSS при разных ограничениях памяти.
+
+Источник — csv из `datasets`, сортировка по строковой и целой колонкам, результат пишется в ndjson.
+Каждое ограничение запускается в отдельном процессе, чтобы пиковый RSS не переходил между прогонами.
+
+Запуск из каталога `app`:
+    python -m benchmarks.external_sort --rows 1000000 --memory 2000000 --memory 200000 --memory 50000
+'''
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import argparse
+import tempfile
+import time
+from src.plugins.converter.objects.optimized_table import OptimizedTable
+from . import datasets
+from .suite import peak_rss
+
+def run_case(source:Path, target:Path, columns:list[str], memory_rows:int) -> dict:
+    started = time.perf_counter()
+    OptimizedTable.read(source).sort(columns, memory_rows=memory_rows).save(target)
+    return {'seconds': time.perf_counter() - started, 'rss_peak': peak_rss()}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--width', type=int, default=16)
+    parser.add_argument('--memory', type=int, action='append', dest='budgets', help='Строк в памяти, можно указать несколько раз')
+    args = parser.parse_args()
+    names = datasets.columns(args.cols)
+    columns = [names[2], names[0]]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = datasets.generate(Path(tmp) / 'source.csv', args.rows, args.cols, args.width)
+        print(f'{args.rows} строк, сортировка по {", ".join(columns)}')
+        for memory_rows in args.budgets or [args.rows * 2, args.rows // 10, args.rows // 100]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                result = pool.submit(run_case, source, Path(tmp) / 'target.ndjson', columns, memory_rows).result()
+            line = f'{memory_rows:>10} строк в памяти {result["seconds"]:7.2f}s {args.rows / result["seconds"]:10.0f} строк/с'
+            if result['rss_peak']:
+                line += f' RSS {result["rss_peak"] / 1024 / 1024:7.1f}MB'
+            print(line, flush=True)
+
+if __name__ == '__main__':
+    main()
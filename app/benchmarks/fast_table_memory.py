@@ -0,0 +1,82 @@
+'''Память и время FastTable: строки-словари против колоночного хранения.
+
+Запуск из каталога `app`:
+    python -m benchmarks.fast_table_memory --rows 200000 --cols 100
+'''
+from pathlib import Path
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from src.plugins.converter.objects.fast_table import FastTable
+
+def legacy_from_csv(path:Path, splitter:str=','):
+    'Чтение csv в список словарей, как в FastTable до перехода на колонки.'
+    with path.open('r', encoding='utf-8') as file:
+        data = file.readlines()
+    cols = data.pop(0).replace('\n', '').split(splitter)
+    rows = []
+    for row in data:
+        rows.append(dict(zip(cols, row.replace('\n', '').split(splitter))))
+    return cols, rows
+
+def legacy_to_csv(cols:list[str], rows:list[dict], splitter:str=','):
+    result = [splitter.join(cols)]
+    for row in rows:
+        result.append(splitter.join(map(str, row.values())))
+    return '\n'.join(result)
+
+def make_csv(path:Path, rows:int, cols:int, numeric:bool):
+    with path.open('w', encoding='utf-8') as file:
+        file.write(','.join(f'column_{c}' for c in range(cols)) + '\n')
+        for r in range(rows):
+            if numeric:
+                file.write(','.join(str(r * cols + c) for c in range(cols)) + '\n')
+            else:
+                file.write(','.join(f'v{r % 1000}_{c}' for c in range(cols)) + '\n')
+
+def measure(load, dump):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    table = load()
+    loaded = time.perf_counter() - started
+    retained = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    dump(table)
+    dumped = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return loaded, dumped, retained, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cols', type=int, default=50)
+    parser.add_argument('--numeric', action='store_true', help='Числовые значения: FastTable.compact() хранит их в array. '
+                        'Время чтения колоночной таблицы в этом режиме включает перевод строк в int')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'wide.csv'
+        make_csv(path, args.rows, args.cols, args.numeric)
+
+        def load_columnar():
+            table = FastTable.from_csv(path)
+            if args.numeric:
+                table.columns = [list(map(int, column)) for column in table.columns]
+                table.compact()
+            return table
+
+        cases = (
+            ('dict rows', lambda: legacy_from_csv(path), lambda table: legacy_to_csv(*table)),
+            ('columnar', load_columnar, lambda table: table.to_csv()),
+        )
+        print(f'{args.rows} строк x {args.cols} колонок, файл {path.stat().st_size / 1024 / 1024:.1f}MB')
+        for name, load, dump in cases:
+            loaded, dumped, retained, peak = measure(load, dump)
+            print(f'{name:10} чтение {loaded:7.2f}s запись {dumped:7.2f}s '
+                  f'в памяти {retained / 1024 / 1024:8.1f}MB пик {peak / 1024 / 1024:8.1f}MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''Сравнение потокового чтения json: построчная эвристика против побайтового токенизатора.
+
+Запуск из каталога `app`:
+    python -m benchmarks.json_reader --size-mb 1024 --size-mb 5120
+'''
+from pathlib import Path
+from typing import TextIO
+import argparse
+import tempfile
+import time
+import tracemalloc
+import orjson
+from src.plugins.converter.objects._generators import json_read_gen
+
+def legacy_json_read_gen(file:TextIO):
+    'Построчный генератор, который использовался в `OptimizedTable.from_json` до потокового токенизатора.'
+    result = ''
+    square_braces = 0
+    curly_braces = 0
+    while True:
+        line = file.readline()
+        if not line:
+            # в исходной версии проверки не было: на минифицированном json генератор зацикливался
+            break
+        if '[' in line and square_braces == 0:
+            square_braces += 1
+            continue
+        if ']' in line and square_braces == 1 and curly_braces == 0:
+            break
+        if '{' in line and square_braces == 0:
+            continue
+        if '{' in line and square_braces == 1:
+            curly_braces += 1
+        if '}' in line:
+            curly_braces -= 1
+        if '},' in line and curly_braces == 0:
+            line = line.replace('},', '}')
+        result += line.strip()
+        if result.endswith('}'):
+            yield orjson.loads(result)
+            result = ''
+
+def make_export(path:Path, size_mb:int, pretty:bool):
+    option = orjson.OPT_INDENT_2 if pretty else 0
+    limit = size_mb * 1024 * 1024
+    written = 0
+    num = 0
+    with path.open('wb') as file:
+        file.write(b'[\n' if pretty else b'[')
+        while written < limit:
+            row = {'id': num, 'name': f'row "{num}"', 'value': num * 0.5, 'tags': ['a', 'b'], 'note': None}
+            data = orjson.dumps(row, option=option)
+            if num:
+                data = b',\n' + data if pretty else b',' + data
+            file.write(data)
+            written += len(data)
+            num += 1
+        file.write(b'\n]' if pretty else b']')
+    return num
+
+def measure(func, path:Path, memory:bool):
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    rows = func(path)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return rows, elapsed, peak
+
+def run_legacy(path:Path):
+    with path.open('r', encoding='utf-8') as file:
+        return sum(1 for _ in legacy_json_read_gen(file))
+
+def run_stream(path:Path):
+    with path.open('rb') as file:
+        return sum(len(batch) for batch in json_read_gen(file))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, action='append', help='Размер тестового файла в МБ, можно указать несколько раз')
+    parser.add_argument('--memory', action='store_true', help='Замерять пиковое потребление памяти через tracemalloc (медленнее)')
+    parser.add_argument('--dir', type=Path, default=None, help='Каталог для временных файлов')
+    args = parser.parse_args()
+    sizes = args.size_mb or [64]
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for size in sizes:
+            for pretty in (True, False):
+                path = Path(tmp) / f'export_{size}_{"pretty" if pretty else "min"}.json'
+                total = make_export(path, size, pretty)
+                for name, func in (('legacy', run_legacy), ('stream', run_stream)):
+                    try:
+                        rows, elapsed, peak = measure(func, path, args.memory)
+                    except Exception as e:
+                        print(f'{path.name:28} {name:7} ошибка: {type(e).__name__}: {str(e)[:60]}')
+                        continue
+                    status = 'ok' if rows == total else f'прочитано {rows} из {total}'
+                    mem = f' peak={peak / 1024 / 1024:8.1f}MB' if peak is not None else ''
+                    print(f'{path.name:28} {name:7} {elapsed:8.2f}s {size / elapsed:8.1f}MB/s{mem} {status}')
+                path.unlink()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+'''Повторное чтение результата конвертации: время FastTable.read для json, ndjson, csv, parquet и feather.
+
+Запуск из каталога `app`:
+    python -m benchmarks.reread --rows 1000000
+'''
+from pathlib import Path
+import argparse
+import tempfile
+import time
+from src.plugins.converter.objects.fast_table import FastTable
+
+FORMATS = ('json', 'ndjson', 'csv', 'parquet', 'feather')
+
+def make_table(rows:int) -> FastTable:
+    columns = [
+        list(range(rows)),
+        [f'name_{num % 1000}' for num in range(rows)],
+        [num * 0.25 for num in range(rows)],
+        [num % 2 == 0 for num in range(rows)],
+    ]
+    return FastTable(cols=['id', 'name', 'amount', 'active'], columns=columns).compact()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args()
+    table = make_table(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{args.rows} строк x {len(table.cols)} колонок')
+        for kind in FORMATS:
+            path = Path(tmp) / f'table.{kind}'
+            started = time.perf_counter()
+            table.save(path)
+            saved = time.perf_counter() - started
+            started = time.perf_counter()
+            FastTable.read(path)
+            loaded = time.perf_counter() - started
+            print(f'{kind:8} запись {saved:7.2f}s чтение {loaded:7.2f}s файл {path.stat().st_size / 1024 / 1024:7.1f}MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+'''Набор бенчмарков конвертера: каждая пара источник -> результат в каждом режиме на синтетических данных.
+
+Для каждого случая записывается время, строк в секунду и пиковый RSS процесса. Каждый случай выполняется
+в отдельном процессе, иначе пиковый RSS одного случая перекрывал бы все следующие. С `--tracemalloc` каждый
+случай запускается ещё раз под tracemalloc, чтобы получить пик памяти Python-объектов. Это отдельный прогон,
+т.к. tracemalloc замедляет конвертацию в несколько раз.
+
+Отчёт сохраняется в json вместе с коммитом и параметрами. `--compare` сравнивает его с отчётом другого коммита.
+
+Запуск из каталога `app`:
+    python -m benchmarks.suite --rows 200000 --out report.json
+    python -m benchmarks.suite --rows 200000 --out new.json --compare report.json
+'''
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import argparse
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import orjson
+from src.plugins.converter.objects.fast_table import FastTable
+from src.plugins.converter.objects.optimized_table import OptimizedTable
+from src.plugins.converter.objects.sharded_table import ShardedTable
+from src.plugins.converter.objects._arrow import ARROW_TYPES, arrow_available
+from . import datasets
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля нет, пиковый RSS не записывается
+    resource = None
+
+FORMATS = ('csv', 'json', 'ndjson', 'xlsx', 'startrek', 'parquet', 'feather')
+MODES = ('fast', 'optimized', 'parallel')
+
+def peak_rss(who:int=None) -> int|None:
+    'Пиковый RSS текущего процесса в байтах или, с `RUSAGE_CHILDREN`, самого большого из его дочерних процессов.'
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def supported(mode:str, source:str, target:str) -> bool:
+    if source == target:
+        return False
+    if mode == 'parallel':
+        return source == 'csv' and target in ShardedTable.serializers
+    return True
+
+def convert(mode:str, source:Path, target:Path):
+    match mode:
+        case 'fast':
+            FastTable.read(source).save(target)
+        case 'optimized':
+            OptimizedTable.read(source).save(target)
+        case 'parallel':
+            ShardedTable.read(source).save(target)
+
+def run_case(mode:str, source:Path, target:Path, trace:bool) -> dict:
+    'Выполняется в отдельном процессе: одна конвертация с замерами.'
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    convert(mode, source, target)
+    elapsed = time.perf_counter() - started
+    result = {'seconds': elapsed, 'rss_peak': peak_rss(), 'target_size': target.stat().st_size}
+    if mode == 'parallel' and resource is not None:
+        # Параллельный режим конвертирует в дочерних процессах
+        result['rss_children_peak'] = peak_rss(resource.RUSAGE_CHILDREN)
+    if trace:
+        result['tracemalloc_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    target.unlink()
+    return result
+
+def isolated(mode:str, source:Path, target:Path, trace:bool=False) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(run_case, mode, source, target, trace).result()
+
+def git_commit() -> str|None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def case_key(case:dict) -> str:
+    return f"{case['mode']}:{case['source']}->{case['target']}"
+
+def compare(report:dict, base:dict):
+    'Печатает отношение времени и пикового RSS к базовому отчёту. Меньше 1 — быстрее или экономнее.'
+    base_cases = {case_key(case): case for case in base['cases']}
+    print(f"\nсравнение с {base.get('commit')} ({base['params']})")
+    for case in report['cases']:
+        old = base_cases.get(case_key(case))
+        if old is None:
+            continue
+        line = f"{case_key(case):32} время x{case['seconds'] / old['seconds']:5.2f}"
+        if case.get('rss_peak') and old.get('rss_peak'):
+            line += f" RSS x{case['rss_peak'] / old['rss_peak']:5.2f}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cols', type=int, default=20)
+    parser.add_argument('--width', type=int, default=16, help='Длина строковых значений')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--source', action='append', dest='sources', help='Формат источника, по умолчанию csv, json и xlsx')
+    parser.add_argument('--target', action='append', dest='targets', help='Формат результата, по умолчанию все')
+    parser.add_argument('--mode', action='append', dest='modes', choices=MODES)
+    parser.add_argument('--tracemalloc', action='store_true', help='Дополнительный прогон каждого случая под tracemalloc')
+    parser.add_argument('--out', type=Path, default=Path('benchmark_report.json'))
+    parser.add_argument('--compare', type=Path, help='Отчёт, с которым сравнить результаты')
+    args = parser.parse_args()
+    formats = [fmt for fmt in FORMATS if fmt not in ARROW_TYPES or arrow_available()]
+    sources = args.sources or ['csv', 'json', 'xlsx']
+    targets = args.targets or formats
+    modes = args.modes or list(MODES)
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'rows': args.rows, 'cols': args.cols, 'width': args.width, 'seed': args.seed},
+        'cases': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for source_type in sources:
+            source = datasets.generate(tmp / f'source.{source_type}', args.rows, args.cols, args.width, args.seed)
+            for mode in modes:
+                for target_type in targets:
+                    if not supported(mode, source_type, target_type):
+                        continue
+                    result = isolated(mode, source, tmp / f'target.{target_type}')
+                    if args.tracemalloc:
+                        result['tracemalloc_peak'] = isolated(mode, source, tmp / f'target.{target_type}', True)['tracemalloc_peak']
+                    case = {'mode': mode, 'source': source_type, 'target': target_type, 'source_size': source.stat().st_size,
+                            'rows_per_second': args.rows / result['seconds'], **result}
+                    report['cases'].append(case)
+                    line = f"{case_key(case):32} {case['seconds']:7.2f}s {case['rows_per_second']:10.0f} строк/с"
+                    if case['rss_peak']:
+                        line += f" RSS {case['rss_peak'] / 1024 / 1024:7.1f}MB"
+                    if 'tracemalloc_peak' in case:
+                        line += f" tracemalloc {case['tracemalloc_peak'] / 1024 / 1024:7.1f}MB"
+                    print(line, flush=True)
+            source.unlink()
+    args.out.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    print(f'отчёт: {args.out}')
+    if args.compare:
+        compare(report, orjson.loads(args.compare.read_bytes()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''Время и память записи xlsx: openpyxl в режиме write_only против потоковой записи XlsxWriter.
+
+Запуск из каталога `app`:
+    python -m benchmarks.xlsx_writer --rows 500000
+'''
+from pathlib import Path
+from datetime import datetime, timedelta
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from openpyxl import Workbook
+from src.plugins.converter.objects._xlsx import XlsxWriter
+
+HEADERS = ['id', 'name', 'amount', 'created', 'active']
+
+def make_rows(rows:int):
+    started = datetime(2024, 1, 1)
+    for num in range(rows):
+        yield [num, f'name_{num % 1000}', num * 0.25, started + timedelta(seconds=num), num % 2 == 0]
+
+def legacy_write(path:Path, rows:int):
+    'Запись как в excel_write_gen до перехода на XlsxWriter: все значения через str().'
+    wb = Workbook(True)
+    ws = wb.create_sheet('Data_1')
+    ws.append(HEADERS)
+    for values in make_rows(rows):
+        ws.append(['' if value is None else str(value) for value in values])
+    wb.save(path)
+
+def streaming_write(path:Path, rows:int):
+    with XlsxWriter(path, HEADERS) as writer:
+        writer.append_rows(make_rows(rows))
+
+def measure(write, path:Path, rows:int):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    write(path, rows)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{args.rows} строк x {len(HEADERS)} колонок')
+        for name, write in (('openpyxl', legacy_write), ('streaming', streaming_write)):
+            path = Path(tmp) / f'{name}.xlsx'
+            elapsed, peak = measure(write, path, args.rows)
+            print(f'{name:10} {elapsed:7.2f}s пик {peak / 1024 / 1024:8.1f}MB файл {path.stat().st_size / 1024 / 1024:6.1f}MB')
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,11 @@ from nicegui import Event
 from ...ui.components.dropdown import DropDownBtn
 from ...ui.components.progress import LinearProgress
 from .params_validator import validate_params, Errors
-from .src.script import main
+from .src.jobs import JobScheduler, ConverterJob, JobStatus
+from .objects._compression import with_type, file_formats
+from .objects.optimized_table import OptimizedTable
+from .objects._xlsx import sheet_names
+from .objects._preview import FilePreview
 import os
 import asyncio
 import platform
@@ -18,7 +22,6 @@ from nicegui import Event
 from ...ui.components.dropdown import DropDownBtn
 from ...ui.components.progress import LinearProgress
 from .params_validator import validate_params, Errors
-from .src.script import main
 import os
 import asyncio
 import platform
@@ -32,6 +35,118 @@ class EventsStorage:
         self.param_changed = Event[str, str]()
         self.file_event = Event[str, str]()
         self.fmt_change = Event[str, str]()
+        self.job_changed = Event[ConverterJob]()
+
+def _cell_view(value):
+    'Значение для таблицы просмотра: всё, кроме чисел, строк и bool, показывается текстом.'
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+class JobRow(ui.row):
+    '''Строка задачи в списке конвертаций. Прогресс-бар создаётся один раз на задачу, поэтому при смене статуса
+    любой задачи оценка оставшегося времени не сбрасывается: обновляются только подписи и видимость элементов.'''
+    def __init__(self, job:ConverterJob, cancel):
+        super().__init__(wrap=False)
+        self.job = job
+        self.classes('w-full items-center')
+        with self:
+            ui.label(job.title)
+            self.status_label = ui.label()
+            self.progress_bar = LinearProgress(size='25px').classes('w-1/3')
+            self.progress_bar.set_visibility(False)
+            ui.space()
+            self.cancel_btn = ui.button(icon='close', on_click=partial(cancel, job)).props('flat round dense').tooltip('Отменить')
+        self.update()
+
+    def update(self):
+        job = self.job
+        self.status_label.set_text(f'{job.status}: {job.error}' if job.error else job.status)
+        running = job.status == JobStatus.running
+        if running and not self.progress_bar.visible:
+            self.progress_bar.set_visibility(True)
+            self.progress_bar.start(job.progress)
+        elif not running and self.progress_bar.visible:
+            self.progress_bar.stop()
+            self.progress_bar.set_visibility(False)
+        self.cancel_btn.set_visibility(job.active)
+
+class PreviewDialog(ui.dialog):
+    '''Постраничный просмотр файла источника или результата. В таблицу загружается только текущая страница,
+    индекс строк файла строится в фоне, после этого переход к любой странице читает несколько КБ файла.
+    С `remove` файл удаляется при закрытии просмотра.'''
+    page_size = 100
+
+    def __init__(self, path:Path, source_type:str=None, splitter:str=None, remove:bool=False):
+        super().__init__()
+        self.path = Path(path)
+        self.preview = FilePreview(self.path, source_type, splitter)
+        self.remove = remove
+        self.start = 0
+        self.rows = 0
+        self.props('maximized')
+        self.on_value_change(lambda e: None if e.value else self.release())
+        with self, ui.card().classes('w-full h-full'):
+            with ui.row().classes('w-full items-center'):
+                ui.label(self.path.name)
+                ui.space()
+                ui.button(icon='close', on_click=self.close).props('flat round dense')
+            self.grid = ui.aggrid({'columnDefs': [], 'rowData': [], 'suppressFieldDotNotation': True}).classes('w-full grow')
+            with ui.row().classes('w-full items-center'):
+                ui.button(icon='first_page', on_click=lambda: self.show(0)).props('flat dense')
+                ui.button(icon='chevron_left', on_click=lambda: self.show(max(0, self.start - self.page_size))).props('flat dense')
+                ui.button(icon='chevron_right', on_click=lambda: self.show(self.start + self.page_size)).props('flat dense')
+                self.last_btn = ui.button(icon='last_page', on_click=self.show_last).props('flat dense')
+                self.last_btn.set_enabled(False)
+                self.position_label = ui.label()
+                ui.space()
+                goto = ui.number('Перейти к строке', min=1, step=1, format='%d').props('dense')
+                goto.on('keydown.enter', lambda: self.show(max(0, int(goto.value or 1) - 1)))
+
+    async def open_preview(self):
+        self.open()
+        await self.show(0)
+        if self.preview.indexed:
+            await asyncio.to_thread(self.preview.build_index)
+        self.update_position()
+
+    async def show(self, start:int):
+        total = self.preview.total
+        if total is not None and start >= total:
+            start = max(0, total - self.page_size)
+        try:
+            rows = await asyncio.to_thread(self.preview.page, start, self.page_size)
+        except Exception as e:
+            logger.debug(f'Не удалось прочитать страницу {self.path}: {e}')
+            ui.notify(f'Не удалось прочитать файл: {e}')
+            return
+        if not rows and start:
+            return
+        self.start = start
+        self.rows = len(rows)
+        if rows and not self.grid.options['columnDefs']:
+            self.grid.options['columnDefs'] = [{'field': str(name), 'headerName': str(name)} for name in rows[0]]
+        self.grid.options['rowData'] = [{str(name): _cell_view(value) for name, value in row.items()} for row in rows]
+        self.grid.update()
+        self.update_position()
+
+    async def show_last(self):
+        if self.preview.total is not None:
+            await self.show(max(0, self.preview.total - self.page_size))
+
+    def update_position(self):
+        total = self.preview.total
+        self.last_btn.set_enabled(total is not None)
+        if not self.rows:
+            self.position_label.set_text('Нет строк')
+            return
+        count = f'{total:,}' if total is not None else '…'
+        self.position_label.set_text(f'Строки {self.start + 1:,}–{self.start + self.rows:,} из {count}'.replace(',', ' '))
+
+    def release(self):
+        self.preview.close()
+        if self.remove:
+            self.path.unlink(missing_ok=True)
 
 class ConverterUI(PluginUI):
     def __init__(self, url, notify):
@@ -41,21 +156,45 @@ class ConverterUI(PluginUI):
         self.source_file_filed:FilepickField = None
         self.target_file_filed:FilepickField = None
         self.open_result_btn:ui.button = None
-        self.progress_bar:LinearProgress = None
+        self.columns_select:ui.select = None
+        self.unique_select:ui.select = None
+        self.group_select:ui.select = None
+        self.sort_select:ui.select = None
+        self.sheets_select:ui.select = None
+        self.columns_request = 0
+        self.jobs_owner:str = None
+        self.jobs_column:ui.column = None
+        self.job_rows:dict[int, JobRow] = {}
+        self.target_area:ui.textarea = None
+        self.scheduler = JobScheduler()
 
         self.events.file_event.subscribe(self.pick_file)
         self.events.param_changed.subscribe(self.param_changed_handler)
         self.events.fmt_change.subscribe(self.change_fmt)
         self.events.res_btn_show.subscribe(self.result_dir_toggle)
         self.events.done.subscribe(self.done_handler)
+        self.events.job_changed.subscribe(self.job_changed_handler)
 
     def done_handler(self):
         if self.target_file_filed.value:
             self.events.res_btn_show.emit(True)
-        self.progress_bar.clear()
-        self.progress_bar.set_visibility(False)
         self.notify.emit({'message': 'Конвертация завершена.'})
 
+    def job_changed_handler(self, job:ConverterJob):
+        if job.status == JobStatus.done:
+            if job.params.source_text:
+                self.params.target_text = job.params.target_text
+                self.target_area.set_value(job.params.target_text)
+            if job.params.preview_path is not None:
+                self.notify.emit({'message': 'Результат слишком большой для поля и открыт в просмотре.'})
+                asyncio.create_task(self.open_preview(job.params.preview_path, job.params.target_type, remove=True))
+            self.done_handler()
+        elif job.status == JobStatus.failed:
+            self.notify.emit({'message': job.error})
+        elif job.status == JobStatus.cancelled:
+            self.notify.emit({'message': 'Конвертация отменена.'})
+        self.jobs_view()
+
     def param_changed_handler(self, key, value):
         setattr(self.params, key, value)
         self.events.res_btn_show.emit(False)
@@ -63,21 +202,70 @@ class ConverterUI(PluginUI):
     def pick_file(self, field:str, value:str):
         setattr(self.params, field, value)
         if field == 'source_path':
-            self.params.target_path = Path(self.params.source_path).with_suffix(f'.{self.params.target_type}')
+            self.params.target_path = with_type(self.params.source_path, self.params.target_type)
             self.target_file_filed.set_value(self.params.target_path, skip=True)
+            self.update_sheets()
+            asyncio.create_task(self.update_columns())
         self.events.res_btn_show.emit(False)
 
+    async def open_preview(self, path:Path|None, source_type:str, remove:bool=False):
+        if not path or not Path(path).is_file():
+            self.notify.emit({'message': f'Файл не найден: {path}'})
+            return
+        await PreviewDialog(path, source_type, self.params.splitter, remove).open_preview()
+
+    def update_sheets(self):
+        'Заполняет список листов xlsx источника. Выбранные листы, которых нет в новом файле, сбрасываются.'
+        sheets = []
+        if self.params.source_type == 'xlsx':
+            try:
+                sheets = sheet_names(Path(self.params.source_path))
+            except Exception as e:
+                logger.debug(f'Не удалось прочитать листы источника: {e}')
+        self.params.sheets = [sheet for sheet in self.params.sheets if sheet in sheets]
+        self.sheets_select.set_options(sheets, value=self.params.sheets)
+        self.sheets_select.set_visibility(bool(sheets))
+
+    def change_sheets(self, sheets:list[str]):
+        self.events.param_changed.emit('sheets', sheets or [])
+        asyncio.create_task(self.update_columns())
+
+    async def update_columns(self):
+        '''Заполняет список колонок по заголовку файла источника. Выбранные колонки, которых нет в новом заголовке, сбрасываются.
+        Заголовок читается в отдельном потоке. Если за это время источник снова сменился, результат устаревшего чтения не применяется.'''
+        self.columns_request += 1
+        request = self.columns_request
+        try:
+            headers = await asyncio.to_thread(OptimizedTable.read_headers, Path(self.params.source_path), self.params.source_type,
+                                              self.params.splitter, list(self.params.sheets))
+        except Exception as e:
+            logger.debug(f'Не удалось прочитать заголовок источника: {e}')
+            headers = []
+        if request != self.columns_request:
+            return
+        self.params.columns = [col for col in self.params.columns if col in headers]
+        self.columns_select.set_options(headers, value=self.params.columns)
+        self.params.unique = [col for col in self.params.unique if col in headers]
+        self.unique_select.set_options(headers, value=self.params.unique)
+        self.params.group_by = [col for col in self.params.group_by if col in headers]
+        self.group_select.set_options(headers, value=self.params.group_by)
+        self.params.sort_by = [col for col in self.params.sort_by if col in headers]
+        self.sort_select.set_options(headers, value=self.params.sort_by)
+
     def change_fmt(self, field:str, value:str):
         setattr(self.params, field, value)
         try:
-            self.params.source_path = self.params.source_path.with_suffix(f'.{self.params.source_type}')
-            self.params.target_path = self.params.source_path.with_suffix(f'.{self.params.target_type}')
+            self.params.source_path = with_type(self.params.source_path, self.params.source_type)
+            self.params.target_path = with_type(self.params.source_path, self.params.target_type)
         except Exception as e:
             pass
-        self.source_file_filed.formats = [self.params.source_type]
-        self.target_file_filed.formats = [self.params.target_type]
+        self.source_file_filed.formats = file_formats(self.params.source_type)
+        self.target_file_filed.formats = file_formats(self.params.target_type)
         self.source_file_filed.set_value(self.params.source_path, skip=True)
         self.target_file_filed.set_value(self.params.target_path, skip=True)
+        if field == 'source_type':
+            self.update_sheets()
+            asyncio.create_task(self.update_columns())
         self.events.res_btn_show.emit(False)
 
     async def run(self, *args, **kwargs):
@@ -85,18 +273,12 @@ class ConverterUI(PluginUI):
             validate_params(self.params)
         except Errors.ValidationError as e:
             return await self.handle_validate_errors(e)
-        self.progress_bar.clear()
-        self.progress_bar.set_visibility(True)
-        try:
-            await asyncio.to_thread(main, 
-                                    self.params, 
-                                    lambda e: self.notify.emit({'message': e}), 
-                                    self.events.done.emit, 
-                                    self.progress_bar.change_event.emit)
-        except Exception as e:
-            self.notify.emit({'message': str(e)})
-            self.progress_bar.clear()
-            self.progress_bar.set_visibility(False)
+        job = ConverterJob(self.params,
+                           ui.context.client.id,
+                           lambda e: self.notify.emit({'message': e}),
+                           self.events.job_changed.emit)
+        self.scheduler.submit(job)
+        self.jobs_view()
 
     async def handle_validate_errors(self, e: Errors.ValidationError):
         self.notify.emit({'message': e.msg})
@@ -116,19 +298,71 @@ class ConverterUI(PluginUI):
             ui.space()
             ui.label('Тип конвертации')
             with ui.label('?'):
-                ui.tooltip('Оптимизированный режим потребляет меньше памяти, но занимает больше времени.\n\nВ быстром режиме потребление памяти будет пропорционально размеру файла(Примерно в 2 раза больше размера файла), т.к. файл целиком загружается в память.')
+                ui.tooltip('Оптимизированный режим потребляет меньше памяти, но занимает больше времени.\n\nВ быстром режиме таблица целиком загружается в память, сам файл источника не копируется, а отображается в память.\n\nПараллельный режим делит csv файл на части и конвертирует их на всех ядрах процессора, поддерживается только конвертация csv в json и ndjson.\n\nАсинхронный режим читает и пишет файлы в цикле событий сервера, не занимая отдельный поток, тяжёлые блоки разбираются в небольшом общем пуле потоков.\n\nПакетная конвертация обрабатывает все файлы формата источника из папки или по шаблону в нескольких процессах, каждый файл выбранным типом конвертации. Файлы, результат которых новее источника, пропускаются.\n\nФайлы json, ndjson, csv и startrek с расширением .gz, .bz2, .xz, .zst или .zip распаковываются и сжимаются на лету.')
             ui.space()
         with ui.row(wrap=False).classes('w-full justify-center'):
-            DropDownBtn('type', 'Быстрый', 'Оптимизированный', value=self.params.type, callback=self.events.param_changed)
+            DropDownBtn('type', 'Быстрый', 'Оптимизированный', 'Параллельный', 'Асинхронный', value=self.params.type, callback=self.events.param_changed)
+        with ui.row(wrap=False).classes('w-full justify-center'):
+            ui.switch('Определять типы значений', value=self.params.infer_types,
+                      on_change=lambda e: self.events.param_changed.emit('infer_types', e.value)
+                      ).tooltip('Числа, даты и true/false из csv и текста будут записаны в результат как числа, даты и bool, а не строки.')
+            ui.switch('Инкрементально', value=self.params.incremental,
+                      on_change=lambda e: self.events.param_changed.emit('incremental', e.value)
+                      ).tooltip('Оптимизированный режим запоминает хэши блоков источника и при повторной конвертации того же файла дописывает в результат только новые строки. Подходит для выгрузок, которые дополняются в конец.')
+            ui.switch('Индекс строк', value=self.params.row_index,
+                      on_change=lambda e: self.events.param_changed.emit('row_index', e.value)
+                      ).tooltip('Оптимизированный режим сохраняет рядом с результатом json, ndjson или csv позицию каждой тысячной строки. Просмотр результата открывается сразу и листается без чтения файла с начала, параллельный режим делит такой csv на части без поиска границ строк.')
+            batch_switch = ui.switch('Пакетная конвертация', value=self.params.batch,
+                                     on_change=lambda e: self.events.param_changed.emit('batch', e.value))
+        with ui.row(wrap=False).classes('w-full items-baseline'):
+            self.sheets_select = ui.select([], multiple=True, label='Листы xlsx (по умолчанию все)', value=self.params.sheets,
+                                           on_change=lambda e: self.change_sheets(e.value)
+                                           ).classes('w-full').props('use-chips clearable').tooltip('Выбранные листы читаются как одна таблица, колонки сопоставляются по заголовкам листов. Листы разбираются параллельно в отдельных процессах.')
+            self.sheets_select.set_visibility(False)
+        with ui.row(wrap=False).classes('w-full items-baseline'):
+            self.columns_select = ui.select([], multiple=True, label='Колонки результата (по умолчанию все)', value=self.params.columns, with_input=True,
+                                            on_change=lambda e: self.events.param_changed.emit('columns', e.value or [])
+                                            ).classes('w-1/2').props('use-chips clearable')
+            ui.input('Условие отбора строк', value=self.params.where,
+                     on_change=lambda e: self.events.param_changed.emit('where', e.value or '')
+                     ).classes('w-1/2').tooltip('Условия вида "колонка оператор значение" через ";", например: status = done; amount >= 100.\n\nОператоры: = != > < >= <= и ~ (содержит, без учёта регистра). Числа сравниваются как числа.\n\nКолонки и условие применяются при чтении источника, лишние данные не попадают в память.')
+        with ui.row(wrap=False).classes('w-full items-baseline'):
+            self.unique_select = ui.select([], multiple=True, label='Убрать повторы по колонкам', value=self.params.unique, with_input=True,
+                                           on_change=lambda e: self.events.param_changed.emit('unique', e.value or [])
+                                           ).classes('w-1/4').props('use-chips clearable').tooltip('Оптимизированный режим оставляет первую строку для каждого сочетания значений выбранных колонок.')
+            FilepickField('Справочник для соединения', 'join_path', value=self.params.join_path, callback=self.events.file_event).classes('w-1/4')
+            ui.input('Колонки соединения', value=self.params.join_on,
+                     on_change=lambda e: self.events.param_changed.emit('join_on', e.value or '')
+                     ).classes('w-1/4').tooltip('Колонки через запятую: "id" или "id = user_id", если в справочнике колонка называется иначе.\n\nСправочник собирается в памяти, большие справочники и источник раскладываются по временным файлам по хэшу ключа. Количество строк в памяти задаётся в настройках.')
+            ui.select({'inner': 'Только совпавшие строки', 'left': 'Все строки источника'}, value=self.params.join_how, label='Соединение',
+                      on_change=lambda e: self.events.param_changed.emit('join_how', e.value)).classes('w-1/4')
+        with ui.row(wrap=False).classes('w-full items-baseline'):
+            self.group_select = ui.select([], multiple=True, label='Группировать по колонкам', value=self.params.group_by, with_input=True,
+                                          on_change=lambda e: self.events.param_changed.emit('group_by', e.value or [])
+                                          ).classes('w-1/2').props('use-chips clearable')
+            ui.input('Агрегаты', value=self.params.aggregates,
+                     on_change=lambda e: self.events.param_changed.emit('aggregates', e.value or '')
+                     ).classes('w-1/2').tooltip('Функции через ";", например: count; sum(amount); mean(amount); distinct(user_id).\n\nФункции: count, sum, min, max, mean и distinct (число различных значений, приблизительно для больших групп). Результат — строка на группу, колонки агрегатов называются sum_amount и т.д.\n\nБез колонок группировки вся таблица считается одной группой.')
+        with ui.row(wrap=False).classes('w-full items-baseline'):
+            self.sort_select = ui.select([], multiple=True, label='Сортировать по колонкам', value=self.params.sort_by, with_input=True, new_value_mode='add-unique',
+                                         on_change=lambda e: self.events.param_changed.emit('sort_by', e.value or [])
+                                         ).classes('w-3/4').props('use-chips clearable').tooltip('Оптимизированный режим сортирует строки частями в памяти, сбрасывает их во временные файлы и сливает при записи. Числа сравниваются как числа, пустые значения идут первыми.\n\nПосле группировки можно сортировать и по агрегатам, например sum_amount.')
+            ui.switch('По убыванию', value=self.params.sort_descending,
+                      on_change=lambda e: self.events.param_changed.emit('sort_descending', e.value))
+        with ui.row(wrap=False).classes('w-full').bind_visibility_from(batch_switch, 'value'):
+            FilepickField('Папка или шаблон файлов источников, например exports/**/*.csv', 'batch_source', value=self.params.batch_source, callback=self.events.file_event)
+            FilepickField('Папка для результатов (по умолчанию рядом с источниками)', 'batch_target', value=self.params.batch_target, callback=self.events.file_event)
         with ui.row(wrap=False).classes('w-full'):
             with ui.column().style('align-items: center;').classes('w-1/2'):
                 with ui.row():
                     ui.label('Источник')
                 with ui.row():
-                    DropDownBtn('source_type', 'json', 'xlsx', 'csv', value=self.params.source_type, callback=self.events.fmt_change)
+                    DropDownBtn('source_type', 'json', 'ndjson', 'xlsx', 'csv', 'startrek', 'parquet', 'feather', value=self.params.source_type, callback=self.events.fmt_change)
                 with ui.row().classes('w-full no-wrap items-baseline'):
                     self.source_file_filed = FilepickField('Путь к файлу', 'source_path', value=self.params.source_path, callback=self.events.file_event)
-                    self.source_file_filed.formats = [self.params.source_type]
+                    self.source_file_filed.formats = file_formats(self.params.source_type)
+                    ui.button(icon='visibility', on_click=lambda: self.open_preview(self.params.source_path, self.params.source_type)
+                              ).props('flat round dense').tooltip('Просмотр файла по страницам')
                 ui.textarea('Текст для конвертации', 
                             on_change=lambda e: partial(self.events.param_changed.emit, 'source_text')(e.value)
                             ).classes('w-full').props('autogrow')
@@ -136,20 +370,38 @@ class ConverterUI(PluginUI):
                 with ui.row():
                     ui.label('Результат')
                 with ui.row():
-                    DropDownBtn('target_type', 'json', 'xlsx', 'csv', value=self.params.target_type, callback=self.events.fmt_change)
+                    DropDownBtn('target_type', 'json', 'ndjson', 'xlsx', 'csv', 'startrek', 'parquet', 'feather', value=self.params.target_type, callback=self.events.fmt_change)
                 with ui.row().classes('w-full no-wrap items-baseline'):
                     self.target_file_filed = FilepickField('Путь к файлу', 'target_path', value=self.params.target_path, callback=self.events.file_event)
-                    self.target_file_filed.formats = [self.params.target_type]
-                ui.textarea('Результат конвертации будет тут', 
-                            on_change=lambda e: partial(self.events.param_changed.emit, 'target_text')(e.value)
-                            ).classes('w-full').props('autogrow')
+                    self.target_file_filed.formats = file_formats(self.params.target_type)
+                    ui.button(icon='visibility', on_click=lambda: self.open_preview(self.params.target_path, self.params.target_type)
+                              ).props('flat round dense').tooltip('Просмотр файла по страницам')
+                self.target_area = ui.textarea('Результат конвертации будет тут', 
+                                               on_change=lambda e: partial(self.events.param_changed.emit, 'target_text')(e.value)
+                                               ).classes('w-full').props('autogrow')
         with ui.row().classes('w-full justify-center'):
             ui.button('Конвертировать', on_click=self.run)
             self.open_result_btn = ui.button('Показать в проводнике', on_click=self.open_result_dir)
             self.open_result_btn.set_visibility(False)
-        with ui.row().classes('w-full justify-center'):
-            self.progress_bar = LinearProgress(size='25px')
-            self.progress_bar.set_visibility(False)
+        self.jobs_owner = ui.context.client.id
+        self.jobs_column = ui.column().classes('w-full')
+        self.jobs_view()
+
+    def jobs_view(self):
+        '''Обновляет список задач владельца: новые задачи добавляются сверху, у известных обновляются подписи,
+        задачи, вытесненные из истории планировщика, удаляются.'''
+        jobs = self.scheduler.owner_jobs(self.jobs_owner)
+        known = {job.id for job in jobs}
+        for job_id in [job_id for job_id in self.job_rows if job_id not in known]:
+            self.job_rows.pop(job_id).delete()
+        for job in jobs:
+            row = self.job_rows.get(job.id)
+            if row is None:
+                with self.jobs_column:
+                    row = self.job_rows[job.id] = JobRow(job, self.scheduler.cancel)
+                row.move(target_index=0)
+            else:
+                row.update()
 
 
 # def build_run_converter_handler(params: ConverterParams, pubsub: PubSub, *args, **kwargs):
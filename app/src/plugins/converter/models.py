@@ -1,20 +1,84 @@
-from pydantic import BaseModel, Field, field_validator
-from typing import Literal
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import ClassVar, Literal, Self
 from pathlib import Path
+from functools import partial
+from nicegui import ui
 from ...shared.settings.models import PluginSettingsModel
 
-FILE_TYPES = Literal['json', 'xlsx', 'csv', 'startrek']
+FILE_TYPES = Literal['json', 'xlsx', 'csv', 'startrek', 'ndjson', 'parquet', 'feather']
+SETTINGS_PATH = Path(__file__).parent / 'settings.json'
+# Параметры конвертации, значения по умолчанию которых задаются в настройках плагина
+SETTINGS_FIELDS = ('batch_size', 'compress_threads', 'stage_memory_rows')
+
+class Settings(PluginSettingsModel):
+    batch_size: int = Field(10000, ge=1, description='Количество строк, которое оптимизированный режим передаёт от чтения к записи за раз')
+    max_jobs: int = Field(2, ge=1, description='Количество одновременно выполняемых конвертаций')
+    compress_threads: int = Field(0, ge=0, description='Количество потоков сжатия zstd, 0 — сжатие в потоке записи')
+    stage_memory_rows: int = Field(1_000_000, ge=1, description='Количество строк или групп, которое дедупликация, соединение, сортировка и группировка держат в памяти до сброса на диск')
+    _cached: ClassVar[tuple[int, 'Settings']|None] = None
+
+    @classmethod
+    def load(cls) -> Self:
+        'Настройки из файла. Пока файл не изменился, возвращается прочитанный ранее экземпляр.'
+        mtime = SETTINGS_PATH.stat().st_mtime_ns
+        cached = cls._cached
+        if cached is None or cached[0] != mtime:
+            cached = cls._cached = (mtime, cls.from_file(SETTINGS_PATH))
+        return cached[1]
+
+    @classmethod
+    def get_max_jobs(cls):
+        return cls.load().max_jobs
+
+    def layout(self):
+        ui.number('Размер пачки строк (Оптимизированный режим)', value=self.batch_size, min=1, step=1000, format='%d',
+                  on_change=partial(self.setting_changed, 'batch_size'))
+        ui.number('Одновременных конвертаций (после перезапуска)', value=self.max_jobs, min=1, step=1, format='%d',
+                  on_change=partial(self.setting_changed, 'max_jobs'))
+        ui.number('Потоков сжатия zstd (0 — в потоке записи)', value=self.compress_threads, min=0, step=1, format='%d',
+                  on_change=partial(self.setting_changed, 'compress_threads'))
+        ui.number('Строк в памяти для дедупликации, соединения, сортировки и группировки', value=self.stage_memory_rows, min=1, step=100000, format='%d',
+                  on_change=partial(self.setting_changed, 'stage_memory_rows'))
+
+    def setting_changed(self, field:str, e):
+        if e.value is None:
+            return
+        minimum = 0 if field == 'compress_threads' else 1
+        setattr(self, field, max(minimum, int(e.value)))
+        self.save_to_file(SETTINGS_PATH)
+        Settings._cached = None
 
 class ConverterParams(BaseModel):
-    type: Literal['Быстрый', 'Оптимизированный'] = Field('Быстрый', description='Тип конвертации')
+    type: Literal['Быстрый', 'Оптимизированный', 'Параллельный', 'Асинхронный'] = Field('Быстрый', description='Тип конвертации')
     source_type: FILE_TYPES = Field('json', description='Тип файла источника')
     target_type: FILE_TYPES = Field('json', description='Тип файла цели')
     source_path: Path|None = Field(None, description='Путь к файлу источнику')
     target_path: Path|None = Field(None, description='Путь к файлу цели')
     source_text: str = Field('', description='Текст источника')
     target_text: str = Field('', description='Текст цели')
+    preview_path: Path|None = Field(None, description='Временный файл с результатом конвертации текста, который слишком велик для поля')
     splitter: str = Field(',', description='Разделитель (Только для CSV)')
     joiner: str = Field(',', description='Объединитель (Только для CSV)')
+    batch_size: int = Field(None, description='Размер пачки строк (Только для оптимизированного режима)')
+    compress_threads: int = Field(None, description='Количество потоков сжатия zstd')
+    infer_types: bool = Field(False, description='Определять типы значений (числа, даты, bool) по первым строкам источника')
+    columns: list[str] = Field(default_factory=list, description='Колонки результата, пустой список — все колонки источника')
+    where: str = Field('', description='Условие отбора строк, например "status = done; amount > 100"')
+    sheets: list[str] = Field(default_factory=list, description='Листы xlsx, которые читаются как одна таблица, пустой список — все листы')
+    incremental: bool = Field(False, description='Конвертировать только изменившийся конец источника (Только для оптимизированного режима)')
+    unique: list[str] = Field(default_factory=list, description='Колонки, по которым убираются повторы строк, пустой список — без дедупликации')
+    join_path: Path|None = Field(None, description='Файл справочника, с которым соединяется источник (Только для оптимизированного режима)')
+    join_on: str = Field('', description='Колонки соединения через запятую: "id" или "id = user_id"')
+    join_how: Literal['inner', 'left'] = Field('inner', description='inner — только строки с парой в справочнике, left — все строки источника')
+    group_by: list[str] = Field(default_factory=list, description='Колонки группировки, пустой список с агрегатами — вся таблица одной группой')
+    aggregates: str = Field('', description='Агрегаты группировки, например "count; sum(amount); distinct(user_id)"')
+    sort_by: list[str] = Field(default_factory=list, description='Колонки сортировки результата, пустой список — порядок источника')
+    sort_descending: bool = Field(False, description='Сортировать по убыванию')
+    stage_memory_rows: int = Field(None, description='Строк или групп в памяти для дедупликации, соединения, сортировки и группировки')
+    row_index: bool = Field(False, description='Сохранить рядом с результатом индекс строк (Только для оптимизированного режима)')
+    batch: bool = Field(False, description='Пакетная конвертация')
+    batch_source: Path|None = Field(None, description='Папка или glob-шаблон файлов источников (Только для пакетной конвертации)')
+    batch_target: Path|None = Field(None, description='Папка для результатов, по умолчанию рядом с источниками (Только для пакетной конвертации)')
     done: bool = Field(False, description='Готово')
 
     @classmethod
@@ -25,11 +89,20 @@ class ConverterParams(BaseModel):
             return f"../{'/'.join(path.parts[-4:])}"
         return str(path)
 
-    @field_validator('source_path', 'target_path')
+    @model_validator(mode='before')
+    @classmethod
+    def settings_defaults(cls, data):
+        'Незаданные `SETTINGS_FIELDS` берутся из настроек плагина, файл настроек читается не больше одного раза.'
+        if isinstance(data, dict):
+            missing = [name for name in SETTINGS_FIELDS if data.get(name) is None]
+            if missing:
+                settings = Settings.load()
+                data = {**data, **{name: getattr(settings, name) for name in missing}}
+        return data
+
+    @field_validator('source_path', 'target_path', 'batch_source', 'batch_target', 'join_path')
     def validate_path(cls, v):
         if v is None:
             return v
         return Path(v)
 
-class Settings(PluginSettingsModel):
-    pass
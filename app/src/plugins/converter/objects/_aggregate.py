@@ -0,0 +1,255 @@
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+import operator
+import re
+from ._types import table_row, table_batch
+from ._projection import _number
+from ._sort import _value_key
+from ._join import key_getter
+from ._hll import hll_add, hll_count, hll_hash, hll_merge
+from ._spill import SpillStage, Partitions, STAGE_MEMORY_ROWS, SPILL_BATCH_SIZE, check_columns
+
+FUNCTIONS = ('count', 'sum', 'min', 'max', 'mean', 'distinct')
+_AGGREGATE = re.compile(r'\s*(\w+)\s*(?:\(\s*(.*?)\s*\))?\s*')
+
+state = list
+updater = Callable[[state, table_row], None]
+merger = Callable[[state, state], None]
+
+def _empty(value) -> bool:
+    return value is None or value == ''
+
+class Aggregate():
+    '''Агрегатная функция над колонкой: `count` (строки группы или, с колонкой, непустые значения), `sum`, `min`,
+    `max`, `mean` и `distinct` (число различных значений, HyperLogLog). Пустые значения пропускаются, `sum` и `mean`
+    учитывают только конечные числа и строки с ними (см. `_number`), сумма целых остаётся целой. `min` и `max`
+    сравнивают значения как сортировка.
+
+    Состояние группы — один список, агрегат занимает в нём `slots` ячеек, начиная с `slot`.'''
+    def __init__(self, function:str, column:str=None):
+        function = function.lower()
+        if function == 'avg':
+            function = 'mean'
+        if function not in FUNCTIONS:
+            raise AttributeError(f'Неизвестная функция {function}')
+        if column is None and function != 'count':
+            raise AttributeError(f'Для функции {function} необходима колонка')
+        self.function = function
+        self.column = column
+        self.name = function if column is None else f'{function}_{column}'
+        self.slots = 2 if function == 'mean' else 1
+        self.slot = 0
+
+    def __repr__(self):
+        return self.name if self.column is None else f'{self.function}({self.column})'
+
+    def initial(self) -> list:
+        match self.function:
+            case 'count' | 'sum':
+                return [0]
+            case 'mean':
+                return [0, 0]
+            case 'distinct':
+                return [set()]
+            case _:
+                return [None]
+
+    def updater(self) -> updater:
+        slot = self.slot
+        column = self.column
+        match self.function:
+            case 'count' if column is None:
+                def update(values:state, row:table_row):
+                    values[slot] += 1
+            case 'count':
+                def update(values:state, row:table_row):
+                    if not _empty(row.get(column)):
+                        values[slot] += 1
+            case 'sum':
+                def update(values:state, row:table_row):
+                    number = _number(row.get(column))
+                    if number is not None:
+                        values[slot] += number
+            case 'mean':
+                def update(values:state, row:table_row):
+                    number = _number(row.get(column))
+                    if number is not None:
+                        values[slot] += number
+                        values[slot + 1] += 1
+            case 'min' | 'max':
+                better = operator.lt if self.function == 'min' else operator.gt
+                def update(values:state, row:table_row):
+                    value = row.get(column)
+                    if _empty(value):
+                        return
+                    current = values[slot]
+                    if current is None or better(_value_key(value), _value_key(current)):
+                        values[slot] = value
+            case 'distinct':
+                def update(values:state, row:table_row):
+                    value = row.get(column)
+                    if not _empty(value):
+                        values[slot] = hll_add(values[slot], hll_hash(value))
+        return update
+
+    def merger(self) -> merger:
+        'Объединение состояний одной группы из разных сбросов на диск.'
+        slot = self.slot
+        match self.function:
+            case 'count' | 'sum':
+                def merge(values:state, other:state):
+                    values[slot] += other[slot]
+            case 'mean':
+                def merge(values:state, other:state):
+                    values[slot] += other[slot]
+                    values[slot + 1] += other[slot + 1]
+            case 'min' | 'max':
+                better = operator.lt if self.function == 'min' else operator.gt
+                def merge(values:state, other:state):
+                    value = other[slot]
+                    current = values[slot]
+                    if value is not None and (current is None or better(_value_key(value), _value_key(current))):
+                        values[slot] = value
+            case 'distinct':
+                def merge(values:state, other:state):
+                    values[slot] = hll_merge(values[slot], other[slot])
+        return merge
+
+    def result(self, values:state):
+        match self.function:
+            case 'mean':
+                count = values[self.slot + 1]
+                return values[self.slot] / count if count else None
+            case 'distinct':
+                return hll_count(values[self.slot])
+            case _:
+                return values[self.slot]
+
+def parse_aggregates(text:str) -> list[Aggregate]:
+    'Разбирает агрегаты через `;` или запятую: `count; sum(amount); distinct(user_id)`.'
+    aggregates = []
+    for part in re.split(r'[;,]', text):
+        if not part.strip():
+            continue
+        match = _AGGREGATE.fullmatch(part)
+        if match is None:
+            raise AttributeError(f'Не удалось разобрать агрегат "{part.strip()}", ожидается "функция(колонка)"')
+        function, column = match.groups()
+        aggregates.append(Aggregate(function, column or None))
+    return aggregates
+
+class GroupBy(SpillStage):
+    '''Группировка потока строк по колонкам `columns` с агрегатами `aggregates` за один проход. Без колонок
+    вся таблица — одна группа. Результат — строка на группу: значения колонок группы из первой строки группы
+    и значения агрегатов под именами вида `sum_amount`. Значения колонок группы сравниваются как текст.
+
+    Состояния групп хранятся в словаре по ключу группы, каждое — один список (см. `Aggregate`). Когда групп
+    становится больше `memory_rows`, состояния раскладываются по разделам на диске (см. `Partitions`) и словарь
+    начинается заново. В конце разделы читаются по одному, состояния одной группы объединяются. Без сброса
+    группы выдаются в порядке первого появления, со сбросом — по разделам.'''
+    max_level = 4
+
+    def __init__(self, columns:list[str], aggregates:list[Aggregate], memory_rows:int=STAGE_MEMORY_ROWS, directory:Path=None,
+                 batch_size:int=SPILL_BATCH_SIZE):
+        super().__init__(memory_rows, directory)
+        self.columns = list(columns)
+        self.aggregates = aggregates or [Aggregate('count')]
+        self.batch_size = batch_size
+        slot = 1
+        for aggregate in self.aggregates:
+            aggregate.slot = slot
+            slot += aggregate.slots
+        self.updates = [aggregate.updater() for aggregate in self.aggregates]
+        self.merges = [aggregate.merger() for aggregate in self.aggregates]
+
+    def run(self, batches:Iterable[table_batch]) -> Iterator[table_batch]:
+        key = key_getter(self.columns) if self.columns else (lambda row: ())
+        columns = self.columns
+        required = columns + [aggregate.column for aggregate in self.aggregates if aggregate.column is not None]
+        updates = self.updates
+        aggregates = self.aggregates
+        groups = {}
+        spilled:Partitions|None = None
+        checked = False
+        try:
+            for batch in batches:
+                if not batch:
+                    continue
+                if not checked:
+                    check_columns(batch[0], required)
+                    checked = True
+                for row in batch:
+                    group = key(row)
+                    values = groups.get(group)
+                    if values is None:
+                        values = groups[group] = [[row.get(column) for column in columns]]
+                        for aggregate in aggregates:
+                            values.extend(aggregate.initial())
+                    for update in updates:
+                        update(values, row)
+                if len(groups) > self.memory_rows:
+                    if spilled is None:
+                        spilled = Partitions(self.directory)
+                    self._spill(groups, spilled)
+                    groups = {}
+            if spilled is None:
+                yield from self._results(groups.values())
+                return
+            self._spill(groups, spilled)
+            del groups
+            spilled.close()
+            yield from self._merge_partitions(spilled, 1)
+        finally:
+            if spilled is not None:
+                spilled.remove()
+            self.cleanup()
+
+    def _spill(self, groups:dict, partitions:Partitions):
+        for group, values in groups.items():
+            partitions.add(group, (group, values))
+
+    def _merge_partitions(self, partitions:Partitions, level:int) -> Iterator[table_batch]:
+        merges = self.merges
+        for num in range(len(partitions)):
+            groups = {}
+            overflow:Partitions|None = None
+            try:
+                for batch in partitions.batches(num):
+                    for group, values in batch:
+                        known = groups.get(group)
+                        if known is None:
+                            groups[group] = values
+                        else:
+                            for merge in merges:
+                                merge(known, values)
+                    if len(groups) > self.memory_rows and level < self.max_level:
+                        if overflow is None:
+                            overflow = Partitions(self.directory, level)
+                        self._spill(groups, overflow)
+                        groups = {}
+                partitions.remove(num)
+                if overflow is None:
+                    yield from self._results(groups.values())
+                    continue
+                self._spill(groups, overflow)
+                groups = {}
+                overflow.close()
+                yield from self._merge_partitions(overflow, level + 1)
+            finally:
+                if overflow is not None:
+                    overflow.remove()
+
+    def _results(self, groups:Iterable[state]) -> Iterator[table_batch]:
+        columns = self.columns
+        aggregates = self.aggregates
+        batch = []
+        for values in groups:
+            row = dict(zip(columns, values[0]))
+            for aggregate in aggregates:
+                row[aggregate.name] = aggregate.result(values)
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
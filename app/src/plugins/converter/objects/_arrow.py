@@ -0,0 +1,155 @@
+from pathlib import Path
+from typing import Iterable, Iterator, Any
+from importlib.util import find_spec
+import orjson
+from ._types import table_batch, table_column
+
+ARROW_TYPES = ('parquet', 'feather')
+ROW_GROUP_SIZE = 128 * 1024
+
+def arrow_available() -> bool:
+    return find_spec('pyarrow') is not None
+
+def _pyarrow():
+    'pyarrow импортируется при первой записи или чтении parquet и feather, а не при запуске приложения.'
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Для форматов parquet и feather необходим пакет pyarrow.') from None
+    return pyarrow
+
+def _text(value:Any) -> str|None:
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode('utf-8')
+    return str(value)
+
+class ArrowWriter():
+    '''Потоковая запись parquet или feather (Arrow IPC).
+
+    Строки копятся по колонкам до `row_group_size` и записываются одной группой строк parquet или одним
+    record batch feather. Схема определяется по первой группе: колонки без значений и колонки со значениями
+    разных типов записываются строками, вложенные объекты и списки — строками json.'''
+    row_group_size = ROW_GROUP_SIZE
+
+    def __init__(self, dest:str|Path, kind:str, cols:Iterable[Any]):
+        if kind not in ARROW_TYPES:
+            raise AttributeError(f'Неизвестный тип {kind}')
+        self.pa = _pyarrow()
+        self.dest = str(dest)
+        self.kind = kind
+        self.keys = list(cols)
+        self.names = ['' if col is None else str(col) for col in self.keys]
+        self.schema = None
+        self.writer = None
+        self.pending:list[list] = [[] for _ in self.keys]
+        self.pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append_columns(self, columns:list[table_column]):
+        'Добавляет строки, переданные колонками в порядке `cols`.'
+        if not columns or not len(columns[0]):
+            return
+        for pending, column in zip(self.pending, columns):
+            pending.extend(column)
+        self.pending_rows += len(columns[0])
+        if self.pending_rows >= self.row_group_size:
+            self._flush()
+
+    def append_batch(self, batch:table_batch):
+        'Добавляет пачку строк-словарей. Отсутствующие в строке ключи записываются как null.'
+        self.append_columns([[row.get(key) for row in batch] for key in self.keys])
+
+    def _array(self, index:int, values:list):
+        pa = self.pa
+        kind = self.schema.field(index).type if self.schema is not None else None
+        try:
+            array = pa.array(values, type=kind)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            if kind is not None and not pa.types.is_string(kind):
+                raise AttributeError(f'Значения колонки {self.names[index]} не приводятся к типу {kind}, определённому по первым строкам.')
+            return pa.array([_text(value) for value in values], pa.string())
+        if kind is None and (pa.types.is_null(array.type) or pa.types.is_nested(array.type)):
+            return pa.array([_text(value) for value in values], pa.string())
+        return array
+
+    def _open(self):
+        pa = self.pa
+        if self.kind == 'parquet':
+            self.writer = pa.parquet.ParquetWriter(self.dest, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(self.dest, self.schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+
+    def _flush(self):
+        if self.writer is not None and not self.pending_rows:
+            return
+        arrays = [self._array(index, values) for index, values in enumerate(self.pending)]
+        if self.schema is None:
+            self.schema = self.pa.schema([self.pa.field(name, array.type) for name, array in zip(self.names, arrays)])
+            self._open()
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+        self.pending = [[] for _ in self.keys]
+        self.pending_rows = 0
+
+    def close(self):
+        if self.pending is None:
+            return
+        self._flush()
+        self.writer.close()
+        self.pending = None
+
+def arrow_rows(path:Path, kind:str) -> int:
+    'Количество строк в файле по его метаданным, без чтения данных.'
+    pa = _pyarrow()
+    if kind == 'parquet':
+        return pa.parquet.ParquetFile(path).metadata.num_rows
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).count_rows()
+
+def _check_columns(schema, columns:list[str]|None):
+    if columns is None:
+        return
+    missing = [name for name in columns if schema.get_field_index(name) == -1]
+    if missing:
+        raise AttributeError(f'Колонки не найдены в источнике: {", ".join(missing)}')
+
+def iter_arrow_batches(path:Path, kind:str, batch_size:int, columns:list[str]=None) -> Iterator:
+    '''Потоково читает parquet или feather и отдаёт record batch не больше `batch_size` строк.
+    С `columns` читаются только эти колонки: в parquet остальные колонки не распаковываются вовсе.'''
+    pa = _pyarrow()
+    if kind == 'parquet':
+        source = pa.parquet.ParquetFile(path, memory_map=True)
+        _check_columns(source.schema_arrow, columns)
+        yield from source.iter_batches(batch_size, columns=columns)
+        return
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        _check_columns(reader.schema, columns)
+        for num in range(reader.num_record_batches):
+            batch = reader.get_batch(num)
+            if columns is not None:
+                batch = batch.select(columns)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield batch.slice(offset, batch_size)
+
+def read_arrow_columns(path:Path, kind:str, columns:list[str]=None) -> tuple[list[str], list[list]]:
+    'Читает parquet или feather целиком и возвращает имена колонок и значения колонок. С `columns` — только эти колонки.'
+    pa = _pyarrow()
+    if kind == 'parquet':
+        _check_columns(pa.parquet.read_schema(path, memory_map=True), columns)
+        table = pa.parquet.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = pa.feather.read_table(path, memory_map=True)
+        _check_columns(table.schema, columns)
+        if columns is not None:
+            table = table.select(columns)
+    return table.column_names, [column.to_pylist() for column in table.columns]
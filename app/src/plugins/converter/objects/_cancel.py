@@ -0,0 +1,23 @@
+from threading import Event
+
+class JobCancelled(Exception):
+    '''Конвертация остановлена пользователем.'''
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.msg = 'Конвертация отменена.'
+
+class CancelToken():
+    '''Флаг отмены, который выставляется из интерфейса и проверяется рабочим кодом между пачками строк.'''
+    def __init__(self):
+        self._event = Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
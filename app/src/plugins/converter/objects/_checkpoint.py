@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO
+import os
+import time
+import orjson
+from ._generators import ReadState
+from ._compression import compression_of
+from ._projection import Projection
+
+class Checkpoint():
+    '''Точка продолжения прерванной оптимизированной конвертации.
+
+    Хранится рядом с результатом в `.<имя результата>.checkpoint` и связывает позицию в источнике после
+    последней записанной пачки с размером результата на тот же момент. Продолжение возможно, только если
+    источник, результат и параметры не изменились. Поддерживаются форматы, в которые можно дописывать: json, ndjson и csv,
+    только без сжатия.'''
+    sources = ('json', 'ndjson', 'csv')
+    targets = ('json', 'ndjson', 'csv')
+    interval = 2.0
+
+    def __init__(self, source:Path, dest:Path, source_type:str, target_type:str, splitter:str=None, projection:Projection=None,
+                 infer_types:bool=False):
+        self.path = self.sidecar(dest)
+        self.dest = dest
+        stat = source.stat()
+        self.key = {
+            'source': str(source.resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'target': str(dest.resolve()),
+            'source_type': source_type,
+            'target_type': target_type,
+            'splitter': splitter,
+            'projection': projection.key if projection is not None else None,
+            # Типы колонок сохраняются в checkpoint, записанная часть должна быть приведена так же
+            'infer_types': infer_types,
+        }
+        self.input_offset = 0
+        self.output_offset = 0
+        self.rows = 0
+        self.headers:list[str]|None = None
+        self.kinds:list[str]|None = None
+        self.saved_at = 0.0
+
+    @staticmethod
+    def sidecar(dest:Path) -> Path:
+        return dest.with_name(f'.{dest.name}.checkpoint')
+
+    @classmethod
+    def supports(cls, source_type:str, target_type:str, source:Path=None, dest:Path=None) -> bool:
+        if compression_of(source) or compression_of(dest):
+            return False
+        return source_type in cls.sources and target_type in cls.targets
+
+    @classmethod
+    def load(cls, source:Path, dest:Path, source_type:str, target_type:str, splitter:str=None, projection:Projection=None,
+             infer_types:bool=False) -> 'Checkpoint':
+        'Возвращает сохранённую точку продолжения, если она подходит к текущим параметрам, иначе пустую.'
+        checkpoint = cls(source, dest, source_type, target_type, splitter, projection, infer_types)
+        try:
+            data = orjson.loads(checkpoint.path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return checkpoint
+        if data.get('key') != checkpoint.key or not dest.exists() or dest.stat().st_size < data.get('output_offset', 0):
+            return checkpoint
+        checkpoint.input_offset = data['input_offset']
+        checkpoint.output_offset = data['output_offset']
+        checkpoint.rows = data['rows']
+        checkpoint.headers = data.get('headers')
+        checkpoint.kinds = data.get('kinds')
+        return checkpoint
+
+    @property
+    def resumable(self) -> bool:
+        return self.rows > 0
+
+    def state(self) -> ReadState:
+        return ReadState(self.input_offset, self.rows, self.headers, self.kinds)
+
+    def commit(self, state:ReadState, file:IO, force:bool=False) -> bool:
+        '''Сохраняет позицию, если последняя пачка закончилась на известной границе.
+        Без `force` записывает не чаще, чем раз в `interval` секунд. Возвращает `True`, если позиция сохранена.'''
+        if state.offset is None:
+            return False
+        now = time.monotonic()
+        if not force and now - self.saved_at < self.interval:
+            return False
+        file.flush()
+        self.input_offset = state.offset
+        self.output_offset = file.tell()
+        self.rows = state.rows
+        self.headers = state.headers
+        self.kinds = state.kinds
+        data = {
+            'key': self.key,
+            'input_offset': self.input_offset,
+            'output_offset': self.output_offset,
+            'rows': self.rows,
+            'headers': self.headers,
+            'kinds': self.kinds,
+        }
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_bytes(orjson.dumps(data))
+        os.replace(tmp, self.path)
+        self.saved_at = now
+        return True
+
+    def finish(self, state:ReadState, file:IO):
+        'Конвертация завершена, точка продолжения больше не нужна.'
+        self.remove()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+def _target_stat(dest:Path) -> tuple[int, int]|None:
+    try:
+        stat = dest.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+@contextmanager
+def unfinished_removed(dest:Path|None, checkpoint:Checkpoint=None):
+    '''Удаляет результат, если запись прервана отменой или ошибкой, а точка продолжения для него не сохранена.
+    Неполный файл без checkpoint выглядел бы готовым, например для пропуска в пакетном режиме (см. `batch.is_up_to_date`).
+    Файл, который запись не успела изменить, остаётся.'''
+    if dest is None:
+        yield
+        return
+    before = _target_stat(dest)
+    try:
+        yield
+    except BaseException:
+        if (checkpoint is None or not checkpoint.path.exists()) and _target_stat(dest) not in (None, before):
+            dest.unlink(missing_ok=True)
+        raise
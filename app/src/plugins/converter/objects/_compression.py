@@ -0,0 +1,172 @@
+from pathlib import Path
+from typing import IO
+from importlib.util import find_spec
+import bz2
+import gzip
+import io
+import lzma
+import zipfile
+
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd', '.zip': 'zip'}
+# xlsx, parquet и feather сжаты внутри формата и читаются с произвольным доступом.
+COMPRESSIBLE = ('json', 'ndjson', 'csv', 'startrek')
+STREAM_BUFFER_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def compression_of(path:Path|str|None) -> str|None:
+    'Сжатие файла по последнему расширению: `a.csv.gz` -> `gzip`, `a.csv` -> `None`.'
+    if path is None:
+        return None
+    return COMPRESSIONS.get(Path(path).suffix.lower())
+
+def strip_compression(path:Path) -> Path:
+    'Путь без расширения сжатия: `a.csv.gz` -> `a.csv`.'
+    path = Path(path)
+    return path.with_suffix('') if compression_of(path) else path
+
+def file_type(path:Path) -> str:
+    'Формат файла с учётом сжатия: `a.csv.gz` -> `csv`.'
+    return strip_compression(path).suffix[1:]
+
+def with_type(path:Path, type:str) -> Path:
+    '''Меняет формат файла, сохраняя сжатие: `a.csv.gz`, `json` -> `a.json.gz`.
+    Для форматов, которые не сжимаются целиком, расширение сжатия отбрасывается.'''
+    path = Path(path)
+    compression = path.suffix if compression_of(path) and type in COMPRESSIBLE else ''
+    return strip_compression(path).with_suffix(f'.{type}{compression}')
+
+def file_formats(type:str) -> list[str]:
+    'Расширения файлов формата `type`, включая сжатые варианты.'
+    if type not in COMPRESSIBLE:
+        return [type]
+    return [type, *(f'{type}{suffix}' for suffix in COMPRESSIONS)]
+
+def zstd_available() -> bool:
+    return find_spec('zstandard') is not None
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Для сжатия zstd необходим пакет zstandard.') from None
+    return zstandard
+
+class _CompressedRaw(io.RawIOBase):
+    '''Поток сжатия поверх файла на диске, оборачивается в `io.BufferedReader` или `io.BufferedWriter`.
+    При закрытии закрывает поток, архив zip и сам файл.'''
+    def __init__(self, stream, file:IO[bytes], archive:zipfile.ZipFile=None, writing:bool=False):
+        self.stream = stream
+        self.file = file
+        self.archive = archive
+        self.writing = writing
+
+    def readable(self) -> bool:
+        return not self.writing
+
+    def writable(self) -> bool:
+        return self.writing
+
+    def readinto(self, buffer) -> int:
+        return self.stream.readinto(buffer)
+
+    def write(self, data) -> int:
+        self.stream.write(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def position(self) -> int:
+        'Сколько байт сжатого файла прочитано или записано.'
+        return self.file.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+            if self.archive is not None:
+                self.archive.close()
+        finally:
+            self.file.close()
+            super().close()
+
+def _zip_member(archive:zipfile.ZipFile, path:Path) -> str:
+    'Файл внутри архива: с именем архива без `.zip`, иначе единственный файл архива.'
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    name = strip_compression(path).name
+    if name in names:
+        return name
+    if len(names) != 1:
+        raise AttributeError(f'В архиве {path.name} должен быть один файл или файл {name}')
+    return names[0]
+
+def _text(stream:io.BufferedIOBase, mode:str, encoding:str=None, newline:str=None) -> IO:
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding or 'utf-8', newline=newline)
+
+def open_source(path:Path, mode:str='rb', encoding:str=None, newline:str=None) -> IO:
+    '''Открывает файл источника на чтение. Сжатый по расширению файл распаковывается на лету,
+    для текстового `mode` поток оборачивается в `TextIOWrapper`.'''
+    compression = compression_of(path)
+    if compression is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    file = open(path, 'rb')
+    archive = None
+    try:
+        match compression:
+            case 'gzip':
+                stream = gzip.GzipFile(fileobj=file, mode='rb')
+            case 'bz2':
+                stream = bz2.BZ2File(file, 'rb')
+            case 'xz':
+                stream = lzma.LZMAFile(file, 'rb')
+            case 'zstd':
+                stream = _zstandard().ZstdDecompressor().stream_reader(file, read_size=STREAM_BUFFER_SIZE, closefd=False)
+            case 'zip':
+                archive = zipfile.ZipFile(file)
+                stream = archive.open(_zip_member(archive, Path(path)))
+    except Exception:
+        file.close()
+        raise
+    raw = _CompressedRaw(stream, file, archive)
+    return _text(io.BufferedReader(raw, STREAM_BUFFER_SIZE), mode, encoding, newline)
+
+def open_target(path:Path, mode:str='wb', encoding:str=None, newline:str=None, threads:int=0) -> IO:
+    '''Открывает файл результата на запись. Если расширение указывает на сжатие, данные сжимаются на лету.
+
+    `threads` — число потоков сжатия zstd, `-1` — по числу ядер. Остальные форматы сжимаются в одном потоке.'''
+    compression = compression_of(path)
+    if compression is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    file = open(path, 'wb')
+    archive = None
+    try:
+        match compression:
+            case 'gzip':
+                stream = gzip.GzipFile(strip_compression(path).name, 'wb', compresslevel=GZIP_LEVEL, fileobj=file)
+            case 'bz2':
+                stream = bz2.BZ2File(file, 'wb')
+            case 'xz':
+                stream = lzma.LZMAFile(file, 'wb')
+            case 'zstd':
+                compressor = _zstandard().ZstdCompressor(level=ZSTD_LEVEL, threads=threads)
+                stream = compressor.stream_writer(file, closefd=False)
+            case 'zip':
+                archive = zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED, compresslevel=GZIP_LEVEL)
+                stream = archive.open(strip_compression(path).name, 'w', force_zip64=True)
+    except Exception:
+        file.close()
+        raise
+    raw = _CompressedRaw(stream, file, archive, writing=True)
+    return _text(io.BufferedWriter(raw, STREAM_BUFFER_SIZE), mode, encoding, newline)
+
+def source_position(file:IO) -> int:
+    'Позиция в файле на диске. Для сжатого источника — сколько сжатых байт прочитано.'
+    buffer = getattr(file, 'buffer', file)
+    raw = getattr(buffer, 'raw', None)
+    if isinstance(raw, _CompressedRaw):
+        return raw.position()
+    return buffer.tell()
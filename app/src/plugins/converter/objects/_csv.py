@@ -0,0 +1,163 @@
+from typing import Iterable, Iterator, TextIO
+from mmap import mmap
+from contextlib import contextmanager
+import csv
+import gc
+import io
+
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
+MAX_PENDING_BLOCKS = 16
+
+def safe_cut(data:str|bytes) -> int:
+    '''Позиция сразу после последнего перевода строки в `data`, который стоит вне кавычек.
+    Возвращает 0, если такого перевода строки нет.'''
+    newline, quote = ('\n', '"') if isinstance(data, str) else (b'\n', b'"')
+    cut = data.rfind(newline) + 1
+    if cut == 0 or data.find(quote, 0, cut) == -1:
+        return cut
+    quotes = data.count(quote, 0, cut)
+    while cut and quotes % 2:
+        prev = data.rfind(newline, 0, cut - 1) + 1
+        quotes -= data.count(quote, prev, cut)
+        cut = prev
+    return cut
+
+def read_record(file:TextIO) -> str:
+    'Читает одну запись csv целиком: строки добавляются, пока число кавычек в записи нечётное.'
+    record = file.readline()
+    while record.count('"') % 2 and (line := file.readline()):
+        record += line
+    return record
+
+def iter_blocks(file:TextIO, block_size:int=CSV_BLOCK_SIZE) -> Iterator[str]:
+    '''Читает текстовый файл блоками из целых записей csv.
+
+    Если перевод строки вне кавычек не находится на протяжении `MAX_PENDING_BLOCKS` блоков
+    (например, из-за одиночной кавычки в неэкранированном поле), блок режется по последнему
+    переводу строки без учёта кавычек.'''
+    tail = ''
+    while True:
+        chunk = file.read(block_size)
+        if not chunk:
+            if tail:
+                yield tail
+            return
+        text = tail + chunk
+        cut = safe_cut(text)
+        if cut == 0 and len(text) > block_size * MAX_PENDING_BLOCKS:
+            cut = text.rfind('\n') + 1
+        if cut == 0:
+            tail = text
+            continue
+        tail = text[cut:]
+        yield text[:cut]
+
+def iter_buffer_blocks(buffer:bytes|mmap, encoding:str='utf-8', block_size:int=CSV_BLOCK_SIZE) -> Iterator[str]:
+    '''Делит файл, отображённый в память, на блоки из целых записей csv.
+
+    Границы блоков ищутся прямо в буфере по смещениям, в строку декодируется только сам блок.
+    Копия байт блока создаётся лишь для подсчёта кавычек, если они в нём есть.'''
+    size = len(buffer)
+    view = memoryview(buffer)
+    start = 0
+    try:
+        while start < size:
+            end = min(start + block_size, size)
+            cut = size
+            while end < size:
+                cut = buffer.rfind(b'\n', start, end) + 1
+                if cut and buffer.find(b'"', start, cut) != -1:
+                    cut = start + safe_cut(buffer[start:cut])
+                    if cut == start and end - start > block_size * MAX_PENDING_BLOCKS:
+                        cut = buffer.rfind(b'\n', start, end) + 1
+                if cut > start:
+                    break
+                end = min(end + block_size, size)
+                cut = size
+            yield str(view[start:cut], encoding)
+            start = cut
+    finally:
+        view.release()
+
+@contextmanager
+def gc_paused():
+    '''Отключает сборщик циклического мусора на время создания большого числа списков строк.
+    Такие списки не образуют циклов, а без паузы сборщик запускается на каждые несколько сотен новых объектов.'''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def parse_block(text:str, splitter:str=',') -> list[list[str]]:
+    '''Разбирает блок целых записей csv в список строк. Пустые строки пропускаются.
+
+    Строки без кавычек разбираются через `str.split`. Запись с кавычками собирается из строк,
+    пока число кавычек не станет чётным, и отдаётся в `csv.reader`, который обрабатывает
+    экранирование и переводы строк внутри полей.'''
+    with gc_paused():
+        if '"' not in text or len(splitter) != 1:
+            if '\r' in text:
+                text = text.replace('\r\n', '\n')
+            return [line.split(splitter) for line in text.split('\n') if line]
+        rows = []
+        carriage = '\r' in text
+        record = None
+        for line in text.split('\n'):
+            if record is None:
+                if '"' not in line:
+                    if carriage and line.endswith('\r'):
+                        line = line[:-1]
+                    if line:
+                        rows.append(line.split(splitter))
+                    continue
+                record = line
+            else:
+                record += '\n' + line
+            if record.count('"') % 2 == 0:
+                if carriage and record.endswith('\r'):
+                    record = record[:-1]
+                rows.extend(csv.reader((record,), delimiter=splitter))
+                record = None
+        if record is not None:
+            rows.extend(csv.reader((record,), delimiter=splitter))
+        return rows
+
+def iter_rows(file:TextIO, splitter:str=',', block_size:int=CSV_BLOCK_SIZE) -> Iterator[list[list[str]]]:
+    'Разобранные записи csv файла пачками по одному блоку.'
+    for text in iter_blocks(file, block_size):
+        rows = parse_block(text, splitter)
+        if rows:
+            yield rows
+
+class _JoinWriter():
+    'Запись csv с многосимвольным разделителем, который не поддерживает модуль `csv`. Кавычки не расставляются.'
+    def __init__(self, file:TextIO, splitter:str):
+        self.file = file
+        self.splitter = splitter
+
+    @staticmethod
+    def _cell(obj):
+        if obj is None:
+            return ''
+        return str(obj)
+
+    def writerow(self, row:Iterable):
+        self.file.write(self.splitter.join(map(self._cell, row)) + '\n')
+
+    def writerows(self, rows:Iterable[Iterable]):
+        self.file.write(''.join(self.splitter.join(map(self._cell, row)) + '\n' for row in rows))
+
+def make_writer(file:TextIO, splitter:str=','):
+    'Возвращает объект с методами `writerow`/`writerows`, который экранирует поля по RFC 4180.'
+    if len(splitter) != 1:
+        return _JoinWriter(file, splitter)
+    return csv.writer(file, delimiter=splitter, lineterminator='\n')
+
+def format_rows(rows:Iterable[Iterable], splitter:str=',') -> str:
+    'Записывает строки в csv и возвращает результат строкой.'
+    buffer = io.StringIO()
+    make_writer(buffer, splitter).writerows(rows)
+    return buffer.getvalue()
@@ -1,131 +1,489 @@
-from typing import TextIO
+from typing import TextIO, BinaryIO, IO
 import orjson
-from openpyxl import Workbook, load_workbook
+import re
 from typing import Iterable
 from pathlib import Path
-from ._types import progress_callback, message_callback
+from ._types import progress_callback, message_callback, table_batch
+from ._csv import iter_blocks, parse_block, make_writer
+from ._xlsx import XlsxWriter, XlsxReader
+from ._startrek import iter_st_rows, format_st_row, StWildcards, ST_CHUNK_SIZE
+from ._schema import Schema
+from ._arrow import ArrowWriter, iter_arrow_batches
+from ._compression import source_position
+from ._projection import Projection
+from ._row_index import RowIndex
 
-def json_read_gen(file:TextIO, progress:progress_callback=None, msg_cb:message_callback=None):
-    result = ''
-    square_braces = 0
-    curly_braces = 0
-    read_progress = 0
+JSON_CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 10000
+_JSON_BRACES = re.compile(rb'[{}\[\]]')
+_JSON_ESCAPED_QUOTES = re.compile(rb'\\+"')
+_JSON_OBJECT_END = re.compile(rb'}\s*[,\]]')
+_ARRAY_START = ord('[')
+_OPENERS, _CLOSERS = frozenset(b'{['), frozenset(b'}]')
+
+def _json_in_string(buffer:bytearray, start:int, end:int, in_string:bool) -> bool:
+    'Возвращает состояние "внутри строки" на позиции `end`, если на позиции `start` оно было `in_string`.'
+    quotes = buffer.count(b'"', start, end)
+    for match in _JSON_ESCAPED_QUOTES.finditer(buffer, start, end):
+        if (match.end() - match.start()) % 2 == 0:
+            quotes -= 1
+    return in_string ^ bool(quotes & 1)
+
+def _json_guess_object(buffer:bytearray, start:int):
+    '''Пробует разобрать объект, начинающийся на `start`, до ближайшей `}` перед `,` или `]`.
+
+    Объект json не может быть началом другого корректного объекта, поэтому успешный разбор
+    означает, что граница найдена верно. Возвращает `(объект, конец)` или `None`.'''
+    match = _JSON_OBJECT_END.search(buffer, start)
+    if match is None:
+        return None
+    end = match.start() + 1
+    try:
+        return orjson.loads(buffer[start:end]), end
+    except orjson.JSONDecodeError:
+        return None
+
+class ReadState():
+    '''Сколько источника уже отдано читателем.
+
+    `offset` — позиция в байтах сразу после последней отданной пачки или `None`, если пачка закончилась
+    не на известной границе записи. `rows` — число отданных строк, `headers` — заголовок csv,
+    `kinds` — типы колонок, если они определялись.'''
+    def __init__(self, offset:int=0, rows:int=0, headers:list[str]=None, kinds:list[str]=None):
+        self.offset = offset
+        self.rows = rows
+        self.headers = headers
+        self.kinds = kinds
+
+    def mark(self, offset:int|None, batch:table_batch):
+        self.offset = offset
+        self.rows += len(batch)
+
+def json_read_gen(file:BinaryIO, progress:progress_callback=None, msg_cb:message_callback=None, chunk_size:int=JSON_CHUNK_SIZE, batch_size:int=BATCH_SIZE,
+                  state:ReadState=None, resume:bool=False, projection:Projection=None):
+    '''Потоково читает json-массив объектов из бинарного файла и отдаёт их пачками по `batch_size` строк.
+
+    Файл читается блоками по `chunk_size` байт. Границы объектов ищутся по скобкам верхнего уровня массива,
+    скобки внутри строк (с учётом экранирования) пропускаются. Каждый объект целиком отдаётся в `orjson.loads`,
+    поэтому форматирование файла (в т.ч. минифицированный json) не влияет на потребление памяти:
+    в буфере хранится только текущий незавершённый объект.
+
+    Для плоских объектов граница сначала угадывается через `_json_guess_object`, что избавляет от обхода
+    вложенных скобок. Если угадать не удалось ни разу, генератор переходит на полный разбор скобок.
+
+    С `resume=True` файл должен стоять внутри массива, между объектами: так продолжается чтение с позиции из `state`.
+    С `projection` объекты, не подходящие под условие, отбрасываются сразу после разбора.'''
+    pick, check = projection.compile_dicts() if projection is not None else (None, None)
+    buffer = bytearray()
+    depth = 1 if resume else 0
+    in_string = False
+    start = -1
+    pos = 0
+    guess = True
+    guessed = 0
+    batch = []
     while True:
-        line = file.readline()
-        if '[' in line and square_braces == 0:
-            square_braces += 1
-            continue
-        if ']' in line and square_braces == 1 and curly_braces == 0:
+        chunk = file.read(chunk_size)
+        if not chunk:
             break
-        if '{' in line and square_braces == 0:
+        buffer += chunk
+        escape = buffer.find(b'\\', pos)
+        while True:
+            match = _JSON_BRACES.search(buffer, pos)
+            if match is None:
+                break
+            i = match.start()
+            if escape == -1 or escape >= i:
+                if buffer.count(b'"', pos, i) & 1:
+                    in_string = not in_string
+            else:
+                in_string = _json_in_string(buffer, pos, i, in_string)
+                escape = buffer.find(b'\\', i)
+            pos = i + 1
+            if in_string:
+                continue
+            char = buffer[i]
+            if char in _OPENERS:
+                if depth == 0 and char != _ARRAY_START:
+                    raise AttributeError('Неизвестный формат входного json файла, ожидается массив объектов.')
+                if depth == 1:
+                    if guess:
+                        result = _json_guess_object(buffer, i)
+                        if result is not None:
+                            guessed += 1
+                            row, pos = result
+                            if escape != -1 and escape < pos:
+                                escape = buffer.find(b'\\', pos)
+                            if check is None or check(row):
+                                batch.append(row if pick is None else pick(row))
+                            if len(batch) >= batch_size:
+                                if state is not None:
+                                    state.mark(file.tell() - len(buffer) + pos, batch)
+                                yield batch
+                                batch = []
+                            continue
+                        guess = guessed > 0
+                    start = i
+                depth += 1
+            elif char in _CLOSERS:
+                depth -= 1
+                if depth == 1:
+                    row = orjson.loads(buffer[start:pos])
+                    if check is None or check(row):
+                        batch.append(row if pick is None else pick(row))
+                    start = -1
+                    if len(batch) >= batch_size:
+                        if state is not None:
+                            state.mark(file.tell() - len(buffer) + pos, batch)
+                        yield batch
+                        batch = []
+                elif depth == 0:
+                    if batch:
+                        if state is not None:
+                            state.mark(file.tell() - len(buffer) + pos, batch)
+                        yield batch
+                    if progress:
+                        progress(read_position(file))
+                    return
+        cut = pos if start == -1 else start
+        if cut:
+            del buffer[:cut]
+            pos -= cut
+            if start != -1:
+                start = 0
+        if progress:
+            progress(read_position(file))
+    if batch:
+        if state is not None:
+            state.mark(file.tell() - len(buffer) + pos, batch)
+        yield batch
+
+def _index_parts(batch:table_batch, rows:int, index:RowIndex|None) -> Iterable[table_batch]:
+    'Делит пачку на части, которые заканчиваются на строках с номером, кратным шагу индекса. Без индекса пачка не делится.'
+    if index is None:
+        yield batch
+        return
+    start = 0
+    cut = index.step - rows % index.step
+    while cut < len(batch):
+        yield batch[start:cut]
+        start = cut
+        cut += index.step
+    yield batch[start:]
+
+def _index_mark(index:RowIndex|None, rows:int, file:IO):
+    if index is not None and rows % index.step == 0:
+        index.add(rows, file.tell())
+
+def json_write_gen(file:BinaryIO, data:Iterable[table_batch], progress:progress_callback=None, msg_cb:message_callback=None, written:int=0,
+                   index:RowIndex=None):
+    '''Пишет пачки строк в json-массив. Каждая пачка сериализуется одним вызовом `orjson.dumps`,
+    от результата отрезаются скобки массива, а сами пачки склеиваются через запятую.
+
+    `written` — число строк, уже записанных в файл ранее: тогда `[` не пишется, а первая пачка начинается с запятой.
+    С `index` пачки делятся по строкам индекса и в него добавляется позиция после каждой `index.step`-й строки.'''
+    if not written:
+        file.write(b'[')
+    rows = written
+    for batch in data:
+        if not batch:
             continue
-        if '{' in line and square_braces == 1:
-            curly_braces += 1
-        if '}' in line:
-            curly_braces -= 1
-        if '},' in line and curly_braces == 0:
-            line = line.replace('},', '}')
-        result += line.strip()
-        read_progress += 1
-        if result.endswith('}'):
-            res:dict = orjson.loads(result)
-            if progress:
-                progress(read_progress)
-            yield res
-            result = ''
-
-def json_write_gen(file:TextIO, data:Iterable[dict], progress:progress_callback=None, msg_cb:message_callback=None):
-    file.write('[\n')
-    next_row = next(data)
-    last_row = False
-    while True:
+        for part in _index_parts(batch, rows, index):
+            dumped = orjson.dumps(part, option=orjson.OPT_INDENT_2)
+            file.write(dumped[1:-2] if not rows else b',' + dumped[1:-2])
+            rows += len(part)
+            _index_mark(index, rows, file)
+        if progress is not None:
+            progress(rows)
         yield
-        row = next_row
-        try:
-            next_row = next(data)
-        except StopIteration:
-            last_row = True
-        if not last_row: 
-            file.write(f'\t{orjson.dumps(row, option=orjson.OPT_INDENT_2).decode("utf-8")},\n')
-        else:
-            file.write(f'\t{orjson.dumps(row, option=orjson.OPT_INDENT_2).decode("utf-8")}')
-            break
-    file.write('\n]')
+    file.write(b'\n]' if rows else b']')
+    if index is not None:
+        index.total = rows
+
+def ndjson_read_gen(file:BinaryIO, progress:progress_callback=None, msg_cb:message_callback=None, chunk_size:int=JSON_CHUNK_SIZE, batch_size:int=BATCH_SIZE,
+                    state:ReadState=None, projection:Projection=None):
+    '''Потоково читает json lines: по одному объекту в строке. Пустые строки пропускаются.
 
-def csv_read_gen(file:TextIO, splitter:str=',', progress:progress_callback=None, msg_cb:message_callback=None):
-    first_row = file.readline()
-    headers = first_row.strip().split(splitter)
-    read_progress = 0
+    Каждая пачка заканчивается на границе строки, поэтому позиция в `state` известна после любой пачки.'''
+    pick, check = projection.compile_dicts() if projection is not None else (None, None)
+    tail = b''
+    batch = []
     while True:
-        line = file.readline()
-        if line == '':
+        chunk = file.read(chunk_size)
+        if not chunk:
             break
-        row = line.strip().split(splitter)
-        yield dict(zip(headers, row))
+        buffer = tail + chunk
+        buffer_start = file.tell() - len(buffer)
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                break
+            if end > start and not buffer[start:end].isspace():
+                row = orjson.loads(buffer[start:end])
+                if check is None or check(row):
+                    batch.append(row if pick is None else pick(row))
+            start = end + 1
+            if len(batch) >= batch_size:
+                if state is not None:
+                    state.mark(buffer_start + start, batch)
+                yield batch
+                batch = []
+        tail = buffer[start:]
+        if progress:
+            progress(read_position(file))
+    if tail and not tail.isspace():
+        row = orjson.loads(tail)
+        if check is None or check(row):
+            batch.append(row if pick is None else pick(row))
+    if batch:
+        if state is not None:
+            state.mark(file.tell(), batch)
+        yield batch
+
+def ndjson_write_gen(file:BinaryIO, data:Iterable[table_batch], progress:progress_callback=None, msg_cb:message_callback=None, written:int=0,
+                     index:RowIndex=None):
+    'Пишет пачки строк в json lines, каждая пачка (или её часть до строки индекса) записывается одним вызовом `write`.'
+    rows = written
+    for batch in data:
+        if not batch:
+            continue
+        for part in _index_parts(batch, rows, index):
+            file.write(b''.join([orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in part]))
+            rows += len(part)
+            _index_mark(index, rows, file)
         if progress is not None:
-            read_progress += 1
-            progress(read_progress)
+            progress(rows)
+        yield
+    if index is not None:
+        index.total = rows
 
-def csv_write_gen(file:TextIO, data:Iterable[dict], splitter:str=',', progress:progress_callback=None, msg_cb:message_callback=None):
-    first_row = next(data)
-    file.write(splitter.join(first_row.keys()) + '\n')
+def arrow_read_gen(file:Path, kind:str, progress:progress_callback=None, msg_cb:message_callback=None, batch_size:int=BATCH_SIZE,
+                   projection:Projection=None):
+    '''Потоково читает parquet или feather и отдаёт строки пачками по `batch_size`.
+    С `projection` из файла читаются только нужные колонки.'''
+    columns = projection.required if projection is not None else None
+    pick, check = projection.compile_dicts() if projection is not None else (None, None)
     rows = 0
-    while True:
-        yield
-        try:
-            row = next(data)
-        except StopIteration:
-            break
-        file.write(splitter.join([str(row[key]) for key in row.keys()]) + '\n')
+    for batch in iter_arrow_batches(file, kind, batch_size, columns):
+        rows += batch.num_rows
+        data = batch.to_pylist()
+        if check is not None:
+            data = [row for row in data if check(row)]
+        if pick is not None:
+            data = [pick(row) for row in data]
+        yield data
         if progress is not None:
-            rows += 1
             progress(rows)
 
-def excel_read_gen(file:str|Path, progress:progress_callback=None, msg_cb:message_callback=None):
-    wb = load_workbook(file, read_only=True, data_only=True)
-    sheet = wb.active
-    headers = None
-    read_progress = 0
-    for row in sheet.iter_rows():
-        if headers is None:
-            headers = [cell.value for cell in row]
+def arrow_write_gen(file:Path, kind:str, data:Iterable[table_batch], progress:progress_callback=None, msg_cb:message_callback=None):
+    'Пишет пачки строк в parquet или feather. Колонки определяются по ключам первой строки.'
+    writer = None
+    rows = 0
+    try:
+        for batch in data:
+            if not batch:
+                continue
+            if writer is None:
+                writer = ArrowWriter(file, kind, batch[0].keys())
+            writer.append_batch(batch)
+            rows += len(batch)
+            if progress is not None:
+                progress(rows)
+            yield
+    finally:
+        if writer is not None:
+            writer.close()
+
+def read_position(file:TextIO|BinaryIO) -> int:
+    '''Количество прочитанных байт исходного файла. Для текстовых файлов берётся позиция нижележащего буфера,
+    для сжатых — позиция в сжатом файле.'''
+    return source_position(file)
+
+class CsvRows():
+    '''Разбор блоков csv с общим для всех блоков состоянием: заголовок, отбор по `projection` и типы колонок.
+    Заголовок и типы можно передать заранее, если чтение продолжается с середины файла.'''
+    def __init__(self, splitter:str=',', infer_types:bool=False, projection:Projection=None, headers:list[str]=None, kinds:list[str]=None):
+        self.splitter = splitter
+        self.infer_types = infer_types
+        self.projection = projection
+        self.headers = None
+        self.names = self.pick = self.check = None
+        self.schema = Schema(kinds) if kinds else None
+        if headers is not None:
+            self._set_headers(headers)
+
+    def _set_headers(self, headers:list[str]):
+        self.headers = self.names = headers
+        if self.projection is not None:
+            self.names, self.pick, self.check = self.projection.compile(headers)
+
+    @property
+    def kinds(self) -> list[str]|None:
+        return self.schema.kinds if self.schema is not None else None
+
+    def parse(self, text:str) -> list[list[str]]:
+        'Строки блока без заголовка, отобранные и сокращённые до нужных колонок. Типы определяются по первому непустому блоку.'
+        rows = parse_block(text, self.splitter)
+        if self.headers is None and rows:
+            self._set_headers(rows.pop(0))
+        if self.check is not None:
+            rows = list(filter(self.check, rows))
+        if self.pick is not None:
+            rows = list(map(self.pick, rows))
+        if self.infer_types and self.schema is None and rows:
+            self.schema = Schema.infer_rows(rows, len(self.names))
+        return rows
+
+    def batch(self, rows:list[list[str]]) -> table_batch:
+        if self.schema is not None:
+            rows = self.schema.convert_rows(rows, len(self.names))
+        return [dict(zip(self.names, row)) for row in rows]
+
+def csv_read_gen(file:TextIO, splitter:str=',', progress:progress_callback=None, msg_cb:message_callback=None, batch_size:int=BATCH_SIZE,
+                 state:ReadState=None, infer_types:bool=False, projection:Projection=None):
+    '''Потоково читает csv и отдаёт строки пачками по `batch_size`.
+
+    С `infer_types` типы колонок определяются по первым строкам файла, и каждая пачка приводится к ним.
+
+    Если передан `state` с заголовком, файл должен стоять на начале записи после заголовка: так продолжается
+    чтение с позиции из `state`. Известная позиция в байтах есть только у последней пачки каждого блока.
+
+    С `projection` строки отбираются и сокращаются до нужных колонок сразу после разбора блока, до приведения
+    типов и сборки словарей. В `state` сохраняется полный заголовок источника, а типы — только выбранных колонок.'''
+    parser = CsvRows(splitter, infer_types, projection, state.headers if state is not None else None, state.kinds if state is not None else None)
+    position = state.offset if state is not None else 0
+    for text in iter_blocks(file):
+        rows = parser.parse(text)
+        if state is not None:
+            state.headers = parser.headers
+            state.kinds = parser.kinds
+            position += len(text.encode(file.encoding))
+        for start in range(0, len(rows), batch_size):
+            batch = parser.batch(rows[start:start + batch_size])
+            if state is not None:
+                state.mark(position if start + batch_size >= len(rows) else None, batch)
+            yield batch
+        if progress is not None:
+            progress(read_position(file))
+
+def csv_write_gen(file:TextIO, data:Iterable[table_batch], splitter:str=',', progress:progress_callback=None, msg_cb:message_callback=None, written:int=0,
+                  index:RowIndex=None):
+    'С `index` в него добавляется позиция начала каждой `index.step`-й строки (без учёта заголовка).'
+    writer = make_writer(file, splitter)
+    rows = written
+    for batch in data:
+        if not batch:
             continue
-        result = dict(zip(headers, [cell.value for cell in row]))
+        if not rows:
+            writer.writerow(batch[0].keys())
+        for part in _index_parts(batch, rows, index):
+            writer.writerows(row.values() for row in part)
+            rows += len(part)
+            _index_mark(index, rows, file)
         if progress is not None:
-            read_progress += 1
-            progress(read_progress)
-        yield result
-    wb.close()
-
-def _to_excel_cell_str(obj):
-    if obj is None:
-        return ''
-    else:
-        return str(obj)
-
-def excel_write_gen(file:str|Path, data:Iterable[dict], progress:progress_callback=None, msg_cb:message_callback=None):
-    first_row = next(data)
-    ws_num = 1
-    headers = list(first_row.keys())
-    wb = Workbook(True)
-    ws = wb.create_sheet(f'Data_{ws_num}')
-    ws.append(headers)
-    values = list(first_row.values())
-    values = list(map(_to_excel_cell_str, values))
-    ws.append(values)
-    row_num = 1
-    for dic in data:
-        row_num += 1
-        values = list(dic.values())
-        values = list(map(_to_excel_cell_str, values))
-        ws.append(values)
-        if row_num >= 1048570:
-            ws_num += 1
-            row_num = 1
-            ws = wb.create_sheet(f'Data_{ws_num}')
-            ws.append(headers)
+            progress(rows)
+        yield
+    if index is not None:
+        index.total = rows
+
+def st_read_gen(file:TextIO, progress:progress_callback=None, msg_cb:message_callback=None, batch_size:int=BATCH_SIZE,
+                infer_types:bool=False, chunk_size:int=ST_CHUNK_SIZE, projection:Projection=None):
+    '''Потоково читает таблицу startrek и отдаёт строки пачками по `batch_size`. Первая строка таблицы — заголовок.
+
+    С `infer_types` типы колонок определяются по первой пачке, и каждая пачка приводится к ним.
+    С `projection` строки отбираются и сокращаются до нужных колонок до сборки словарей.'''
+    rows = iter_st_rows(iter(lambda: file.read(chunk_size), ''))
+    headers = next(rows, None)
+    if headers is None:
+        return
+    if projection is not None:
+        headers, rows = projection.rows(headers, rows)
+    schema = None
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            if infer_types and schema is None:
+                schema = Schema.infer_rows(batch, len(headers))
+            yield _st_batch(headers, batch, schema)
+            batch = []
+            if progress is not None:
+                progress(read_position(file))
+    if batch:
+        if infer_types and schema is None:
+            schema = Schema.infer_rows(batch, len(headers))
+        yield _st_batch(headers, batch, schema)
+    if progress is not None:
+        progress(read_position(file))
+
+def _st_batch(headers:list[str], rows:list[list[str]], schema:Schema=None) -> table_batch:
+    width = len(headers)
+    if schema is not None:
+        rows = schema.convert_rows(rows, width)
+    elif any(len(row) != width for row in rows):
+        rows = [(row + [None] * width)[:width] for row in rows]
+    return [dict(zip(headers, row)) for row in rows]
+
+def st_write_gen(file:TextIO, data:Iterable[table_batch], progress:progress_callback=None, msg_cb:message_callback=None):
+    'Пишет пачки строк в таблицу startrek, каждая пачка записывается одним вызовом `write`.'
+    rows = 0
+    file.write(f'{StWildcards.start_table}\n')
+    for batch in data:
+        if not batch:
+            continue
+        if not rows:
+            file.write(format_st_row(batch[0].keys()))
+        file.write(''.join([format_st_row(row.values()) for row in batch]))
+        rows += len(batch)
+        if progress is not None:
+            progress(rows)
+        yield
+    file.write(f'{StWildcards.end_table}\n')
+
+def excel_read_gen(file:str|Path|XlsxReader, progress:progress_callback=None, msg_cb:message_callback=None, batch_size:int=BATCH_SIZE,
+                   projection:Projection=None, sheets:list[str]=None, workers:int=None):
+    '''Потоково читает листы xlsx (все или `sheets`) как одну таблицу и отдаёт строки пачками по `batch_size`,
+    см. `XlsxReader`. Прогресс — в байтах разметки листов.
+
+    С `projection` строки листов читаются только до последней нужной колонки: ячейки правее не превращаются в значения.'''
+    reader = file if isinstance(file, XlsxReader) else XlsxReader(file, sheets, projection, workers)
+    names = reader.names
+    batch = []
+    try:
+        for row in reader.rows():
+            batch.append(dict(zip(names, row)))
+            if len(batch) >= batch_size:
+                if progress is not None:
+                    progress(reader.position)
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        if progress is not None:
+            progress(reader.size)
+    finally:
+        reader.close()
+
+def excel_write_gen(file:str|Path, data:Iterable[table_batch], progress:progress_callback=None, msg_cb:message_callback=None):
+    writer = None
+    rows = 0
     try:
-        wb.save(file)
-    except PermissionError:
-        # APP_WINDOW_API.msg.send.emit(f'Не удалось сохранить файл {file}, возможно он занят другим процессом.')
-        msg_cb(f'Не удалось сохранить файл {file}, возможно он занят другим процессом.')
+        for batch in data:
+            if not batch:
+                continue
+            if writer is None:
+                try:
+                    writer = XlsxWriter(file, batch[0].keys())
+                except PermissionError:
+                    # APP_WINDOW_API.msg.send.emit(f'Не удалось сохранить файл {file}, возможно он занят другим процессом.')
+                    msg_cb(f'Не удалось сохранить файл {file}, возможно он занят другим процессом.')
+                    return
+            writer.append_rows(row.values() for row in batch)
+            rows += len(batch)
+            if progress is not None:
+                progress(rows)
+            yield
+    finally:
+        if writer is not None:
+            writer.close()
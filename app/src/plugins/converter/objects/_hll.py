@@ -0,0 +1,61 @@
+from math import log
+from xxhash import xxh3_64_intdigest
+from ._projection import _text
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_SPARSE_LIMIT = 64
+_RANK_BITS = 64 - HLL_PRECISION
+_RANK_MASK = (1 << _RANK_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_POWERS = [2.0 ** -rank for rank in range(_RANK_BITS + 2)]
+
+sketch = set[int] | bytearray
+
+def hll_hash(value) -> int:
+    'Значения сравниваются как текст, как ключи групп.'
+    return xxh3_64_intdigest(_text(value).encode('utf-8'))
+
+def _registers(hashes:set[int]) -> bytearray:
+    registers = bytearray(HLL_REGISTERS)
+    for hashed in hashes:
+        _set(registers, hashed)
+    return registers
+
+def _set(registers:bytearray, hashed:int):
+    index = hashed >> _RANK_BITS
+    rank = _RANK_BITS - (hashed & _RANK_MASK).bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+def hll_add(current:sketch, hashed:int) -> sketch:
+    '''Добавляет хэш значения. Пока значений не больше `HLL_SPARSE_LIMIT`, хэши хранятся множеством и число
+    различных значений точное, затем переводятся в `HLL_REGISTERS` однобайтовых регистров HyperLogLog
+    (стандартная ошибка около 1.6%).'''
+    if type(current) is set:
+        current.add(hashed)
+        return _registers(current) if len(current) > HLL_SPARSE_LIMIT else current
+    _set(current, hashed)
+    return current
+
+def hll_merge(left:sketch, right:sketch) -> sketch:
+    if type(left) is set and type(right) is set:
+        left |= right
+        return _registers(left) if len(left) > HLL_SPARSE_LIMIT else left
+    if type(left) is set:
+        left, right = right, left
+    if type(right) is set:
+        for hashed in right:
+            _set(left, hashed)
+        return left
+    return bytearray(map(max, left, right))
+
+def hll_count(current:sketch) -> int:
+    if type(current) is set:
+        return len(current)
+    estimate = _ALPHA * HLL_REGISTERS * HLL_REGISTERS / sum(map(_POWERS.__getitem__, current))
+    zeros = current.count(0)
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        # Поправка для малых значений: линейный подсчёт по пустым регистрам
+        return round(HLL_REGISTERS * log(HLL_REGISTERS / zeros))
+    return round(estimate)
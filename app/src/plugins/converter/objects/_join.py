@@ -0,0 +1,196 @@
+from pathlib import Path
+from typing import Callable, Hashable, Iterable, Iterator
+from ._types import table_row, table_batch
+from ._projection import _text
+from ._spill import SpillStage, Partitions, STAGE_MEMORY_ROWS, check_columns
+
+keyed_batch = list[tuple[Hashable, table_row]]
+
+def key_getter(columns:list[str]) -> Callable[[table_row], Hashable]:
+    'Ключ строки по колонкам `columns`. Значения сравниваются как текст, так что `1` из json совпадает с "1" из csv.'
+    if len(columns) == 1:
+        column = columns[0]
+        return lambda row: _text(row.get(column))
+    return lambda row: tuple([_text(row.get(column)) for column in columns])
+
+def keyed_batches(batches:Iterable[table_batch], columns:list[str]) -> Iterator[keyed_batch]:
+    'Пачки пар (ключ, строка). Ключевые колонки проверяются по первой строке.'
+    key = key_getter(columns)
+    checked = False
+    for batch in batches:
+        if not batch:
+            continue
+        if not checked:
+            check_columns(batch[0], columns)
+            checked = True
+        yield [(key(row), row) for row in batch]
+
+class Dedup(SpillStage):
+    '''Убирает повторы строк по колонкам `columns`, остаётся первая строка каждого ключа.
+
+    Ключи выданных строк хранятся в множестве. Когда ключей становится больше `memory_rows`, они и все оставшиеся
+    строки раскладываются по разделам на диске (см. `Partitions`), и разделы обрабатываются по одному, так что
+    в памяти ключи только одного раздела. Строки после сброса выдаются по разделам, а не в порядке источника.'''
+    max_level = 4
+
+    def __init__(self, columns:list[str], memory_rows:int=STAGE_MEMORY_ROWS, directory:Path=None):
+        super().__init__(memory_rows, directory)
+        self.columns = list(columns)
+
+    def run(self, batches:Iterable[table_batch]) -> Iterator[table_batch]:
+        try:
+            yield from self._dedup(keyed_batches(batches, self.columns), set(), 0)
+        finally:
+            self.cleanup()
+
+    def _dedup(self, pairs:Iterable[keyed_batch], seen:set, level:int) -> Iterator[table_batch]:
+        pairs = iter(pairs)
+        for batch in pairs:
+            unique = []
+            for key, row in batch:
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(row)
+            if unique:
+                yield unique
+            if len(seen) > self.memory_rows and level < self.max_level:
+                break
+        else:
+            return
+        keys = Partitions(self.directory, level)
+        rows = Partitions(self.directory, level)
+        try:
+            for key in seen:
+                keys.add(key, key)
+            seen.clear()
+            for batch in pairs:
+                for pair in batch:
+                    rows.add(pair[0], pair)
+            keys.close()
+            rows.close()
+            for num in range(len(rows)):
+                part = set(keys.values(num))
+                keys.remove(num)
+                yield from self._dedup(rows.batches(num), part, level + 1)
+                rows.remove(num)
+        finally:
+            keys.remove()
+            rows.remove()
+
+class HashJoin(SpillStage):
+    '''Соединение двух потоков строк по ключевым колонкам. Правый поток (справочник) собирается в хэш-таблицу,
+    левый проходит по ней. `how='inner'` — только строки с парой, `'left'` — все левые строки, у строк без пары
+    колонки правой таблицы пустые. Ключевые колонки правой таблицы в результат не попадают, остальные колонки,
+    которые есть и в левой таблице, получают суффикс `suffix`.
+
+    Если в правой таблице больше `memory_rows` строк, обе таблицы раскладываются по разделам на диске по хэшу
+    ключа (grace hash join) и соединяются по парам разделов. Тогда результат выдаётся по разделам, а не в порядке
+    левой таблицы. Раздел, который снова не поместился в память, делится дальше.'''
+    hows = ('inner', 'left')
+    max_level = 4
+
+    def __init__(self, left_on:list[str], right_on:list[str]=None, how:str='inner', memory_rows:int=STAGE_MEMORY_ROWS,
+                 directory:Path=None, suffix:str='_right'):
+        super().__init__(memory_rows, directory)
+        if how not in self.hows:
+            raise AttributeError(f'Неизвестный тип соединения {how}')
+        self.left_on = list(left_on)
+        self.right_on = list(right_on or left_on)
+        if len(self.left_on) != len(self.right_on):
+            raise AttributeError('Число колонок соединения в таблицах должно совпадать')
+        self.how = how
+        self.suffix = suffix
+        # Колонки правой таблицы без ключа, известны после первой строки справочника
+        self.columns:list[str] = []
+
+    def run(self, left:Iterable[table_batch], right:Iterable[table_batch]) -> Iterator[table_batch]:
+        try:
+            yield from self._join(keyed_batches(left, self.left_on), self._right(right), 0)
+        finally:
+            self.cleanup()
+
+    def _right(self, right:Iterable[table_batch]) -> Iterator[keyed_batch]:
+        keys = set(self.right_on)
+        for batch in keyed_batches(right, self.right_on):
+            if not self.columns:
+                self.columns = [name for name in batch[0][1] if name not in keys]
+            yield batch
+
+    def _join(self, left:Iterable[keyed_batch], right:Iterable[keyed_batch], level:int) -> Iterator[table_batch]:
+        # Строка справочника хранится как есть, список заводится только для повторяющихся ключей
+        table = {}
+        size = 0
+        right = iter(right)
+        for batch in right:
+            for key, row in batch:
+                known = table.get(key)
+                if known is None:
+                    table[key] = row
+                elif type(known) is list:
+                    known.append(row)
+                else:
+                    table[key] = [known, row]
+            size += len(batch)
+            if size > self.memory_rows and level < self.max_level:
+                break
+        else:
+            yield from self._probe(left, table)
+            return
+        lefts = Partitions(self.directory, level)
+        rights = Partitions(self.directory, level)
+        try:
+            for key, rows in table.items():
+                for row in rows if type(rows) is list else (rows,):
+                    rights.add(key, (key, row))
+            table.clear()
+            for batch in right:
+                for pair in batch:
+                    rights.add(pair[0], pair)
+            for batch in left:
+                for pair in batch:
+                    lefts.add(pair[0], pair)
+            lefts.close()
+            rights.close()
+            for num in range(len(rights)):
+                yield from self._join(lefts.batches(num), rights.batches(num), level + 1)
+                lefts.remove(num)
+                rights.remove(num)
+        finally:
+            lefts.remove()
+            rights.remove()
+
+    def _probe(self, left:Iterable[keyed_batch], table:dict) -> Iterator[table_batch]:
+        outer = self.how == 'left'
+        merge = self._merge
+        for batch in left:
+            result = []
+            for key, row in batch:
+                found = table.get(key)
+                if found is None:
+                    if outer:
+                        result.append(merge(row, None))
+                elif type(found) is list:
+                    result.extend([merge(row, other) for other in found])
+                else:
+                    result.append(merge(row, found))
+            if result:
+                yield result
+
+    def _merge(self, left:table_row, right:table_row|None) -> table_row:
+        row = dict(left)
+        for name in self.columns:
+            row[name + self.suffix if name in left else name] = None if right is None else right.get(name)
+        return row
+
+def parse_join_on(text:str) -> tuple[list[str], list[str]]:
+    'Колонки соединения через запятую: `id` или `id = user_id`, если в справочнике колонка называется иначе.'
+    left, right = [], []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, other = part.partition('=')
+        left.append(name.strip())
+        right.append(other.strip() or name.strip())
+    if not left:
+        raise AttributeError('Не заданы колонки соединения')
+    return left, right
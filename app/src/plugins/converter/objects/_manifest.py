@@ -0,0 +1,151 @@
+from pathlib import Path
+from typing import IO
+import os
+import time
+import orjson
+from xxhash import xxh3_64_hexdigest
+from ._checkpoint import Checkpoint
+from ._generators import ReadState
+from ._projection import Projection
+
+MANIFEST_CHUNK_SIZE = 4 * 1024 * 1024
+
+class Manifest(Checkpoint):
+    '''Манифест инкрементальной конвертации. Хранится рядом с результатом в `.<имя результата>.manifest`.
+
+    Источник делится на блоки по `chunk_size` байт, для каждого сохраняется xxh3-хэш. Отдельно сохраняются
+    точки соответствия: позиция в источнике, размер результата и число строк на границе пачки, не реже чем
+    раз в `chunk_size` байт источника и в конце источника.
+
+    При следующем запуске хэши сравниваются с текущим источником и находится неизменившееся начало файла.
+    Результат обрезается до последней точки внутри этого начала, и конвертируется только остаток источника.
+    Для дописываемых в конец выгрузок это только новые строки. В отличие от checkpoint, манифест не удаляется
+    после конвертации, а размер и время изменения источника в ключ не входят.'''
+    chunk_size = MANIFEST_CHUNK_SIZE
+
+    def __init__(self, source:Path, dest:Path, source_type:str, target_type:str, splitter:str=None, projection:Projection=None,
+                 infer_types:bool=False):
+        super().__init__(source, dest, source_type, target_type, splitter, projection, infer_types)
+        self.source = source
+        self.size = source.stat().st_size
+        del self.key['size'], self.key['mtime']
+        self.key['chunk_size'] = self.chunk_size
+        # [позиция в источнике, размер результата, число строк]
+        self.entries:list[list[int]] = []
+        self.digests:list[str] = []
+        self.tail:list = None
+        self.unchanged = 0
+
+    @staticmethod
+    def sidecar(dest:Path) -> Path:
+        return dest.with_name(f'.{dest.name}.manifest')
+
+    @classmethod
+    def load(cls, source:Path, dest:Path, source_type:str, target_type:str, splitter:str=None, projection:Projection=None,
+             infer_types:bool=False) -> 'Manifest':
+        'Возвращает манифест с точкой продолжения внутри неизменившегося начала источника или пустой, если такой точки нет.'
+        manifest = cls(source, dest, source_type, target_type, splitter, projection, infer_types)
+        try:
+            data = orjson.loads(manifest.path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return manifest
+        if data.get('key') != manifest.key or not dest.exists():
+            # Точки старого манифеста относятся к результату, который будет перезаписан
+            manifest.remove()
+            return manifest
+        manifest.unchanged = manifest._unchanged_prefix(data['digests'], data.get('tail'))
+        output_size = dest.stat().st_size
+        entries = [entry for entry in data['entries'] if entry[0] <= manifest.unchanged and entry[1] <= output_size]
+        while entries and not manifest._record_boundary(entries[-1][0]):
+            entries.pop()
+        if not entries:
+            manifest.remove()
+            return manifest
+        manifest.entries = entries
+        manifest.input_offset, manifest.output_offset, manifest.rows = entries[-1]
+        manifest.headers = data.get('headers')
+        manifest.kinds = data.get('kinds')
+        # Хэши блоков после точки продолжения будут посчитаны заново по ходу конвертации
+        manifest.digests = data['digests'][:manifest.input_offset // manifest.chunk_size]
+        manifest._save()
+        return manifest
+
+    def _unchanged_prefix(self, digests:list[str], tail:list|None) -> int:
+        'Длина начала источника, которое совпадает с источником прошлой конвертации.'
+        with open(self.source, 'rb') as file:
+            for num, digest in enumerate(digests):
+                chunk = file.read(self.chunk_size)
+                if len(chunk) < self.chunk_size or xxh3_64_hexdigest(chunk) != digest:
+                    return num * self.chunk_size
+            prefix = len(digests) * self.chunk_size
+            if tail is not None:
+                length, digest = tail
+                chunk = file.read(length)
+                if len(chunk) == length and xxh3_64_hexdigest(chunk) == digest:
+                    prefix += length
+        return prefix
+
+    def _record_boundary(self, offset:int) -> bool:
+        '''Для csv и ndjson точка в конце прошлого источника годится, только если он заканчивался переводом строки:
+        иначе дописанные данные продолжают последнюю строку.'''
+        if offset == 0 or self.key['source_type'] not in ('csv', 'ndjson'):
+            return True
+        with open(self.source, 'rb') as file:
+            file.seek(offset - 1)
+            return file.read(1) == b'\n'
+
+    def _hash_until(self, offset:int, tail:bool=False):
+        'Досчитывает хэши целых блоков источника до `offset`, с `tail` — и последнего неполного блока.'
+        start = len(self.digests) * self.chunk_size
+        if start + self.chunk_size > offset and not tail:
+            return
+        with open(self.source, 'rb') as file:
+            file.seek(start)
+            while start + self.chunk_size <= offset:
+                self.digests.append(xxh3_64_hexdigest(file.read(self.chunk_size)))
+                start += self.chunk_size
+            if tail:
+                chunk = file.read(offset - start)
+                self.tail = [len(chunk), xxh3_64_hexdigest(chunk)] if chunk else None
+
+    def commit(self, state:ReadState, file:IO, force:bool=False) -> bool:
+        '''Добавляет точку соответствия, если источник продвинулся на `chunk_size` байт с прошлой точки или дочитан до конца.
+        Без `force` сохраняет манифест не чаще, чем раз в `interval` секунд. Возвращает `True`, если манифест сохранён
+        и его последняя точка совпадает с текущим концом результата.'''
+        if state.offset is None:
+            return False
+        last = self.entries[-1][0] if self.entries else 0
+        if state.offset - last >= self.chunk_size or state.offset >= self.size:
+            file.flush()
+            self.input_offset = state.offset
+            self.output_offset = file.tell()
+            self.rows = state.rows
+            self.headers = state.headers
+            self.kinds = state.kinds
+            if not self.entries or self.entries[-1][0] != state.offset:
+                self.entries.append([self.input_offset, self.output_offset, self.rows])
+        now = time.monotonic()
+        if not force and now - self.saved_at < self.interval:
+            return False
+        self._hash_until(self.input_offset)
+        self._save()
+        self.saved_at = now
+        return self.output_offset == file.tell()
+
+    def finish(self, state:ReadState, file:IO):
+        'Конвертация завершена: хэши досчитываются до конца источника, манифест сохраняется.'
+        self._hash_until(self.size, tail=True)
+        self._save()
+
+    def _save(self):
+        data = {
+            'key': self.key,
+            'entries': self.entries,
+            'digests': self.digests,
+            'tail': self.tail,
+            'headers': self.headers,
+            'kinds': self.kinds,
+        }
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_bytes(orjson.dumps(data))
+        os.replace(tmp, self.path)
@@ -0,0 +1,18 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import mmap
+import os
+
+@contextmanager
+def mapped(path:Path) -> Iterator[mmap.mmap|bytes]:
+    '''Отображает файл в память только для чтения.
+
+    Страницы файла подгружает и при нехватке памяти выгружает ОС, поэтому разбор идёт без копии
+    содержимого в памяти процесса. Для пустого файла отдаёт `b''`, т.к. пустой файл отобразить нельзя.'''
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
@@ -0,0 +1,193 @@
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+import threading
+import orjson
+from ._types import modes, table_row
+from ._csv import safe_cut, parse_block
+from ._generators import json_read_gen, ReadState
+from ._compression import compression_of, file_type
+from ._row_index import RowIndex, record_offsets, BLANK_LINES
+
+PREVIEW_INDEX_STEP = 1000
+PREVIEW_CHUNK_SIZE = 64 * 1024
+INDEXED_TYPES = ('csv', 'ndjson', 'json')
+
+class FilePreview():
+    '''Постраничный просмотр файла источника или результата без загрузки его целиком.
+
+    Для csv, json lines и json без сжатия строится разреженный индекс `RowIndex` с позицией каждой `step`-й
+    строки, если рядом с файлом не сохранён индекс, записанный при конвертации. Страница читается с ближайшей известной строки, т.е. не больше `step` строк до начала страницы.
+    Индекс строится в `build_index` одним проходом по файлу (для csv и json lines — только поиск границ строк,
+    без разбора значений). Страницы доступны и до конца построения: строки дальше построенной части читаются
+    от последней известной точки.
+
+    Остальные форматы читаются оптимизированным режимом последовательно. Последняя позиция чтения запоминается,
+    так что листание вперёд не перечитывает файл, а переход назад читает его с начала.'''
+    encoding = 'utf-8'
+    step = PREVIEW_INDEX_STEP
+
+    def __init__(self, path:Path, source_type:modes=None, splitter:str=None):
+        self.path = Path(path)
+        self.source_type = source_type or file_type(self.path)
+        self.splitter = splitter or ','
+        self.indexed = self.source_type in INDEXED_TYPES and not compression_of(self.path)
+        self.index = (RowIndex.load(self.path) if self.indexed else None) or RowIndex()
+        self.headers:list[str]|None = None
+        self.lock = threading.Lock()
+        self._cursor:tuple[int, Iterator[table_row]]|None = None
+        self._table = None
+
+    @property
+    def total(self) -> int|None:
+        'Число строк файла или `None`, пока файл не прочитан до конца.'
+        return self.index.total
+
+    def build_index(self):
+        'Индексирует файл до конца. Долгая операция, выполняется вне цикла событий.'
+        if not self.indexed or self.index.total is not None:
+            return
+        with open(self.path, 'rb') as file:
+            if self.source_type == 'json':
+                state = ReadState()
+                for _ in json_read_gen(file, batch_size=self.step, state=state):
+                    self.index.add(state.rows, state.offset)
+                self.index.total = state.rows
+                return
+            csv = self.source_type == 'csv'
+            # Последняя пара — число строк и конец файла
+            for row, offset in record_offsets(file, self.step, quoted=csv, skip=1 if csv else 0):
+                self.index.add(row, offset)
+            self.index.total = row
+
+    def page(self, start:int, count:int) -> list[table_row]:
+        'Строки `[start, start + count)`. Для строк за концом файла список короче `count`.'
+        with self.lock:
+            if not self.indexed:
+                return self._sequential_page(start, count)
+            rows = self.rows(start, start + count)
+            try:
+                return list(rows)
+            finally:
+                rows.close()
+
+    def rows(self, start:int, stop:int=None) -> Iterator[table_row]:
+        '''Строки `[start, stop)`, без `stop` — до конца файла. Чтение начинается с ближайшей известной строки индекса.
+        Файлы без индекса читаются с начала.'''
+        if not self.indexed:
+            table = self._open_table()
+            rows = (row for batch in table.batches for row in batch)
+            try:
+                yield from islice(rows, start, stop)
+            finally:
+                rows.close()
+                table.close()
+            return
+        if self.source_type == 'csv' and self.headers is None:
+            self.headers = self._csv_headers()
+        row, offset = self.index.locate(start)
+        rows = self._rows_from(row, offset)
+        try:
+            yield from islice(rows, start - row, None if stop is None else stop - row)
+        finally:
+            rows.close()
+
+    def _rows_from(self, row:int, offset:int) -> Iterator[table_row]:
+        'Строки файла, начиная со строки `row` в позиции `offset`.'
+        match self.source_type:
+            case 'csv':
+                return self._csv_rows(row, offset)
+            case 'ndjson':
+                return self._ndjson_rows(row, offset)
+            case 'json':
+                return self._json_rows(row, offset)
+
+    def _csv_headers(self) -> list[str]:
+        rows = self._csv_records(0)
+        try:
+            return next(rows, [])
+        finally:
+            rows.close()
+
+    def _csv_records(self, offset:int) -> Iterator[list[str]]:
+        'Записи csv с позиции `offset` блоками по `PREVIEW_CHUNK_SIZE` байт.'
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            tail = b''
+            while True:
+                chunk = file.read(PREVIEW_CHUNK_SIZE)
+                data = tail + chunk
+                cut = safe_cut(data) if chunk else len(data)
+                if cut:
+                    yield from parse_block(data[:cut].decode(self.encoding), self.splitter)
+                if not chunk:
+                    return
+                tail = data[cut:]
+
+    def _csv_rows(self, row:int, offset:int) -> Iterator[table_row]:
+        records = self._csv_records(offset)
+        if offset == 0:
+            next(records, None)
+        headers = self.headers
+        try:
+            for values in records:
+                row += 1
+                yield dict(zip(headers, values))
+        finally:
+            records.close()
+        self.index.total = row
+
+    def _ndjson_rows(self, row:int, offset:int) -> Iterator[table_row]:
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if line not in BLANK_LINES:
+                    row += 1
+                    yield orjson.loads(line)
+        self.index.total = row
+
+    def _json_rows(self, row:int, offset:int) -> Iterator[table_row]:
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            state = ReadState(offset, row)
+            for batch in json_read_gen(file, chunk_size=PREVIEW_CHUNK_SIZE, batch_size=self.step, state=state, resume=offset > 0):
+                yield from batch
+        self.index.total = state.rows
+
+    def _sequential_page(self, start:int, count:int) -> list[table_row]:
+        if self._cursor is None or self._cursor[0] > start:
+            self._close_table()
+            self._table = self._open_table()
+            self._cursor = (0, (row for batch in self._table.batches for row in batch))
+        position, rows = self._cursor
+        position += sum(1 for _ in islice(rows, start - position))
+        result = list(islice(rows, count))
+        position += len(result)
+        if len(result) < count:
+            self.index.total = position
+        self._cursor = (position, rows)
+        return result
+
+    def _open_table(self):
+        from .optimized_table import OptimizedTable
+        return OptimizedTable.read(self.path, self.source_type, self.splitter)
+
+    def _close_table(self):
+        if self._table is not None:
+            self._table.close()
+        self._table = None
+        self._cursor = None
+
+    def close(self):
+        with self.lock:
+            self._close_table()
+
+def read_rows(path:Path, start:int, stop:int=None, source_type:modes=None, splitter:str=None) -> list[table_row]:
+    '''Строки `[start, stop)` файла. Для csv, json и json lines с индексом строк, записанным при конвертации,
+    файл читается с ближайшей строки индекса, а не с начала.'''
+    preview = FilePreview(path, source_type, splitter)
+    rows = preview.rows(start, stop)
+    try:
+        return list(rows)
+    finally:
+        rows.close()
@@ -0,0 +1,206 @@
+from math import isfinite
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, Sequence
+import re
+
+OPERATORS = ('>=', '<=', '!=', '=', '>', '<', '~')
+_CONDITION = re.compile(r'\s*(.+?)\s*(>=|<=|!=|=|>|<|~)\s*(.*?)\s*')
+
+row_check = Callable[[Sequence], bool]
+row_pick = Callable[[Sequence], list]
+
+def _number(value) -> int|float|None:
+    '''Число из значения ячейки. Строка сначала разбирается как целое, чтобы большие целые не теряли точность
+    и суммы целых оставались целыми. Строки с `_`, бесконечности и nan числами не считаются.'''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return value if isfinite(value) else None
+    if not isinstance(value, str) or not value or '_' in value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if isfinite(number) else None
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+class Condition():
+    '''Одно условие отбора: `колонка оператор значение`.
+
+    Если значение условия и значение ячейки — числа (или строки с числами), они сравниваются как числа,
+    иначе как строки. Пустая ячейка считается пустой строкой. `~` — ячейка содержит значение без учёта регистра.'''
+    def __init__(self, column:str, op:str, value:str):
+        if op not in OPERATORS:
+            raise AttributeError(f'Неизвестный оператор {op}')
+        self.column = column
+        self.op = op
+        self.value = value
+        self.number = _number(value)
+        self.folded = value.casefold()
+
+    def __repr__(self):
+        return f'{self.column} {self.op} {self.value}'
+
+    def test(self, value) -> bool:
+        op = self.op
+        if op == '~':
+            return self.folded in _text(value).casefold()
+        number = _number(value) if self.number is not None else None
+        if number is not None:
+            left, right = number, self.number
+        else:
+            left, right = _text(value), self.value
+        match op:
+            case '=':
+                return left == right
+            case '!=':
+                return left != right
+            case '>':
+                return left > right
+            case '<':
+                return left < right
+            case '>=':
+                return left >= right
+            case '<=':
+                return left <= right
+
+def parse_where(where:str) -> list[Condition]:
+    'Разбирает условия, разделённые `;`. Значение можно взять в кавычки, чтобы сохранить пробелы по краям.'
+    conditions = []
+    for part in where.split(';'):
+        if not part.strip():
+            continue
+        match = _CONDITION.fullmatch(part)
+        if match is None:
+            raise AttributeError(f'Не удалось разобрать условие "{part.strip()}", ожидается "колонка оператор значение"')
+        column, op, value = match.groups()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        conditions.append(Condition(column, op, value))
+    return conditions
+
+def _picker(indexes:list[int]) -> row_pick:
+    'Выбирает значения по индексам. Короткие строки дополняются `None`, как при выравнивании по заголовку.'
+    width = max(indexes) + 1
+    getter = itemgetter(*indexes)
+    single = len(indexes) == 1
+    def pick(row:Sequence) -> list:
+        if len(row) < width:
+            row = list(row) + [None] * (width - len(row))
+        values = getter(row)
+        return [values] if single else list(values)
+    return pick
+
+def _index(headers:Sequence) -> dict:
+    'Номер колонки по имени. Первая из одноимённых колонок выигрывает.'
+    index = {}
+    for num, name in enumerate(headers):
+        index.setdefault(name, num)
+        index.setdefault('' if name is None else str(name), num)
+    return index
+
+class Projection():
+    '''Выбор колонок и отбор строк, которые применяются читателями до сборки строк-словарей.
+
+    `columns` — колонки результата в нужном порядке, пустой список — все колонки источника.
+    `where` — условия вида `колонка оператор значение`, разделённые `;`, строка попадает в результат,
+    если выполняются все условия. Операторы: `=`, `!=`, `>`, `<`, `>=`, `<=` и `~` (содержит).
+
+    Для источников с заголовком (csv, xlsx, startrek) неизвестная колонка — ошибка. В строках json
+    отсутствующий ключ считается пустым значением, т.к. разные объекты могут иметь разные ключи.'''
+    def __init__(self, columns:list[str]=None, where:str=None):
+        self.columns = list(dict.fromkeys(columns)) if columns else None
+        self.where = where.strip() if where else None
+        self.conditions = parse_where(self.where) if self.where else []
+
+    @classmethod
+    def create(cls, columns:list[str]=None, where:str=None) -> 'Projection|None':
+        'Возвращает `None`, если ни колонки, ни условие не заданы: тогда читатели работают без изменений.'
+        if not columns and not (where and where.strip()):
+            return None
+        return cls(columns, where)
+
+    @property
+    def key(self) -> list:
+        'Параметры в виде, пригодном для сравнения и сохранения в json.'
+        return [self.columns, self.where]
+
+    @property
+    def required(self) -> list[str]|None:
+        'Колонки, которые нужно прочитать: выбранные и участвующие в условии. `None` — все колонки.'
+        if self.columns is None:
+            return None
+        return list(dict.fromkeys(self.columns + [condition.column for condition in self.conditions]))
+
+    def names(self, headers:Sequence[str]) -> list[str]:
+        'Колонки результата для источника с заголовком `headers`. Нестроковые заголовки xlsx можно указывать текстом.'
+        known = set(_index(headers))
+        missing = [name for name in self.required or [condition.column for condition in self.conditions] if name not in known]
+        if missing:
+            raise AttributeError(f'Колонки не найдены в источнике: {", ".join(map(str, missing))}')
+        return list(self.columns or headers)
+
+    def compile(self, headers:Sequence[str]) -> tuple[list[str], row_pick|None, row_check|None]:
+        '''Для строк-списков с заголовком `headers` возвращает колонки результата, функцию выбора значений
+        и проверку условия. Функции равны `None`, если выбирать или проверять нечего.'''
+        names = self.names(headers)
+        index = _index(headers)
+        pick = _picker([index[name] for name in names]) if self.columns else None
+        check = None
+        if self.conditions:
+            tests = [(index[condition.column], condition.test) for condition in self.conditions]
+            def check(row:Sequence) -> bool:
+                width = len(row)
+                for num, test in tests:
+                    if not test(row[num] if num < width else None):
+                        return False
+                return True
+        return names, pick, check
+
+    def rows(self, headers:Sequence[str], rows:Iterable[Sequence]) -> tuple[list[str], Iterator[Sequence]]:
+        'Колонки результата и отобранные строки-списки.'
+        names, pick, check = self.compile(headers)
+        if check is not None:
+            rows = filter(check, rows)
+        if pick is not None:
+            rows = map(pick, rows)
+        return names, iter(rows)
+
+    def compile_dicts(self) -> tuple[Callable[[dict], dict]|None, Callable[[dict], bool]|None]:
+        'Функция выбора колонок и проверка условия для строк-словарей.'
+        pick = None
+        if self.columns:
+            columns = self.columns
+            def pick(row:dict) -> dict:
+                return {name: row.get(name) for name in columns}
+        check = None
+        if self.conditions:
+            tests = [(condition.column, condition.test) for condition in self.conditions]
+            def check(row:dict) -> bool:
+                for name, test in tests:
+                    if not test(row.get(name)):
+                        return False
+                return True
+        return pick, check
+
+    def dicts(self, rows:Iterable[dict]) -> Iterator[dict]:
+        'Отобранные строки-словари с выбранными колонками.'
+        pick, check = self.compile_dicts()
+        if check is not None:
+            rows = filter(check, rows)
+        if pick is not None:
+            rows = map(pick, rows)
+        return iter(rows)
@@ -0,0 +1,156 @@
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import BinaryIO, Iterator
+import os
+import sys
+import orjson
+from ._csv import safe_cut
+
+INDEX_BLOCK_SIZE = 4 * 1024 * 1024
+ROW_INDEX_STEP = 1000
+_SIDECAR_MAGIC = b'ROWINDEX1\n'
+
+BLANK_LINES = (b'', b'\n', b'\r\n')
+
+def record_offsets(file:BinaryIO, step:int, quoted:bool=False, skip:int=0, block_size:int=INDEX_BLOCK_SIZE) -> Iterator[tuple[int, int]]:
+    '''Номер и позиция начала каждой `step`-й строки текстового файла с записями, разделёнными переводом строки.
+    Последней отдаётся пара из числа строк и размера файла.
+
+    Файл читается с текущей позиции, она должна быть в начале записи. Пустые строки пропускаются, как при разборе
+    csv и json lines. С `quoted` перевод строки внутри кавычек не разделяет записи (csv). Первые `skip` записей,
+    например заголовок csv, в номера строк не входят. Блоки без нужной строки, пустых строк и кавычек
+    только пересчитываются через `bytes.count`.'''
+    record = -skip
+    position = file.tell()
+    tail = b''
+    while True:
+        chunk = file.read(block_size)
+        data = tail + chunk
+        if chunk:
+            cut = safe_cut(data) if quoted else data.rfind(b'\n') + 1
+            if cut == 0:
+                tail = data
+                continue
+        else:
+            cut = len(data)
+        region, tail = data[:cut], data[cut:]
+        lines = region.count(b'\n') + (not region.endswith(b'\n') and bool(region))
+        plain = (b'\n\n' not in region and b'\n\r\n' not in region and region[:region.find(b'\n') + 1] not in BLANK_LINES
+                 and not (quoted and b'"' in region))
+        # Ближайший номер строки, кратный `step`, не меньше текущего
+        next_mark = max(step, -(-record // step) * step)
+        if plain and record + lines <= next_mark:
+            record += lines
+        else:
+            pos = 0
+            size = len(region)
+            while pos < size:
+                end = region.find(b'\n', pos)
+                end = size if end == -1 else end + 1
+                if quoted:
+                    quotes = region.count(b'"', pos, end)
+                    while quotes % 2 and end < size:
+                        following = region.find(b'\n', end)
+                        following = size if following == -1 else following + 1
+                        quotes += region.count(b'"', end, following)
+                        end = following
+                if region[pos:end] not in BLANK_LINES:
+                    if record > 0 and record % step == 0:
+                        yield record, position + pos
+                    record += 1
+                pos = end
+        position += len(region)
+        if not chunk:
+            break
+    yield max(record, 0), position
+
+class RowIndex():
+    '''Разреженный индекс строк файла: для части строк хранится номер строки и позиция её начала в байтах.
+    Номера и позиции лежат в двух `array('Q')`, 16 байт на точку. Строка 0 всегда начинается с начала файла
+    и в индексе не хранится, `total` — число строк, если файл проиндексирован до конца.
+
+    Позиция строки — место сразу после предыдущей строки: для csv и json lines это начало строки, для json —
+    позиция после `}` предыдущего объекта, с которой `json_read_gen` продолжает чтение с `resume=True`.
+
+    Индекс с точкой на каждой `step`-й строке записывается рядом с файлом в `.<имя файла>.rowindex`:
+    заголовок в json и позиции подряд по 8 байт, номера строк при загрузке восстанавливаются по шагу.'''
+    def __init__(self, step:int=None):
+        self.step = step
+        self.rows = array('Q')
+        self.offsets = array('Q')
+        self.total:int|None = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row:int, offset:int):
+        'Точки добавляются по возрастанию номера строки, уже известные пропускаются.'
+        if row and (not self.rows or row > self.rows[-1]):
+            # Позиция добавляется первой: `locate` из другого потока не увидит номер без позиции
+            self.offsets.append(offset)
+            self.rows.append(row)
+
+    def locate(self, row:int) -> tuple[int, int]:
+        'Ближайшая известная строка не дальше `row` и позиция её начала.'
+        num = bisect_right(self.rows, row) - 1
+        if num < 0:
+            return 0, 0
+        return self.rows[num], self.offsets[num]
+
+    def truncate(self, rows:int):
+        'Оставляет точки первых `rows` строк, например перед дописыванием файла с этой строки.'
+        num = bisect_right(self.rows, rows)
+        del self.rows[num:]
+        del self.offsets[num:]
+        self.total = None
+
+    @staticmethod
+    def sidecar(path:Path) -> Path:
+        return path.with_name(f'.{path.name}.rowindex')
+
+    def save(self, path:Path, source_type:str):
+        'Записывает индекс файла `path`. Размер и время изменения файла сохраняются, чтобы не загрузить устаревший индекс.'
+        if self.step is None or self.rows != array('Q', range(self.step, self.step * (len(self.rows) + 1), self.step)):
+            raise AttributeError('Сохранить можно только индекс с точкой на каждой step-й строке')
+        stat = path.stat()
+        header = {'step': self.step, 'total': self.total, 'type': source_type, 'size': stat.st_size,
+                  'mtime': stat.st_mtime_ns, 'byteorder': sys.byteorder}
+        sidecar = self.sidecar(path)
+        tmp = sidecar.with_name(sidecar.name + '.tmp')
+        with open(tmp, 'wb') as file:
+            file.write(_SIDECAR_MAGIC)
+            file.write(orjson.dumps(header, option=orjson.OPT_APPEND_NEWLINE))
+            self.offsets.tofile(file)
+        os.replace(tmp, sidecar)
+
+    @classmethod
+    def load(cls, path:Path, check:bool=True, size:int=None) -> 'RowIndex|None':
+        '''Индекс файла `path` или `None`, если индекс не записан. С `check` индекс, записанный для другой
+        версии файла (не совпадают размер или время изменения), не загружается. С `size` проверяется только,
+        что индекс записан при таком размере файла: так берётся индекс части файла, которая дописывается с этого места.'''
+        try:
+            with open(cls.sidecar(path), 'rb') as file:
+                if file.readline() != _SIDECAR_MAGIC:
+                    return None
+                header = orjson.loads(file.readline())
+                data = file.read()
+            stat = path.stat()
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if size is not None:
+            if header.get('size') != size:
+                return None
+        elif check and (header.get('size') != stat.st_size or header.get('mtime') != stat.st_mtime_ns):
+            return None
+        index = cls(header['step'])
+        index.offsets.frombytes(data[:len(data) - len(data) % index.offsets.itemsize])
+        if header.get('byteorder') != sys.byteorder:
+            index.offsets.byteswap()
+        index.rows = array('Q', range(index.step, index.step * (len(index.offsets) + 1), index.step))
+        index.total = header.get('total')
+        return index
+
+    @classmethod
+    def remove(cls, path:Path):
+        cls.sidecar(path).unlink(missing_ok=True)
@@ -0,0 +1,103 @@
+from datetime import date, datetime
+from typing import Iterable, Sequence, Callable
+from math import isfinite
+import re
+
+SAMPLE_SIZE = 1000
+
+def _parse_float(value:str) -> float:
+    'Показатель степени не ограничен шаблоном, поэтому `1e400` даёт бесконечность: такое значение не считается числом.'
+    number = float(value)
+    if not isfinite(number):
+        raise ValueError(f'Число вне диапазона float: {value}')
+    return number
+
+def _parse_bool(value:str) -> bool:
+    return value.lower() == 'true'
+
+# Порядок важен: колонка получает первый тип, под который подходят все непустые значения выборки.
+# В int не попадают числа с ведущими нулями (артикулы, телефоны) и больше 18 знаков (не помещаются в int64).
+_KINDS:dict[str, tuple[re.Pattern, Callable[[str], object]]] = {
+    'int': (re.compile(r'-?(?:0|[1-9]\d{0,17})'), int),
+    'float': (re.compile(r'-?(?:0|[1-9]\d{0,17})(?:\.\d+)?(?:[eE][-+]?\d+)?'), _parse_float),
+    'bool': (re.compile(r'(?i:true|false)'), _parse_bool),
+    'date': (re.compile(r'\d{4}-\d{2}-\d{2}'), date.fromisoformat),
+    'datetime': (re.compile(r'\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?'), datetime.fromisoformat),
+}
+
+def infer_kind(values:Iterable) -> str:
+    '''Тип колонки по выборке строковых значений: `null`, если непустых значений нет,
+    один из `_KINDS` или `string`, если значения не подходят ни под один тип.'''
+    values = [value for value in values if value is not None and value != '']
+    if not values:
+        return 'null'
+    if not all(isinstance(value, str) for value in values):
+        return 'string'
+    for kind, (pattern, parse) in _KINDS.items():
+        if all(map(pattern.fullmatch, values)):
+            try:
+                list(map(parse, values))
+            except ValueError:
+                continue
+            return kind
+    return 'string'
+
+def _safe_parse(value, pattern:re.Pattern, parse:Callable[[str], object]):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or not pattern.fullmatch(value):
+        return value
+    try:
+        return parse(value)
+    except ValueError:
+        return value
+
+class Schema():
+    '''Типы колонок, определённые по первым строкам источника.
+
+    Значения, которые не подходят под тип колонки, остаются строками, пустые строки в типизированных
+    колонках становятся `None`. Колонки типа `string` не изменяются.'''
+    def __init__(self, kinds:list[str]):
+        self.kinds = kinds
+
+    @classmethod
+    def infer(cls, columns:Sequence[Sequence], sample_size:int=SAMPLE_SIZE) -> 'Schema':
+        'Определяет типы по первым `sample_size` значениям каждой колонки.'
+        return cls([infer_kind(column[:sample_size]) for column in columns])
+
+    @classmethod
+    def infer_rows(cls, rows:Sequence[Sequence], width:int, sample_size:int=SAMPLE_SIZE) -> 'Schema':
+        'Определяет типы по первым `sample_size` строкам-спискам.'
+        sample = [row for row in rows[:sample_size] if len(row) == width]
+        columns = list(zip(*sample)) if sample else [()] * width
+        return cls([infer_kind(column) for column in columns])
+
+    @property
+    def typed(self) -> bool:
+        return any(kind != 'string' for kind in self.kinds)
+
+    def convert(self, index:int, values:Sequence) -> list:
+        'Приводит значения колонки `index` к её типу.'
+        kind = self.kinds[index] if index < len(self.kinds) else 'string'
+        if kind == 'string':
+            return values if isinstance(values, list) else list(values)
+        if kind == 'null':
+            return [None if value == '' else value for value in values]
+        pattern, parse = _KINDS[kind]
+        try:
+            if all(map(pattern.fullmatch, values)):
+                return list(map(parse, values))
+        except (ValueError, TypeError):
+            pass
+        return [_safe_parse(value, pattern, parse) for value in values]
+
+    def convert_columns(self, columns:list[Sequence]) -> list[list]:
+        return [self.convert(index, column) for index, column in enumerate(columns)]
+
+    def convert_rows(self, rows:list[list], width:int) -> list[tuple]:
+        'Приводит пачку строк-списков к типам колонок. Строки выравниваются до `width` значений.'
+        if not rows:
+            return []
+        if any(len(row) != width for row in rows):
+            rows = [(list(row) + [None] * width)[:width] for row in rows]
+        return list(zip(*self.convert_columns(list(zip(*rows)))))
@@ -0,0 +1,118 @@
+from heapq import merge
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from ._types import table_row, table_batch
+from ._projection import _number, _text
+from ._spill import SpillStage, SpillFile, STAGE_MEMORY_ROWS, SPILL_BATCH_SIZE, SPILL_BUFFER_SIZE, check_columns
+
+SORT_MAX_RUNS = 64
+
+def _value_key(value) -> tuple:
+    'Пустые значения идут первыми, затем числа (и строки с числами) по значению, затем остальное как текст.'
+    if value is None or value == '':
+        return (0, 0, '')
+    number = _number(value)
+    if number is not None and number == number:
+        return (1, number, '')
+    return (2, 0, _text(value))
+
+def sort_key(columns:list[str]) -> Callable[[table_row], tuple]:
+    if len(columns) == 1:
+        column = columns[0]
+        return lambda row: _value_key(row.get(column))
+    return lambda row: tuple([_value_key(row.get(column)) for column in columns])
+
+class ExternalSort(SpillStage):
+    '''Сортировка потока строк по колонкам `columns`, с `descending` — по убыванию. Сортировка устойчива:
+    строки с равным ключом остаются в порядке источника.
+
+    Строки копятся в памяти до `memory_rows`, сортируются и сбрасываются на диск отрезком: пачками pickle через
+    буфер в `SPILL_BUFFER_SIZE` байт (см. `SpillFile`). Отрезки сливаются `heapq.merge`, из каждого в памяти
+    только текущая пачка. Пачки отрезка такого размера, чтобы пачки всех сливаемых отрезков вместе занимали
+    не больше `memory_rows` строк. Если отрезков больше `SORT_MAX_RUNS`, они сначала сливаются группами
+    в более длинные отрезки. Если все строки поместились в память, на диск ничего не пишется.'''
+    max_runs = SORT_MAX_RUNS
+
+    def __init__(self, columns:list[str], descending:bool=False, memory_rows:int=STAGE_MEMORY_ROWS, directory:Path=None,
+                 batch_size:int=SPILL_BATCH_SIZE):
+        super().__init__(memory_rows, directory)
+        self.columns = list(columns)
+        self.descending = descending
+        self.batch_size = batch_size
+        self.key = sort_key(self.columns)
+        self.block_size = max(1, min(SPILL_BATCH_SIZE, memory_rows // self.max_runs))
+
+    def run(self, batches:Iterable[table_batch]) -> Iterator[table_batch]:
+        runs:list[SpillFile] = []
+        try:
+            rows = []
+            checked = False
+            for batch in batches:
+                if not batch:
+                    continue
+                if not checked:
+                    check_columns(batch[0], self.columns)
+                    checked = True
+                rows.extend(batch)
+                if len(rows) >= self.memory_rows:
+                    runs.append(self._spill(rows))
+                    rows = []
+            rows.sort(key=self.key, reverse=self.descending)
+            if not runs:
+                yield from self._batches(rows)
+                return
+            if rows:
+                runs.append(self._spill(rows, sort=False))
+            del rows
+            while len(runs) > self.max_runs:
+                runs = [self._merge_runs(runs[start:start + self.max_runs]) for start in range(0, len(runs), self.max_runs)]
+            yield from self._batches(self._merged(runs))
+        finally:
+            for run in runs:
+                run.remove()
+            self.cleanup()
+
+    def _spill(self, rows:list[table_row], sort:bool=True) -> SpillFile:
+        'Сортирует строки и сбрасывает их на диск отрезком.'
+        if sort:
+            rows.sort(key=self.key, reverse=self.descending)
+        run = SpillFile(self.directory)
+        for start in range(0, len(rows), self.block_size):
+            run.write(rows[start:start + self.block_size])
+        run.close()
+        return run
+
+    def _merged(self, runs:list[SpillFile]) -> Iterator[table_row]:
+        buffering = max(64 * 1024, SPILL_BUFFER_SIZE // len(runs))
+        sources = [(row for batch in run.batches(buffering) for row in batch) for run in runs]
+        return merge(*sources, key=self.key, reverse=self.descending)
+
+    def _merge_runs(self, runs:list[SpillFile]) -> SpillFile:
+        'Сливает группу отрезков в один. Порядок групп сохраняется, поэтому сортировка остаётся устойчивой.'
+        merged = SpillFile(self.directory)
+        block = []
+        for row in self._merged(runs):
+            block.append(row)
+            if len(block) >= self.block_size:
+                merged.write(block)
+                block = []
+        if block:
+            merged.write(block)
+        merged.close()
+        for run in runs:
+            run.remove()
+        return merged
+
+    def _batches(self, rows:Iterable[table_row]) -> Iterator[table_batch]:
+        if isinstance(rows, list):
+            for start in range(0, len(rows), self.batch_size):
+                yield rows[start:start + self.batch_size]
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,119 @@
+from pathlib import Path
+from typing import Hashable, Iterator
+import os
+import pickle
+import tempfile
+
+STAGE_MEMORY_ROWS = 1_000_000
+SPILL_BUFFER_SIZE = 1024 * 1024
+SPILL_BATCH_SIZE = 10000
+SPILL_PARTITIONS = 16
+
+class SpillFile():
+    '''Временный файл с пачками значений. Пачка записывается одним `pickle.dump`, файл пишется и читается
+    через буфер в `SPILL_BUFFER_SIZE` байт. Файл создаётся при первой записи.'''
+    def __init__(self, directory:Path):
+        self.directory = directory
+        self.path:Path|None = None
+        self.file = None
+        self.rows = 0
+
+    def write(self, batch:list):
+        if self.file is None:
+            handle, path = tempfile.mkstemp(suffix='.spill', dir=self.directory)
+            self.path = Path(path)
+            self.file = os.fdopen(handle, 'wb', buffering=SPILL_BUFFER_SIZE)
+        pickle.dump(batch, self.file, pickle.HIGHEST_PROTOCOL)
+        self.rows += len(batch)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def batches(self, buffering:int=SPILL_BUFFER_SIZE) -> Iterator[list]:
+        'Записанные пачки по порядку. Запись после чтения невозможна.'
+        self.close()
+        if self.path is None:
+            return
+        with open(self.path, 'rb', buffering=buffering) as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+    def remove(self):
+        self.close()
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+class Partitions():
+    '''Значения, разложенные по хэшу ключа в `count` временных файлов (grace hash). `level` входит в хэш,
+    поэтому раздел, который снова не поместился в память, на следующем уровне делится по-другому.
+
+    В файл попадают пачки по `batch_size` значений, так что на раздел в памяти не больше одной пачки.'''
+    def __init__(self, directory:Path, level:int=0, count:int=SPILL_PARTITIONS, batch_size:int=SPILL_BATCH_SIZE):
+        self.level = level
+        self.batch_size = batch_size
+        self.files = [SpillFile(directory) for _ in range(count)]
+        self.buffers:list[list] = [[] for _ in range(count)]
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, key:Hashable, value):
+        num = hash((self.level, key)) % len(self.files)
+        buffer = self.buffers[num]
+        buffer.append(value)
+        if len(buffer) >= self.batch_size:
+            self.files[num].write(buffer)
+            self.buffers[num] = []
+
+    def close(self):
+        'Дописывает неполные пачки и закрывает файлы.'
+        for file, buffer in zip(self.files, self.buffers):
+            if buffer:
+                file.write(buffer)
+            file.close()
+        self.buffers = [[] for _ in self.files]
+
+    def batches(self, num:int) -> Iterator[list]:
+        return self.files[num].batches()
+
+    def values(self, num:int) -> Iterator:
+        for batch in self.files[num].batches():
+            yield from batch
+
+    def remove(self, num:int=None):
+        'Удаляет файл раздела `num` или все файлы.'
+        for file in self.files if num is None else (self.files[num],):
+            file.remove()
+
+def check_columns(row:dict, columns:list[str]):
+    'Колонки этапа проверяются по первой строке потока.'
+    missing = [column for column in columns if column not in row]
+    if missing:
+        raise AttributeError(f'Колонки не найдены в источнике: {", ".join(missing)}')
+
+def spill_directory(directory:Path=None) -> tempfile.TemporaryDirectory:
+    'Временная папка для сброса на диск, удаляется вместе с файлами после выхода из `with`.'
+    return tempfile.TemporaryDirectory(prefix='converter_', dir=directory)
+
+class SpillStage():
+    'Этап конвертации со сбросом на диск: временная папка создаётся при первом сбросе и удаляется в `cleanup`.'
+    def __init__(self, memory_rows:int=STAGE_MEMORY_ROWS, directory:Path=None):
+        self.memory_rows = memory_rows
+        self.spill_to = directory
+        self._tmp:tempfile.TemporaryDirectory|None = None
+
+    @property
+    def directory(self) -> Path:
+        if self._tmp is None:
+            self._tmp = spill_directory(self.spill_to)
+        return Path(self._tmp.name)
+
+    def cleanup(self):
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
@@ -0,0 +1,77 @@
+from typing import Iterable, Iterator, Any
+
+ST_CHUNK_SIZE = 1024 * 1024
+
+class StWildcards():
+    start_table:str = '#|'
+    end_table:str = '|#'
+    start_end_row:str = '||'
+    cell_splitter:str = '|'
+
+_OUTSIDE, _TABLE, _ROW = range(3)
+
+def _split_st_row(text:str) -> list[str]:
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    return [cell.strip() for cell in text.replace('\n', ' ').split(StWildcards.cell_splitter)]
+
+def iter_st_rows(chunks:Iterable[str]) -> Iterator[list[str]]:
+    '''Потоково разбирает таблицу в разметке startrek `#| || a | b || |#` и отдаёт её строки списками ячеек.
+
+    Текст обходится один раз: в буфере хранится только непрочитанный хвост блока и текущая незавершённая строка.
+    Разбирается первая таблица в тексте, текст до `#|` и после `|#` пропускается. Переводы строк внутри ячеек
+    заменяются пробелами, пробелы по краям ячеек отбрасываются.'''
+    buffer = ''
+    pos = 0
+    row_start = 0
+    state = _OUTSIDE
+    for chunk in chunks:
+        keep = row_start if state == _ROW else pos
+        buffer = buffer[keep:] + chunk
+        pos -= keep
+        row_start -= keep
+        while True:
+            if state == _OUTSIDE:
+                i = buffer.find(StWildcards.start_table, pos)
+                if i == -1:
+                    pos = max(pos, len(buffer) - 1)
+                    break
+                pos = i + 2
+                state = _TABLE
+            elif state == _TABLE:
+                i = buffer.find(StWildcards.cell_splitter, pos)
+                if i == -1:
+                    pos = len(buffer)
+                    break
+                if i + 1 == len(buffer):
+                    pos = i
+                    break
+                pos = i + 2
+                if buffer.startswith(StWildcards.start_end_row, i):
+                    row_start = pos
+                    state = _ROW
+                elif buffer.startswith(StWildcards.end_table, i):
+                    return
+                else:
+                    pos = i + 1
+            else:
+                i = buffer.find(StWildcards.start_end_row, pos)
+                if i == -1:
+                    pos = max(pos, len(buffer) - 1)
+                    break
+                yield _split_st_row(buffer[row_start:i])
+                pos = i + 2
+                state = _TABLE
+
+def _st_cell(value:Any) -> str:
+    if value is None:
+        return ''
+    value = str(value)
+    if '\n' in value:
+        value = value.replace('\r\n', ' ').replace('\n', ' ')
+    return value
+
+def format_st_row(values:Iterable[Any]) -> str:
+    'Строка таблицы startrek: `|| a | b ||`. `None` записывается пустой ячейкой.'
+    cells = f' {StWildcards.cell_splitter} '.join(map(_st_cell, values))
+    return f'{StWildcards.start_end_row} {cells} {StWildcards.start_end_row}\n'
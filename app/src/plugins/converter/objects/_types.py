@@ -1,7 +1,10 @@
 from typing import TypeAlias, Literal, Callable
+from array import array
 
-modes:TypeAlias = Literal['csv', 'xlsx', 'json', 'startrek']
+modes:TypeAlias = Literal['csv', 'xlsx', 'json', 'startrek', 'ndjson', 'parquet', 'feather']
 table_row:TypeAlias = dict[str, str|int|float|bool|list|dict|None]
+table_batch:TypeAlias = list[table_row]
+table_column:TypeAlias = list[str|int|float|bool|list|dict|None]|array
 progress_callback:TypeAlias = Callable[[int|float], None]
 raw_progress_callback:TypeAlias = Callable[[int|float, int|float], None]
 message_callback:TypeAlias = Callable[[str], None]
\ No newline at end of file
@@ -0,0 +1,548 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Any
+from datetime import datetime, date, time
+from xml.etree.ElementTree import Element, fromstring, iterparse
+from zipfile import ZipFile, ZIP_DEFLATED
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import from_excel, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+import math
+import os
+import pickle
+import posixpath
+import re
+import shutil
+import tempfile
+from ._projection import Projection, _index
+
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_CELL_LENGTH = 32767
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XLSX_BLOCK_SIZE = 1024 * 1024
+FRAGMENT_ROWS = 10000
+_WORKSHEET = re.compile(rb'<(?:([\w.-]+):)?worksheet\b[^>]*>')
+_SHEET_DATA = re.compile(rb'<(?:([\w.-]+):)?sheetData\b[^>]*?(/?)>')
+_COLUMN_DIGITS = '0123456789'
+_ESCAPES = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;',
+    **{chr(code): None for code in (*range(0, 9), 11, 12, *range(14, 32))},
+})
+_STYLE_DATETIME, _STYLE_DATE, _STYLE_TIME = 1, 2, 3
+_STYLES = (
+    f'{_XML_HEADER}<styleSheet xmlns="{_MAIN_NS}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+class XlsxWriter():
+    '''Потоковая запись xlsx с постоянным потреблением памяти.
+
+    Строки сразу сериализуются в xml листа внутри zip, строки таблицы пишутся как inline-строки без
+    общей таблицы строк. Числа, bool и даты сохраняют свой тип. При достижении лимита строк Excel
+    открывается новый лист `Data_N` с тем же заголовком.'''
+    sheet_prefix = 'Data'
+    flush_rows = 1000
+    compresslevel = 1
+
+    def __init__(self, dest:str|Path, headers:Iterable[Any]=None, max_rows:int=EXCEL_MAX_ROWS):
+        self.zip = ZipFile(dest, 'w', compression=ZIP_DEFLATED, compresslevel=self.compresslevel)
+        self.headers = list(headers) if headers is not None else None
+        self.max_rows = max_rows
+        self.sheets = 0
+        self.sheet = None
+        self.row_num = 0
+        self.pending:list[str] = []
+        self.letters:list[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _letter(self, index:int) -> str:
+        while len(self.letters) <= index:
+            self.letters.append(get_column_letter(len(self.letters) + 1))
+        return self.letters[index]
+
+    def _open_sheet(self):
+        self._close_sheet()
+        self.sheets += 1
+        self.sheet = self.zip.open(f'xl/worksheets/sheet{self.sheets}.xml', 'w', force_zip64=True)
+        self.sheet.write(f'{_XML_HEADER}<worksheet xmlns="{_MAIN_NS}"><sheetData>'.encode())
+        self.row_num = 0
+        if self.headers is not None:
+            self._write_row(self.headers)
+
+    def _close_sheet(self):
+        if self.sheet is None:
+            return
+        self._flush()
+        self.sheet.write(b'</sheetData></worksheet>')
+        self.sheet.close()
+        self.sheet = None
+
+    def _flush(self):
+        if self.pending:
+            self.sheet.write(''.join(self.pending).encode('utf-8'))
+            self.pending = []
+
+    def _cell(self, ref:str, value) -> str:
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)) and not (isinstance(value, float) and not math.isfinite(value)):
+            return f'<c r="{ref}"><v>{value!r}</v></c>'
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.replace(tzinfo=None)
+            return f'<c r="{ref}" s="{_STYLE_DATETIME}"><v>{(value - _EXCEL_EPOCH).total_seconds() / 86400!r}</v></c>'
+        if isinstance(value, date):
+            return f'<c r="{ref}" s="{_STYLE_DATE}"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+        if isinstance(value, time):
+            seconds = value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+            return f'<c r="{ref}" s="{_STYLE_TIME}"><v>{seconds / 86400!r}</v></c>'
+        if not isinstance(value, str):
+            value = str(value)
+        value = value[:EXCEL_MAX_CELL_LENGTH].translate(_ESCAPES)
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>'
+
+    def _write_row(self, values:Iterable[Any]):
+        self.row_num += 1
+        num = self.row_num
+        cells = ''.join([self._cell(f'{self._letter(i)}{num}', value) for i, value in enumerate(values)])
+        self.pending.append(f'<row r="{num}">{cells}</row>')
+        if len(self.pending) >= self.flush_rows:
+            self._flush()
+
+    def append(self, values:Iterable[Any]):
+        if self.sheet is None or self.row_num >= self.max_rows:
+            self._open_sheet()
+        self._write_row(values)
+
+    def append_rows(self, rows:Iterable[Iterable[Any]]):
+        for values in rows:
+            self.append(values)
+
+    def close(self):
+        if self.zip is None:
+            return
+        if self.sheet is None and self.sheets == 0:
+            self._open_sheet()
+        self._close_sheet()
+        sheets = range(1, self.sheets + 1)
+        self.zip.writestr('[Content_Types].xml', (
+            f'{_XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{num}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' for num in sheets)
+            + '</Types>'))
+        self.zip.writestr('_rels/.rels', (
+            f'{_XML_HEADER}<Relationships xmlns="{_PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        self.zip.writestr('xl/workbook.xml', (
+            f'{_XML_HEADER}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>'
+            + ''.join(f'<sheet name="{self.sheet_prefix}_{num}" sheetId="{num}" r:id="rId{num}"/>' for num in sheets)
+            + '</sheets></workbook>'))
+        self.zip.writestr('xl/_rels/workbook.xml.rels', (
+            f'{_XML_HEADER}<Relationships xmlns="{_PKG_REL_NS}">'
+            + ''.join(f'<Relationship Id="rId{num}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{num}.xml"/>' for num in sheets)
+            + f'<Relationship Id="rId{self.sheets + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+            '</Relationships>'))
+        self.zip.writestr('xl/styles.xml', _STYLES)
+        self.zip.close()
+        self.zip = None
+
+def _sheet_blocks(stream:IO[bytes], block_size:int=XLSX_BLOCK_SIZE) -> Iterator[Element]:
+    '''Разбирает xml листа блоками из целых строк `<row>`. Каждый блок оборачивается в корневой элемент листа
+    со всеми объявлениями пространств имён и разбирается одним вызовом expat, без событий на каждую ячейку.'''
+    data = b''
+    while (match := _SHEET_DATA.search(data)) is None:
+        chunk = stream.read(block_size)
+        if not chunk:
+            return
+        data += chunk
+    root = _WORKSHEET.search(data, 0, match.start())
+    if root is None or match.group(2):
+        return
+    opening = root.group(0)
+    closing = b'</' + (root.group(1) + b':' if root.group(1) else b'') + b'worksheet>'
+    prefix = match.group(1) + b':' if match.group(1) else b''
+    row_end = b'</' + prefix + b'row>'
+    data_end = b'</' + prefix + b'sheetData>'
+    data = data[match.end():]
+    while True:
+        chunk = stream.read(block_size)
+        searched = max(0, len(data) - len(data_end))
+        data += chunk
+        end = data.find(data_end, searched)
+        if end >= 0 or not chunk:
+            if end < 0:
+                end = data.rfind(row_end) + len(row_end) if row_end in data else 0
+            if end:
+                yield fromstring(opening + data[:end] + closing)
+            return
+        cut = data.rfind(row_end)
+        if cut < 0:
+            # Строка длиннее блока
+            continue
+        cut += len(row_end)
+        yield fromstring(opening + data[:cut] + closing)
+        data = data[cut:]
+
+def _rich_text(node:Element, ns:str) -> str:
+    'Текст строки из `<si>` или `<is>`: простой `<t>` или части форматированного текста `<r><t>`. Фонетика `<rPh>` пропускается.'
+    text = node.find(f'{ns}t')
+    if text is not None:
+        return text.text or ''
+    return ''.join([run.findtext(f'{ns}t', '') for run in node.iterfind(f'{ns}r')])
+
+def _namespace(tag:str) -> str:
+    return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+
+class XlsxBook():
+    '''Чтение xlsx напрямую из xml внутри zip, без модели книги openpyxl. Значения совпадают с openpyxl
+    в режиме `data_only`: числа, строки, bool, даты по формату стиля ячейки, для формул — сохранённый результат.'''
+    block_size = XLSX_BLOCK_SIZE
+
+    def __init__(self, path:str|Path):
+        self.path = Path(path)
+        self.zip = ZipFile(self.path)
+        self.position = 0
+        self._strings:list[str] = []
+        self._shared:IO[bytes] = None
+        self._shared_nodes:Iterator = None
+        self._shared_ns:str = None
+        self._shared_done = False
+        try:
+            self.sheets = self._read_sheets()
+            self.epoch = self._read_epoch()
+            self.dates, self.timedeltas = self._read_styles()
+        except Exception:
+            self.zip.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._shared is not None:
+            self._shared.close()
+        self.zip.close()
+
+    def _member(self, name:str) -> Element|None:
+        try:
+            return fromstring(self.zip.read(name))
+        except KeyError:
+            return None
+
+    def _read_sheets(self) -> dict[str, str]:
+        'Имена листов в порядке книги и пути к их xml внутри zip. Листы диаграмм пропускаются.'
+        workbook = self._member('xl/workbook.xml')
+        rels = self._member('xl/_rels/workbook.xml.rels')
+        if workbook is None or rels is None:
+            raise AttributeError('Файл не является книгой xlsx')
+        targets = {}
+        for rel in rels:
+            if rel.get('Type', '').endswith('/worksheet'):
+                target = rel.get('Target', '')
+                target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+                targets[rel.get('Id')] = target
+        sheets = {}
+        ns = _namespace(workbook.tag)
+        for sheet in workbook.iterfind(f'{ns}sheets/{ns}sheet'):
+            rel_id = next((value for key, value in sheet.attrib.items() if key.endswith('}id')), None)
+            if rel_id in targets:
+                sheets[sheet.get('name')] = targets[rel_id]
+        return sheets
+
+    def _read_epoch(self) -> datetime:
+        workbook = self._member('xl/workbook.xml')
+        props = workbook.find(f'{_namespace(workbook.tag)}workbookPr')
+        if props is not None and props.get('date1904') in ('1', 'true'):
+            return CALENDAR_MAC_1904
+        return CALENDAR_WINDOWS_1900
+
+    def _read_styles(self) -> tuple[set[str], set[str]]:
+        'Номера стилей ячеек с форматом даты и с форматом длительности.'
+        dates, timedeltas = set(), set()
+        styles = self._member('xl/styles.xml')
+        if styles is None:
+            return dates, timedeltas
+        ns = _namespace(styles.tag)
+        formats = dict(BUILTIN_FORMATS)
+        for fmt in styles.iterfind(f'{ns}numFmts/{ns}numFmt'):
+            formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode', '')
+        for num, xf in enumerate(styles.iterfind(f'{ns}cellXfs/{ns}xf')):
+            code = formats.get(int(xf.get('numFmtId', 0)))
+            if code and is_date_format(code):
+                dates.add(str(num))
+                if is_timedelta_format(code):
+                    timedeltas.add(str(num))
+        return dates, timedeltas
+
+    @property
+    def strings(self) -> list[str]:
+        'Общая таблица строк целиком.'
+        return self._read_strings()
+
+    def _read_strings(self, count:int=None) -> list[str]:
+        '''Дочитывает общую таблицу строк потоково до `count` строк, без `count` — до конца. Таблица читается
+        по мере того, как листу нужны строки с большими номерами: для заголовка хватает её начала, а листы,
+        записанные конвертером, её не используют.'''
+        strings = self._strings
+        if self._shared_done or (count is not None and len(strings) >= count):
+            return strings
+        if self._shared is None:
+            try:
+                self._shared = self.zip.open('xl/sharedStrings.xml')
+            except KeyError:
+                self._shared_done = True
+                return strings
+            self._shared_nodes = iterparse(self._shared)
+        ns = self._shared_ns
+        for _, node in self._shared_nodes:
+            if ns is None:
+                ns = self._shared_ns = _namespace(node.tag)
+            if node.tag == f'{ns}si':
+                strings.append(_rich_text(node, ns))
+                node.clear()
+                if count is not None and len(strings) >= count:
+                    return strings
+        self._shared.close()
+        self._shared_done = True
+        return strings
+
+    def select(self, names:list[str]=None) -> list[str]:
+        'Пути к xml листов `names` в порядке книги. Без `names` — все листы.'
+        if not names:
+            return list(self.sheets.values())
+        missing = [name for name in names if name not in self.sheets]
+        if missing:
+            raise AttributeError(f'Листы не найдены в файле: {", ".join(missing)}')
+        return [member for name, member in self.sheets.items() if name in names]
+
+    def size(self, member:str) -> int:
+        return self.zip.getinfo(member).file_size
+
+    def rows(self, member:str, max_col:int=None) -> Iterator[list]:
+        '''Строки листа списками значений. Пропущенные в разметке строки отдаются пустыми списками, пустые ячейки
+        в конце строки не добавляются. С `max_col` ячейки правее не превращаются в значения.'''
+        strings = self._strings
+        dates, timedeltas, epoch = self.dates, self.timedeltas, self.epoch
+        columns = {}
+        last = 0
+        self.position = 0
+        with self.zip.open(member) as stream:
+            for block in _sheet_blocks(stream, self.block_size):
+                ns = _namespace(block.tag)
+                value_tag, inline_tag = f'{ns}v', f'{ns}is'
+                for row in block:
+                    num = row.get('r')
+                    num = int(num) if num else last + 1
+                    while last + 1 < num:
+                        last += 1
+                        yield []
+                    last = num
+                    values = []
+                    for cell in row:
+                        ref = cell.get('r')
+                        if ref is None:
+                            index = len(values)
+                        else:
+                            letters = ref.rstrip(_COLUMN_DIGITS)
+                            index = columns.get(letters)
+                            if index is None:
+                                index = columns[letters] = sum(
+                                    (ord(char) - 64) * 26 ** power for power, char in enumerate(reversed(letters))) - 1
+                        if max_col is not None and index >= max_col:
+                            break
+                        if index > len(values):
+                            values.extend([None] * (index - len(values)))
+                        kind = cell.get('t')
+                        if kind == 'inlineStr':
+                            node = cell.find(inline_tag)
+                            values.append(None if node is None else _rich_text(node, ns))
+                            continue
+                        text = cell.findtext(value_tag)
+                        if not text:
+                            value = None
+                        elif kind is None or kind == 'n':
+                            value = float(text) if '.' in text or 'E' in text or 'e' in text else int(text)
+                            style = cell.get('s')
+                            if style in dates:
+                                value = from_excel(value, epoch, timedelta=style in timedeltas)
+                        elif kind == 's':
+                            index = int(text)
+                            if index >= len(strings):
+                                self._read_strings(index + 1)
+                            value = strings[index]
+                        elif kind == 'b':
+                            value = text == '1' or text == 'true'
+                        elif kind == 'd':
+                            value = datetime.fromisoformat(text)
+                        else:
+                            # str — результат формулы, e — ошибка вида #N/A
+                            value = text
+                        values.append(value)
+                    yield values
+                self.position = stream.tell()
+        self.position = 0
+
+    def first_row(self, member:str) -> list|None:
+        rows = self.rows(member)
+        try:
+            return next(rows, None)
+        finally:
+            rows.close()
+            self.position = 0
+
+def _sheet_records(book:XlsxBook, member:str, headers:list, projection:Projection=None) -> Iterator[list]:
+    '''Строки данных листа в колонках общего заголовка `headers`: первая строка листа — его заголовок,
+    колонки сопоставляются по имени. Строки отбираются по `projection`.'''
+    width = len(headers)
+    index = _index(headers)
+    sheet_headers = book.first_row(member)
+    if sheet_headers is None:
+        return
+    positions = [index[name] for name in sheet_headers]
+    names, pick, check = projection.compile(headers) if projection is not None else (headers, None, None)
+    max_col = None
+    if projection is not None and projection.required is not None:
+        needed = {index[name] for name in projection.required}
+        max_col = max((num for num, position in enumerate(positions) if position in needed), default=-1) + 1
+    aligned = positions == list(range(len(positions)))
+    rows = book.rows(member, max_col)
+    next(rows, None)
+    for row in rows:
+        if aligned:
+            if len(row) < width:
+                row += [None] * (width - len(row))
+            elif len(row) > width:
+                del row[width:]
+        else:
+            values = [None] * width
+            for position, value in zip(positions, row):
+                values[position] = value
+            row = values
+        if check is not None and not check(row):
+            continue
+        yield row if pick is None else pick(row)
+
+def _read_sheet(path:Path, member:str, headers:list, projection:Projection, fragment:Path) -> int:
+    'Выполняется в дочернем процессе: разбирает один лист и пишет его строки во фрагмент пачками pickle.'
+    rows = 0
+    with XlsxBook(path) as book, open(fragment, 'wb') as file:
+        batch = []
+        for row in _sheet_records(book, member, headers, projection):
+            batch.append(row)
+            if len(batch) >= FRAGMENT_ROWS:
+                pickle.dump(batch, file, pickle.HIGHEST_PROTOCOL)
+                rows += len(batch)
+                batch = []
+        if batch:
+            pickle.dump(batch, file, pickle.HIGHEST_PROTOCOL)
+            rows += len(batch)
+    return rows
+
+def _fragment_rows(fragment:Path) -> Iterator[list]:
+    with open(fragment, 'rb') as file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            yield from batch
+
+def sheet_names(path:str|Path) -> list[str]:
+    with XlsxBook(path) as book:
+        return list(book.sheets)
+
+class XlsxReader():
+    '''Чтение нескольких листов xlsx как одной таблицы. Первая строка каждого листа — его заголовок, колонки
+    результата — объединение заголовков в порядке листов, так читаются и листы `Data_N`, на которые конвертер
+    делит большие таблицы.
+
+    Первый лист разбирается в текущем процессе и отдаётся сразу, остальные параллельно разбираются в `workers`
+    процессах во временные фрагменты и отдаются по порядку листов. `workers=1` — все листы по очереди в текущем процессе.'''
+    def __init__(self, path:str|Path, sheets:list[str]=None, projection:Projection=None, workers:int=None):
+        self.book = XlsxBook(path)
+        try:
+            self.members = self.book.select(sheets)
+            self.projection = projection
+            self.workers = workers or os.cpu_count() or 1
+            self.headers = []
+            self.filled = []
+            for member in self.members:
+                sheet_headers = self.book.first_row(member)
+                if sheet_headers is None:
+                    continue
+                self.filled.append(member)
+                known = set(self.headers)
+                self.headers.extend(name for name in dict.fromkeys(sheet_headers) if name not in known)
+            self.names = projection.names(self.headers) if projection is not None else self.headers
+        except Exception:
+            self.book.close()
+            raise
+        self.size = sum(self.book.size(member) for member in self.members)
+        self.done = 0
+
+    @property
+    def position(self) -> int:
+        'Сколько байт разметки листов уже прочитано, для прогресса.'
+        return self.done + self.book.position
+
+    def close(self):
+        self.book.close()
+
+    def rows(self) -> Iterator[list]:
+        'Строки данных всех листов в колонках `names`.'
+        members = self.filled
+        workers = min(self.workers, len(members) - 1)
+        pool = None
+        tmp = None
+        futures:list[tuple[Future, Path]] = []
+        try:
+            if workers > 0 and self.workers > 1:
+                tmp = Path(tempfile.mkdtemp(prefix='xlsx_'))
+                pool = ProcessPoolExecutor(max_workers=workers)
+                for num, member in enumerate(members[1:]):
+                    fragment = tmp / f'sheet{num}.part'
+                    futures.append((pool.submit(_read_sheet, self.book.path, member, self.headers, self.projection, fragment), fragment))
+            for num, member in enumerate(members):
+                if num and pool is not None:
+                    future, fragment = futures[num - 1]
+                    future.result()
+                    yield from _fragment_rows(fragment)
+                    fragment.unlink()
+                else:
+                    yield from _sheet_records(self.book, member, self.headers, self.projection)
+                self.done += self.book.size(member)
+            self.done = self.size
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
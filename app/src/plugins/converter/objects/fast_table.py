@@ -1,29 +1,129 @@
 from ._types import modes, table_row
 from pathlib import Path
-from typing import TextIO
-from openpyxl import Workbook, load_workbook
-from openpyxl.cell import Cell
+from typing import Iterable, Iterator
+from contextlib import closing
+from itertools import chain, compress
+from array import array
+from sys import intern
 import orjson
-from ._types import message_callback
-
-class StWildcards():
-    start_table:str = '#|'
-    end_table:str = '|#'
-    start_end_row:str = '||'
-    cell_splitter:str = '|'
+from ._types import message_callback, table_column
+from ._csv import iter_blocks, iter_buffer_blocks, parse_block, make_writer, format_rows
+from ._mmap import mapped
+from ._xlsx import XlsxWriter, XlsxReader
+from ._startrek import StWildcards, iter_st_rows, format_st_row, ST_CHUNK_SIZE
+from ._schema import Schema, SAMPLE_SIZE
+from ._arrow import ArrowWriter, read_arrow_columns
+from ._compression import open_source, open_target, compression_of, file_type
+from ._projection import Projection
 
 class FastTable():
+    '''Таблица, целиком загруженная в память.
+
+    Данные хранятся по колонкам: `columns[i]` содержит все значения колонки `cols[i]`.
+    Имена колонок интернируются и не повторяются в каждой строке, а колонки из одних int или float
+    после `compact()` хранятся в `array`.'''
     encoding = 'utf-8'
-    def __init__(self, cols:list[str], rows:list[table_row]):
-        self.cols = cols
-        self.rows = rows
+    batch_size = 65536
+
+    def __init__(self, cols:list[str], columns:list[table_column]):
+        self.cols = [intern(col) if isinstance(col, str) else col for col in cols]
+        self.columns = columns
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    @property
+    def rows(self) -> Iterator[table_row]:
+        'Строки таблицы в виде словарей. Словари создаются по одному при обходе.'
+        cols = self.cols
+        for values in zip(*self.columns):
+            yield dict(zip(cols, values))
+
+    def values(self) -> Iterator[tuple]:
+        'Строки таблицы в виде кортежей значений в порядке `cols`.'
+        return zip(*self.columns)
+
+    @classmethod
+    def from_rows(cls, cols:list[str], rows:Iterable[table_row]):
+        'Создаёт таблицу из словарей. Отсутствующие в строке ключи заполняются `None`.'
+        if not isinstance(rows, list):
+            rows = list(rows)
+        return cls(cols=cols, columns=[[row.get(col) for row in rows] for col in cols])
+
+    @classmethod
+    def from_lists(cls, cols:list[str], rows:Iterable[list]):
+        'Создаёт таблицу из строк-списков. Строки приводятся к числу колонок: лишние значения отбрасываются, недостающие заполняются `None`.'
+        width = len(cols)
+        columns:list[list] = [[] for _ in cols]
+        batch:list[list] = []
+        for row in rows:
+            if len(row) != width:
+                row = (list(row) + [None] * width)[:width]
+            batch.append(row)
+            if len(batch) >= cls.batch_size:
+                cls._extend_columns(columns, batch)
+                batch = []
+        cls._extend_columns(columns, batch)
+        return cls(cols=cols, columns=columns)
+
+    @staticmethod
+    def _extend_columns(columns:list[list], batch:list[list]):
+        if not batch:
+            return
+        for column, values in zip(columns, zip(*batch)):
+            column.extend(values)
+
+    def compact(self):
+        'Переводит колонки, состоящие только из int или только из float, в `array`.'
+        for i, column in enumerate(self.columns):
+            if isinstance(column, array) or not column:
+                continue
+            kinds = set(map(type, column))
+            if kinds == {int}:
+                typecode = 'q'
+            elif kinds == {float}:
+                typecode = 'd'
+            else:
+                continue
+            try:
+                self.columns[i] = array(typecode, column)
+            except OverflowError:
+                continue
+        return self
+
+    def project(self, projection:Projection|None):
+        'Оставляет строки, подходящие под условие `projection`, и выбранные колонки.'
+        if projection is None:
+            return self
+        names, pick, check = projection.compile(self.cols)
+        # Функция выбора значений строки по номерам колонок так же выбирает сами колонки
+        columns = self.columns if pick is None else pick(self.columns)
+        if check is not None:
+            mask = list(map(check, zip(*self.columns)))
+            columns = [array(column.typecode, compress(column, mask)) if isinstance(column, array) else list(compress(column, mask))
+                       for column in columns]
+        self.cols = names
+        self.columns = columns
+        return self
+
+    def infer_types(self, sample_size:int=SAMPLE_SIZE):
+        'Приводит колонки к типам, определённым по первым `sample_size` строкам, и сжимает числовые колонки.'
+        schema = Schema.infer(self.columns, sample_size)
+        if schema.typed:
+            self.columns = schema.convert_columns(self.columns)
+        return self.compact()
 
     @classmethod
-    def read(cls, data:list[table_row]|str|Path|list[str], source_type:modes=None, splitter:str=None, msg_cb:message_callback=None):
+    def read(cls, data:list[table_row]|str|Path|list[str], source_type:modes=None, splitter:str=None, msg_cb:message_callback=None, infer_types:bool=False,
+             columns:list[str]=None, where:str=None, sheets:list[str]=None):
+        '''Загружает источник целиком. `columns` и `where` (см. `Projection`) для csv, startrek и xlsx применяются
+        к строкам при чтении, для остальных форматов — к загруженным колонкам. `sheets` — листы xlsx, по умолчанию все.'''
         if isinstance(data, str) and Path(data).exists():
             data = Path(data)
         if source_type is None and isinstance(data, Path):
-            source_type = data.suffix[1:]
+            source_type = file_type(data)
         match source_type:
             case 'json':
                 constructor = cls.from_json
@@ -33,25 +133,77 @@ class FastTable():
                 constructor = cls.from_excel
             case 'startrek':
                 constructor = cls.from_startrek
+            case 'ndjson':
+                constructor = cls.from_ndjson
+            case 'parquet':
+                constructor = cls.from_parquet
+            case 'feather':
+                constructor = cls.from_feather
             case _:
                 raise AttributeError(f'Неизвестный источник {source_type}')
-        return constructor(data, splitter=splitter)
+        return constructor(data, splitter=splitter, infer_types=infer_types, projection=Projection.create(columns, where), sheets=sheets)
 
     @classmethod
-    def from_json(cls, data:str|Path, *args, **kwargs):
+    def from_json(cls, data:str|Path|list[table_row]|dict, projection:Projection=None, *args, **kwargs):
         'Создаёт экземпляр класса RawTable из json. `*args` и `**kwargs` для совместимости с другими конструкторами'
         if isinstance(data, str):
             data:list[table_row] = orjson.loads(data)
+        elif isinstance(data, Path) and compression_of(data):
+            with open_source(data) as file:
+                data:list[table_row] = orjson.loads(file.read())
         elif isinstance(data, Path):
-            file:TextIO = data.open('r', encoding=cls.encoding)
-            data = file.read()
-            data:list[table_row] = orjson.loads(data)
-            file.close()
-            if isinstance(data, dict):
-                return cls._dict_json_parse(data)
+            with mapped(data) as buffer, memoryview(buffer) as view:
+                data:list[table_row] = orjson.loads(view)
+        elif not isinstance(data, (list, dict)):
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        if isinstance(data, dict):
+            return cls._dict_json_parse(data).project(projection)
+        return cls._from_dicts(data, projection)
+
+    @classmethod
+    def _from_dicts(cls, rows:list[table_row], projection:Projection=None):
+        '''Колонки — объединение ключей всех строк в порядке появления, отсутствующие в строке ключи заполняются `None`.
+        Условие проверяется до раскладки строк по колонкам.'''
+        if not rows:
+            return cls(cols=[], columns=[])
+        cols = list(dict.fromkeys(chain.from_iterable(rows)))
+        if projection is not None:
+            cols = projection.columns or cols
+            _, check = projection.compile_dicts()
+            if check is not None:
+                rows = list(filter(check, rows))
+        return cls.from_rows(cols, rows).compact()
+
+    @classmethod
+    def from_ndjson(cls, data:str|Path|list[str], projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из json lines. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        if isinstance(data, str):
+            data = data.splitlines()
+        if isinstance(data, Path):
+            with open_source(data) as file:
+                rows = [orjson.loads(line) for line in file if line.strip()]
+        elif isinstance(data, list):
+            rows = [orjson.loads(line) for line in data if line.strip()]
         else:
             raise AttributeError(f'Неизвестный тип данных {type(data)}')
-        return cls(cols=list(data[0].keys()), rows=data)
+        return cls._from_dicts(rows, projection)
+
+    @classmethod
+    def from_parquet(cls, data:Path, projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из parquet. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        return cls._from_arrow(data, 'parquet', projection)
+
+    @classmethod
+    def from_feather(cls, data:Path, projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из feather (Arrow IPC). `*args` и `**kwargs` для совместимости с другими конструкторами'
+        return cls._from_arrow(data, 'feather', projection)
+
+    @classmethod
+    def _from_arrow(cls, data:Path, kind:str, projection:Projection=None):
+        if not isinstance(data, Path):
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        cols, columns = read_arrow_columns(data, kind, projection.required if projection is not None else None)
+        return cls(cols=cols, columns=columns).project(projection).compact()
 
     @classmethod
     def _dict_json_parse(cls, data:dict, *args, **kwargs):
@@ -61,115 +213,100 @@ class FastTable():
                 cols = []
                 for col in data['columns']:
                     cols.append(col['name'])
-                items:list[table_row] = []
-                for item in data['items']:
-                    item:dict[str, table_row]
-                    temp = {}
-                    for col in cols:
-                        temp[col] = item.get(col.lower())
-                    items.append(temp)
-                return cls(cols=cols, rows=items)
+                items:list[dict] = data['items']
+                columns = [[item.get(col.lower()) for item in items] for col in cols]
+                return cls(cols=cols, columns=columns).compact()
             except Exception:
                 raise AttributeError('Неизвестный формат входного json файла.')
         else:
             data = data[list(data.keys())[0]]
-            return cls(cols=list(data[0].keys()), rows=data)
+            return cls.from_rows(list(data[0].keys()), data).compact()
 
     @classmethod
-    def from_csv(cls, data:list[str]|str|Path, splitter:str=',', *args, **kwargs):
-        'Создаёт экземпляр класса RawTable из csv. `*args` и `**kwargs` для совместимости с другими конструкторами'
-        if isinstance(data, Path):
-            file:TextIO = data.open('r', encoding=cls.encoding)
-            data = file.readlines()
-            file.close()
-        elif isinstance(data, str):
-            data = data.split('\n')
-        cols = data.pop(0).replace('\n', '').split(splitter)
-        rows:list[table_row] = []
-        for row in data:
-            rows.append(dict(zip(cols, row.replace('\n', '').split(splitter))))
-        return cls(cols=cols, rows=rows)
-
-    @classmethod
-    def __from_st_table(cls, st:str):
-        step = 0
-        headers = []
-        rows = []
-        raw_rows = st.split(StWildcards.start_end_row)
-        while step < len(raw_rows):
-            row = raw_rows[step]
-            if StWildcards.cell_splitter in row:
-                cells = cls.__from_st_row(row)
-                if len(headers) == 0:
-                    headers = cells
-                else:
-                    rows.append(cells)
-                raw_rows.pop(step)
-            else:
-                raw_rows.pop(step)
-        return cls(cols=headers, rows=rows)
+    def from_csv(cls, data:list[str]|str|Path, splitter:str=',', infer_types:bool=False, projection:Projection=None, *args, **kwargs):
+        '''Создаёт экземпляр класса RawTable из csv. `*args` и `**kwargs` для совместимости с другими конструкторами.
+        С `infer_types` строковые значения приводятся к типам колонок.'''
+        if splitter is None:
+            splitter = ','
+        if isinstance(data, Path) and compression_of(data):
+            with open_source(data, 'r', encoding=cls.encoding, newline='') as file:
+                table = cls._from_csv_batches((parse_block(text, splitter) for text in iter_blocks(file)), projection)
+        elif isinstance(data, Path):
+            with mapped(data) as buffer, closing(iter_buffer_blocks(buffer, cls.encoding)) as blocks:
+                table = cls._from_csv_batches((parse_block(text, splitter) for text in blocks), projection)
+        else:
+            if isinstance(data, list):
+                data = '\n'.join(data)
+            table = cls._from_csv_batches([parse_block(data, splitter)], projection)
+        if infer_types:
+            table.infer_types()
+        return table
 
     @classmethod
-    def __cell_stripper(cls, cell:str):
-        return cell.strip()
+    def _from_csv_batches(cls, batches:Iterable[list[list[str]]], projection:Projection=None):
+        rows = (row for batch in batches for row in batch)
+        return cls._from_list_rows(rows, projection)
 
     @classmethod
-    def __from_st_row(cls, st:str) -> list[str]:
-        return list(map(cls.__cell_stripper, st.split(StWildcards.cell_splitter)))
+    def _from_list_rows(cls, rows:Iterator[list], projection:Projection=None):
+        'Первая строка — заголовок. С `projection` лишние значения отбрасываются до раскладки строк по колонкам.'
+        cols = next(rows, [])
+        if projection is not None and cols:
+            cols, rows = projection.rows(cols, rows)
+        return cls.from_lists(cols, rows)
 
     @classmethod
-    def from_startrek(cls, data:str, *args, **kwargs):
-        'Создает екземпляр класса RawTable из startrek. `*args` и `**kwargs` для совместимости с другими конструкторами'
-        data = data.replace('\n', ' ')
-        rows = data.split(StWildcards.start_table)
-        step = 0
-        while step < len(rows):
-            row = rows[step]
-            if StWildcards.start_end_row in row:
-                table = cls.__from_st_table(row)
-                rows.pop(step)
-            else:
-                rows.pop(step)
-        return table
+    def from_startrek(cls, data:str|Path|Iterable[str], infer_types:bool=False, projection:Projection=None, *args, **kwargs):
+        '''Создает екземпляр класса RawTable из startrek. `data` — текст, путь к файлу или блоки текста.
+        `*args` и `**kwargs` для совместимости с другими конструкторами'''
+        if isinstance(data, Path):
+            with open_source(data, 'r', encoding=cls.encoding) as file:
+                return cls.from_startrek(iter(lambda: file.read(ST_CHUNK_SIZE), ''), infer_types, projection)
+        if isinstance(data, str):
+            data = (data,)
+        table = cls._from_list_rows(iter_st_rows(data), projection)
+        if infer_types:
+            return table.infer_types()
+        return table.compact()
 
     @classmethod
-    def from_excel(cls, data:Path|str, *args, **kwargs):
-        'Создаёт екземпляр класса RawTable из excel. `*args` и `**kwargs` для совместимости с другими конструкторами'
+    def from_excel(cls, data:Path|str, infer_types:bool=False, projection:Projection=None, sheets:list[str]=None, *args, **kwargs):
+        '''Создаёт екземпляр класса RawTable из excel. `*args` и `**kwargs` для совместимости с другими конструкторами.
+        С `infer_types` типы приводятся только для текста, скопированного из excel: ячейки файла уже типизированы.
+        Листы файла (все или `sheets`) читаются как одна таблица, колонки и условие применяются при разборе листов.'''
         if isinstance(data, str):
-            data = cls._parse_excel_str(data)
+            rows = cls._parse_excel_str(data)
         elif isinstance(data, Path):
-            data = cls._parse_excel_file(data)
-        return cls(cols=list(data[0]), rows=data[1:])
-
-    @classmethod
-    def _parse_excel_file(cls, path: Path):
-        wb = load_workbook(str(path), data_only=True, keep_links=False)
-        ws = wb.active
-        iterator = ws.iter_rows()
-        cols = cls._unpack_excel_row(next(iterator))
-        rows:list[table_row] = []
-        for vals in iterator:
-            rows.append(dict(zip(cols, cls._unpack_excel_row(vals))))
-        return rows
+            rows = cls._parse_excel_file(data, sheets, projection)
+            infer_types = False
+            projection = None
+        else:
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        table = cls._from_list_rows(rows, projection)
+        if infer_types:
+            return table.infer_types()
+        return table.compact()
 
     @classmethod
-    def _unpack_excel_row(cls, cells: list[Cell]):
-        result = []
-        for cell in cells:
-            result.append(cell.value)
-        return result
+    def _parse_excel_file(cls, path: Path, sheets:list[str]=None, projection:Projection=None) -> Iterator[list]:
+        'Заголовок, затем строки данных листов. Листы после первого разбираются в отдельных процессах.'
+        reader = XlsxReader(path, sheets, projection)
+        try:
+            yield reader.names
+            yield from reader.rows()
+        finally:
+            reader.close()
 
     @classmethod
-    def _parse_excel_str(cls, data: str):
-        rows = data.split('\n')
-        result:list[table_row] = []
-        for row in rows:
-            result.append(row.split('\t'))
-        return result
+    def _parse_excel_str(cls, data: str) -> Iterator[list[str]]:
+        for row in data.split('\n'):
+            yield row.split('\t')
 
-    def save(self, dest: Path|None, result_type: modes=None, splitter: str=None, msg_cb: message_callback=None):
+    def save(self, dest: Path|None, result_type: modes=None, splitter: str=None, msg_cb: message_callback=None, compress_threads:int=0):
+        '''Записывает результат в `dest` или возвращает его текстом, если `dest` не указан. Если расширение `dest`
+        указывает на сжатие (`.gz`, `.zst` и т.д.), результат сжимается на лету, `compress_threads` — число потоков сжатия zstd.'''
         if result_type is None and isinstance(dest, Path):
-            result_type = dest.suffix[1:]
+            result_type = file_type(dest)
         match result_type:
             case 'csv':
                 saver = self.to_csv
@@ -179,65 +316,108 @@ class FastTable():
                 saver = self.to_excel
             case 'startrek':
                 saver = self.to_startrek
+            case 'ndjson':
+                saver = self.to_ndjson
+            case 'parquet':
+                saver = self.to_parquet
+            case 'feather':
+                saver = self.to_feather
             case _:
                 raise AttributeError(f'Неизвестный тип {result_type}')
-        return saver(dest, splitter=splitter)
+        return saver(dest, splitter=splitter, compress_threads=compress_threads)
 
     def json_dumps(self, obj):
         return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
 
+    def _json_chunks(self) -> Iterator[str]:
+        yield '[\n'
+        rows = self.rows
+        batch = []
+        first = True
+        for row in rows:
+            batch.append(self.json_dumps(row))
+            if len(batch) >= self.batch_size:
+                yield ('' if first else ',\n') + ',\n'.join(batch)
+                first = False
+                batch = []
+        if batch:
+            yield ('' if first else ',\n') + ',\n'.join(batch)
+        yield '\n]'
+
     def to_json(self, dest:Path = None, *args, **kwargs) -> str|None:
         if dest is None:
-            return self.json_dumps(self.rows)
-        with open(dest, 'w', encoding=self.encoding) as file:
-            file.write(self.json_dumps(self.rows))
+            return ''.join(self._json_chunks())
+        with open_target(dest, 'w', encoding=self.encoding, threads=kwargs.get('compress_threads', 0)) as file:
+            for chunk in self._json_chunks():
+                file.write(chunk)
 
-    def to_csv(self, dest:Path = None, splitter:str=',', *args, **kwargs) -> str|None:
-        result = []
-        result.append(splitter.join(self.cols))
+    def _ndjson_chunks(self) -> Iterator[bytes]:
+        batch = []
         for row in self.rows:
-            temp = list(map(str, row.values()))
-            result.append(splitter.join(temp))
-        result = '\n'.join(result)
+            batch.append(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+            if len(batch) >= self.batch_size:
+                yield b''.join(batch)
+                batch = []
+        yield b''.join(batch)
+
+    def to_ndjson(self, dest:Path = None, *args, **kwargs) -> str|None:
         if dest is None:
-            return result
-        else:
-            file:TextIO = dest.open('w', encoding=self.encoding)
-            file.writelines(result)
-            file.close()
+            return b''.join(self._ndjson_chunks()).decode('utf-8')
+        with open_target(dest, 'wb', threads=kwargs.get('compress_threads', 0)) as file:
+            for chunk in self._ndjson_chunks():
+                file.write(chunk)
 
-    @staticmethod
-    def _to_excel_cell_str(obj):
-        if obj is None:
-            return ''
-        else:
-            return str(obj)
+    def to_parquet(self, dest:Path, *args, **kwargs):
+        self._to_arrow(dest, 'parquet')
+
+    def to_feather(self, dest:Path, *args, **kwargs):
+        self._to_arrow(dest, 'feather')
+
+    def _to_arrow(self, dest:Path, kind:str):
+        if dest is None:
+            raise AttributeError(f'Формат {kind} можно сохранить только в файл')
+        with ArrowWriter(dest, kind, self.cols) as writer:
+            size = writer.row_group_size
+            for start in range(0, len(self), size):
+                writer.append_columns([column[start:start + size] for column in self.columns])
+
+    def to_csv(self, dest:Path = None, splitter:str=',', *args, **kwargs) -> str|None:
+        if splitter is None:
+            splitter = ','
+        if dest is None:
+            return format_rows(chain([self.cols], self.values()), splitter)
+        with open_target(dest, 'w', encoding=self.encoding, newline='', threads=kwargs.get('compress_threads', 0)) as file:
+            writer = make_writer(file, splitter)
+            writer.writerow(self.cols)
+            writer.writerows(self.values())
 
     def _to_string_excel(self):
         result = []
-        for row in self.rows:
-            result.append('\t'.join(list(map(self.__class__._to_excel_cell_str, row.values()))))
+        for values in self.values():
+            result.append('\t'.join('' if value is None else str(value) for value in values))
         return '\n'.join(result)
 
     def to_excel(self, dest:Path=None, *args, **kwargs):
         if dest is None:
             return self._to_string_excel()
-        wb = Workbook(True)
-        ws = wb.create_sheet('Data')
-        ws.append(list(self.cols))
-        for row in self.rows:
-            ws.append(list(map(self.__class__._to_excel_cell_str, row.values())))
-        wb.save(str(dest))
-
-    def to_startrek(self, *args, **kwargs):
-        result = [StWildcards.start_table]
-        result.append(StWildcards.start_end_row)
-        result.append(StWildcards.cell_splitter.join(self.cols))
-        result.append(StWildcards.start_end_row)
-        for row in self.rows:
-            result.append(StWildcards.start_end_row)
-            temp = list(map(str, row.values()))
-            result.append(StWildcards.cell_splitter.join(temp))
-            result.append(StWildcards.start_end_row)
-        result.append(StWildcards.end_table)
-        return '\n'.join(result)
\ No newline at end of file
+        with XlsxWriter(dest, self.cols) as writer:
+            writer.append_rows(self.values())
+
+    def _st_chunks(self) -> Iterator[str]:
+        yield f'{StWildcards.start_table}\n'
+        yield format_st_row(self.cols)
+        batch = []
+        for values in self.values():
+            batch.append(format_st_row(values))
+            if len(batch) >= self.batch_size:
+                yield ''.join(batch)
+                batch = []
+        yield ''.join(batch)
+        yield f'{StWildcards.end_table}\n'
+
+    def to_startrek(self, dest:Path = None, *args, **kwargs) -> str|None:
+        if dest is None:
+            return ''.join(self._st_chunks())
+        with open_target(dest, 'w', encoding=self.encoding, threads=kwargs.get('compress_threads', 0)) as file:
+            for chunk in self._st_chunks():
+                file.write(chunk)
@@ -1,28 +1,52 @@
-from typing import Generator, TextIO
+from typing import Callable, Generator, Iterator, TextIO, BinaryIO, IO
 from pathlib import Path
-from ._types import modes, table_row
-from openpyxl import load_workbook
-from openpyxl.cell import Cell
-from ._generators import csv_write_gen, json_write_gen, excel_write_gen, csv_read_gen, json_read_gen, excel_read_gen
+from ._types import modes, table_row, table_batch
+from ._generators import csv_write_gen, json_write_gen, excel_write_gen, st_write_gen, csv_read_gen, json_read_gen, excel_read_gen, st_read_gen, BATCH_SIZE, ReadState, \
+    ndjson_read_gen, ndjson_write_gen, arrow_read_gen, arrow_write_gen
+from ._checkpoint import Checkpoint, unfinished_removed
+from ._arrow import arrow_rows
+from ._xlsx import XlsxReader
+from ._csv import read_record, parse_block
+from ._compression import open_source, open_target, file_type, compression_of
+from ._cancel import CancelToken
+from ._projection import Projection
+from ._row_index import RowIndex, ROW_INDEX_STEP
+from ._join import Dedup, HashJoin
+from ._sort import ExternalSort
+from ._aggregate import GroupBy, Aggregate
+from ._spill import STAGE_MEMORY_ROWS
 from ._types import message_callback, raw_progress_callback
 from functools import partial
 
-class OptimizedRows(Generator):
-    def __next__(self) -> table_row:
+class OptimizedBatches(Generator):
+    def __next__(self) -> table_batch:
         return super().__next__()
 
 class OptimizedTable():
+    '''Потоковая конвертация: строки передаются от чтения к записи пачками по `batch_size`,
+    поэтому переключение генераторов и вызов прогресса происходят один раз на пачку.
+
+    Между пачками при записи проверяется `CancelToken` и сохраняется `Checkpoint`, если он передан в `read`.
+
+    `columns` и `where` в `read` применяются читателем источника (см. `Projection`): лишние колонки
+    и неподходящие строки отбрасываются до того, как попадут в пачку.
+
+    `unique`, `join`, `aggregate` и `sort` возвращают новую таблицу, пачки которой проходят через этап дедупликации,
+    соединения, группировки или сортировки.'''
     encoding = 'utf-8'
-    def __init__(self, rows:OptimizedRows, source_file:TextIO=None):
-        self.rows = rows
-        self.source_file:TextIO = None
+    def __init__(self, batches:OptimizedBatches, source_file:TextIO=None, state:ReadState=None, checkpoint:Checkpoint=None):
+        self.batches = batches
+        self.source_file:TextIO|BinaryIO = source_file
+        self.state = state
+        self.checkpoint = checkpoint
 
     @classmethod
-    def read(cls, data:Path, source_type:modes=None, splitter:str=None, msg_cb: message_callback=None, progress: raw_progress_callback=None):
+    def read(cls, data:Path, source_type:modes=None, splitter:str=None, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+             checkpoint:Checkpoint=None, infer_types:bool=False, columns:list[str]=None, where:str=None, sheets:list[str]=None):
         if isinstance(data, str) and Path(data).exists():
             data = Path(data)
         if source_type is None and isinstance(data, Path):
-            source_type = data.suffix[1:]
+            source_type = file_type(data)
         match source_type:
             case 'json':
                 constructor = cls.from_json
@@ -32,73 +56,145 @@ class OptimizedTable():
                 constructor = cls.from_excel
             case 'startrek':
                 constructor = cls.from_startrek
+            case 'ndjson':
+                constructor = cls.from_ndjson
+            case 'parquet':
+                constructor = cls.from_parquet
+            case 'feather':
+                constructor = cls.from_feather
             case _:
                 raise AttributeError(f'Неизвестный источник {source_type}')
-        return constructor(data, splitter=splitter, msg_cb=msg_cb, progress=progress)
+        return constructor(data, splitter=splitter, msg_cb=msg_cb, progress=progress, batch_size=batch_size, checkpoint=checkpoint, infer_types=infer_types,
+                           projection=Projection.create(columns, where), sheets=sheets)
 
     @classmethod
-    def from_json(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, *args, **kwargs):
+    def read_headers(cls, data:Path, source_type:modes=None, splitter:str=None, sheets:list[str]=None) -> list[str]:
+        '''Колонки источника по первой строке данных. Читается только начало файла: у csv — первая запись,
+        у xlsx — первые строки листов и начало общей таблицы строк.'''
+        source_type = source_type or file_type(data)
+        if source_type == 'xlsx':
+            reader = XlsxReader(data, sheets)
+            reader.close()
+            return [str(col) for col in reader.headers]
+        if source_type == 'csv':
+            with open_source(data, 'r', encoding=cls.encoding, newline='') as file:
+                record = read_record(file)
+                while record and not record.strip('\r\n'):
+                    record = read_record(file)
+            rows = parse_block(record, splitter or ',')
+            return [str(col) for col in rows[0]] if rows else []
+        table = cls.read(data, source_type, splitter, batch_size=1)
+        try:
+            batch = next(table.batches, [])
+        finally:
+            table.batches.close()
+            if table.source_file is not None:
+                table.source_file.close()
+        return [str(col) for col in batch[0].keys()] if batch else []
+
+    @classmethod
+    def from_json(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                  checkpoint:Checkpoint=None, projection:Projection=None, *args, **kwargs):
         'Создаёт экземпляр класса RawTable из json. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        state = None
         if isinstance(data, Path):
-            file:TextIO = data.open('r', encoding=cls.encoding)
+            file:BinaryIO = open_source(data, 'rb')
             if progress:
-                max_count = cls.count_lines(file)
-                progress = partial(progress, max_count)
-            data:OptimizedRows = json_read_gen(file, progress, msg_cb)
+                progress = partial(progress, data.stat().st_size)
+            if checkpoint is not None:
+                state = checkpoint.state()
+                file.seek(state.offset)
+            data:OptimizedBatches = json_read_gen(file, progress, msg_cb, batch_size=batch_size, state=state,
+                                                  resume=checkpoint is not None and checkpoint.resumable, projection=projection)
         else:
             raise AttributeError(f'Неизвестный тип данных {type(data)}')
-        return cls(rows=data, source_file=file)
+        return cls(batches=data, source_file=file, state=state, checkpoint=checkpoint)
 
     @classmethod
-    def from_csv(cls, data:Path, splitter:str=',', msg_cb: message_callback=None, progress: raw_progress_callback=None, *args, **kwargs):
-        'Создаёт экземпляр класса RawTable из csv. `*args` и `**kwargs` для совместимости с другими конструкторами'
+    def from_ndjson(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                    checkpoint:Checkpoint=None, projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из json lines. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        state = None
         if isinstance(data, Path):
-            file:TextIO = data.open('r', encoding=cls.encoding)
+            file:BinaryIO = open_source(data, 'rb')
             if progress:
-                max_count = cls.count_lines(file)
-                progress = partial(progress, max_count)
-            data = csv_read_gen(file, splitter, progress, msg_cb)
+                progress = partial(progress, data.stat().st_size)
+            if checkpoint is not None:
+                state = checkpoint.state()
+                file.seek(state.offset)
+            data = ndjson_read_gen(file, progress, msg_cb, batch_size=batch_size, state=state, projection=projection)
         else:
             raise AttributeError(f'Неизвестный тип данных {type(data)}')
-        return cls(rows=data, source_file=file)
+        return cls(batches=data, source_file=file, state=state, checkpoint=checkpoint)
 
     @classmethod
-    def from_excel(cls, data:Path|str, msg_cb: message_callback=None, progress: raw_progress_callback=None, *args, **kwargs):
-        'Создаёт екземпляр класса RawTable из excel. `*args` и `**kwargs` для совместимости с другими конструкторами'
-        if isinstance(data, str):
-            data = cls._parse_excel_str(data)
-        elif isinstance(data, Path):
-            max_count = cls.excel_counter(data)
-            progress = partial(progress, max_count)
-            data = excel_read_gen(data, progress, msg_cb)
-        return cls(rows=data)
+    def from_parquet(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                     projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из parquet. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        return cls._from_arrow(data, 'parquet', msg_cb, progress, batch_size, projection)
 
     @classmethod
-    def count_lines(cls, file:TextIO, chunk_size=8192):
-        result = sum(chunk.count('\n') for chunk in iter(lambda: file.read(chunk_size), ''))
-        file.seek(0)
-        return result
+    def from_feather(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                     projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из feather (Arrow IPC). `*args` и `**kwargs` для совместимости с другими конструкторами'
+        return cls._from_arrow(data, 'feather', msg_cb, progress, batch_size, projection)
 
     @classmethod
-    def excel_counter(cls, file:Path):
-        wb = load_workbook(str(file), data_only=True, keep_links=False)
-        result = 0
-        for ws in wb.worksheets:
-            result += ws.max_row
-        wb.close()
-        return result
+    def _from_arrow(cls, data:Path, kind:str, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                    projection:Projection=None):
+        if not isinstance(data, Path):
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        if progress:
+            progress = partial(progress, arrow_rows(data, kind))
+        return cls(batches=arrow_read_gen(data, kind, progress, msg_cb, batch_size, projection))
 
     @classmethod
-    def from_startrek(cls, data:list[table_row]|str|Path, *args, **kwargs):
-        'Создает екземпляр класса RawTable из startrek. `*args` и `**kwargs` для совместимости с другими конструкторами'
-        raise NotImplementedError('Появится в будущих обновлениях.')
+    def from_csv(cls, data:Path, splitter:str=',', msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                 checkpoint:Checkpoint=None, infer_types:bool=False, projection:Projection=None, *args, **kwargs):
+        'Создаёт экземпляр класса RawTable из csv. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        if splitter is None:
+            splitter = ','
+        state = None
+        if isinstance(data, Path):
+            file:TextIO = open_source(data, 'r', encoding=cls.encoding, newline='')
+            if progress:
+                progress = partial(progress, data.stat().st_size)
+            if checkpoint is not None:
+                state = checkpoint.state()
+                file.seek(state.offset)
+            data = csv_read_gen(file, splitter, progress, msg_cb, batch_size, state, infer_types, projection)
+        else:
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        return cls(batches=data, source_file=file, state=state, checkpoint=checkpoint)
 
     @classmethod
-    def _unpack_excel_row(cls, cells:list[Cell]):
-        result = []
-        for cell in cells:
-            result.append(cell.value)
-        return result
+    def from_excel(cls, data:Path|str, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                   projection:Projection=None, sheets:list[str]=None, *args, **kwargs):
+        '''Создаёт екземпляр класса RawTable из excel. `sheets` — листы, которые читаются как одна таблица, по умолчанию все.
+        `*args` и `**kwargs` для совместимости с другими конструкторами'''
+        if isinstance(data, str):
+            data = cls._parse_excel_str(data)
+        elif isinstance(data, Path):
+            reader = XlsxReader(data, sheets, projection)
+            if progress and reader.size:
+                progress = partial(progress, reader.size)
+            else:
+                progress = None
+            data = excel_read_gen(reader, progress, msg_cb, batch_size)
+        return cls(batches=data)
+
+    @classmethod
+    def from_startrek(cls, data:Path, msg_cb: message_callback=None, progress: raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                      infer_types:bool=False, projection:Projection=None, *args, **kwargs):
+        'Создает екземпляр класса RawTable из startrek. `*args` и `**kwargs` для совместимости с другими конструкторами'
+        if isinstance(data, Path):
+            file:TextIO = open_source(data, 'r', encoding=cls.encoding)
+            if progress:
+                progress = partial(progress, data.stat().st_size)
+            data = st_read_gen(file, progress, msg_cb, batch_size, infer_types, projection=projection)
+        else:
+            raise AttributeError(f'Неизвестный тип данных {type(data)}')
+        return cls(batches=data, source_file=file)
 
     @classmethod
     def _parse_excel_str(cls, data:str):
@@ -108,9 +204,52 @@ class OptimizedTable():
             result.append(row.split('\t'))
         return result
 
-    def save(self, dest:Path|None, result_type:modes=None, splitter:str=None, msg_cb: message_callback=None):
+    def unique(self, columns:list[str], memory_rows:int=STAGE_MEMORY_ROWS) -> 'OptimizedTable':
+        'Таблица без повторов по колонкам `columns`, см. `Dedup`.'
+        return self._stage(Dedup(columns, memory_rows).run(self.batches), self)
+
+    def join(self, other:'OptimizedTable', left_on:list[str], right_on:list[str]=None, how:str='inner',
+             memory_rows:int=STAGE_MEMORY_ROWS) -> 'OptimizedTable':
+        'Соединение со справочником `other` по ключевым колонкам, см. `HashJoin`.'
+        return self._stage(HashJoin(left_on, right_on, how, memory_rows).run(self.batches, other.batches), self, other)
+
+    def aggregate(self, columns:list[str], aggregates:list[Aggregate], memory_rows:int=STAGE_MEMORY_ROWS) -> 'OptimizedTable':
+        'Таблица со строкой на каждую группу по колонкам `columns` и значениями агрегатов, см. `GroupBy`.'
+        return self._stage(GroupBy(columns, aggregates, memory_rows).run(self.batches), self)
+
+    def sort(self, columns:list[str], descending:bool=False, memory_rows:int=STAGE_MEMORY_ROWS) -> 'OptimizedTable':
+        'Таблица, отсортированная по колонкам `columns`, см. `ExternalSort`.'
+        return self._stage(ExternalSort(columns, descending, memory_rows).run(self.batches), self)
+
+    @classmethod
+    def _stage(cls, batches:Iterator[table_batch], *tables:'OptimizedTable') -> 'OptimizedTable':
+        '''Таблица из пачек этапа. Строки этапа не соответствуют позициям в источнике, поэтому checkpoint не переносится.
+        Исходные таблицы закрываются, когда пачки этапа закончились или закрыты.'''
+        def staged():
+            try:
+                yield from batches
+            finally:
+                batches.close()
+                for table in tables:
+                    table.close()
+        return cls(batches=staged())
+
+    def close(self):
+        'Закрывает генератор пачек и файл источника.'
+        close = getattr(self.batches, 'close', None)
+        if close is not None:
+            close()
+        if self.source_file is not None:
+            self.source_file.close()
+
+    def save(self, dest:Path|None, result_type:modes=None, splitter:str=None, msg_cb: message_callback=None, token:CancelToken=None,
+             compress_threads:int=0, row_index:bool=False):
+        '''Записывает результат в `dest`. Если расширение `dest` указывает на сжатие (`.gz`, `.zst` и т.д.),
+        результат сжимается на лету, `compress_threads` — число потоков сжатия zstd.
+
+        С `row_index` для csv, json и json lines без сжатия рядом с результатом сохраняется индекс строк (см. `RowIndex`).'''
         if result_type is None and isinstance(dest, Path):
-            result_type = dest.suffix[1:]
+            result_type = file_type(dest)
         match result_type:
             case 'csv':
                 saver = self.to_csv
@@ -119,43 +258,116 @@ class OptimizedTable():
             case 'xlsx':
                 saver = self.to_excel
             case 'startrek':
-                raise NotImplementedError('Возможно появится в будущих обновлениях.')
+                saver = self.to_startrek
+            case 'ndjson':
+                saver = self.to_ndjson
+            case 'parquet':
+                saver = self.to_parquet
+            case 'feather':
+                saver = self.to_feather
             case _:
                 raise AttributeError(f'Неизвестный тип {result_type}')
-        return saver(dest, splitter=splitter, msg_cb=msg_cb)
+        try:
+            with unfinished_removed(dest, self.checkpoint):
+                return saver(dest, splitter=splitter, msg_cb=msg_cb, token=token, compress_threads=compress_threads, row_index=row_index)
+        finally:
+            self.close()
+
+    def _drain(self, gen:Generator, file:IO=None, token:CancelToken=None, committed:Callable[[], None]=None):
+        '''Прогоняет генератор записи. После каждой пачки сохраняет checkpoint и проверяет отмену.
+        `committed` вызывается после каждого сохранения checkpoint, например чтобы сохранить индекс записанной части.'''
+        checkpoint = self.checkpoint if file is not None else None
+        for _ in gen:
+            if checkpoint is not None:
+                if checkpoint.commit(self.state, file) and committed is not None:
+                    committed()
+            if token is not None and token.cancelled:
+                if checkpoint is not None:
+                    if checkpoint.commit(self.state, file, force=True) and committed is not None:
+                        committed()
+                token.check()
+        if checkpoint is not None:
+            checkpoint.finish(self.state, file)
+
+    def _open_dest(self, dest:Path, mode:str, threads:int=0, **kwargs) -> IO:
+        'Открывает файл результата. При продолжении по checkpoint файл обрезается до сохранённого размера.'
+        if self.checkpoint is None or not self.checkpoint.resumable:
+            return open_target(dest, mode, threads=threads, **kwargs)
+        file = dest.open(mode.replace('w', 'r+'), **kwargs)
+        file.truncate(self.checkpoint.output_offset)
+        file.seek(0, 2)
+        return file
+
+    def _written(self) -> int:
+        if self.checkpoint is None:
+            return 0
+        return self.checkpoint.rows
+
+    def _row_index(self, dest:Path, enabled:bool) -> RowIndex|None:
+        '''Индекс строк для записи в `dest`, вызывается до открытия файла. При продолжении записи берётся индекс
+        уже записанной части, сохранённый вместе с checkpoint (см. `_index_committed`), иначе индекс не пишется.
+        Индекс прерванной записи остаётся на диске, пока его не заменит индекс продолжения.'''
+        written = self._written()
+        index = None
+        if enabled and not compression_of(dest):
+            if not written:
+                index = RowIndex(ROW_INDEX_STEP)
+            else:
+                # Индекс части, записанной до отмены, или индекс всего файла от прошлой завершённой записи
+                index = RowIndex.load(dest, size=self.checkpoint.output_offset) or RowIndex.load(dest)
+                if index is not None:
+                    index.truncate(written)
+        if index is None or not written:
+            RowIndex.remove(dest)
+        return index
+
+    def _index_committed(self, index:RowIndex|None, dest:Path, result_type:str) -> Callable[[], None]|None:
+        '''Сохранение индекса после каждого сохранения checkpoint: индекс записан при размере файла из checkpoint,
+        поэтому после отмены или сбоя запись продолжается вместе с индексом.'''
+        if index is None or self.checkpoint is None:
+            return None
+        return partial(index.save, dest, result_type)
 
     def to_json(self, dest:Path, *args, **kwargs) -> str|None:
-        with dest.open('w', encoding=self.encoding) as file:
-            gen = json_write_gen(file, self.rows)
-            for _ in gen:
-                pass
+        index = self._row_index(dest, kwargs.get('row_index'))
+        with self._open_dest(dest, 'wb', kwargs.get('compress_threads', 0)) as file:
+            gen = json_write_gen(file, self.batches, written=self._written(), index=index)
+            self._drain(gen, file, kwargs.get('token'), self._index_committed(index, dest, 'json'))
+        if index is not None:
+            index.save(dest, 'json')
 
-    def to_csv(self, dest:Path = None, splitter:str=',', *args, **kwargs) -> str|None:
-        file:TextIO = dest.open('w', encoding=self.encoding)
-        gen = csv_write_gen(file, self.rows, splitter)
-        first_row = next(self.rows)
-        file.write(splitter.join(first_row.keys()) + '\n')
-        file.write(splitter.join(map(self._to_excel_cell_str, first_row.values())) + '\n')
-        for _ in gen:
-            pass
-        file.close()
+    def to_ndjson(self, dest:Path, *args, **kwargs) -> str|None:
+        index = self._row_index(dest, kwargs.get('row_index'))
+        with self._open_dest(dest, 'wb', kwargs.get('compress_threads', 0)) as file:
+            gen = ndjson_write_gen(file, self.batches, written=self._written(), index=index)
+            self._drain(gen, file, kwargs.get('token'), self._index_committed(index, dest, 'ndjson'))
+        if index is not None:
+            index.save(dest, 'ndjson')
 
-    @classmethod
-    def _to_excel_cell_str(cls, obj):
-        if obj is None:
-            return ''
-        else:
-            return str(obj)
+    def to_parquet(self, dest:Path, *args, **kwargs):
+        self._drain(arrow_write_gen(dest, 'parquet', self.batches), token=kwargs.get('token'))
+
+    def to_feather(self, dest:Path, *args, **kwargs):
+        self._drain(arrow_write_gen(dest, 'feather', self.batches), token=kwargs.get('token'))
+
+    def to_csv(self, dest:Path = None, splitter:str=',', *args, **kwargs) -> str|None:
+        if splitter is None:
+            splitter = ','
+        index = self._row_index(dest, kwargs.get('row_index'))
+        with self._open_dest(dest, 'w', kwargs.get('compress_threads', 0), encoding=self.encoding, newline='') as file:
+            gen = csv_write_gen(file, self.batches, splitter, written=self._written(), index=index)
+            self._drain(gen, file, kwargs.get('token'), self._index_committed(index, dest, 'csv'))
+        if index is not None:
+            index.save(dest, 'csv')
 
     def to_excel(self, dest:Path=None, *args, **kwargs):
-        gen = excel_write_gen(dest, self.rows)
+        gen = excel_write_gen(dest, self.batches, msg_cb=kwargs.get('msg_cb'))
         try:
-            for _ in gen:
-                pass
+            self._drain(gen, token=kwargs.get('token'))
         except StopIteration:
             return
-        except TypeError:
-            return
 
-    def to_startrek(self, *args, **kwargs):
-        raise NotImplementedError('Появится в будущих обновлениях.')
\ No newline at end of file
+    def to_startrek(self, dest:Path=None, *args, **kwargs):
+        with open_target(dest, 'w', encoding=self.encoding, threads=kwargs.get('compress_threads', 0)) as file:
+            gen = st_write_gen(file, self.batches)
+            self._drain(gen, token=kwargs.get('token'))
\ No newline at end of file
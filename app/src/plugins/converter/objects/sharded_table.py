@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterator
+import os
+import shutil
+import orjson
+from ._types import modes, message_callback, raw_progress_callback
+from ._csv import safe_cut, parse_block, read_record
+from ._cancel import CancelToken
+from ._schema import Schema
+from ._compression import open_target, compression_of, file_type
+from ._projection import Projection
+from ._row_index import RowIndex
+
+SHARD_BLOCK_SIZE = 16 * 1024 * 1024
+MIN_SHARD_SIZE = 8 * 1024 * 1024
+
+def _iter_text_blocks(path:Path, start:int, end:int, encoding:str, block_size:int=SHARD_BLOCK_SIZE) -> Iterator[str]:
+    'Читает диапазон байт `[start, end)` блоками из целых записей csv.'
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start
+        tail = b''
+        while remaining > 0:
+            block = file.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            block = tail + block
+            cut = len(block) if remaining <= 0 else safe_cut(block)
+            tail = block[cut:]
+            if cut:
+                yield block[:cut].decode(encoding)
+        if tail:
+            yield tail.decode(encoding)
+
+def _fragment_rows(headers:list[str], text:str, splitter:str, schema:Schema=None, projection:Projection=None) -> tuple[list[str], list]:
+    'Разбирает блок csv, отбирает строки и колонки по `projection` и приводит значения к типам.'
+    rows = parse_block(text, splitter)
+    if projection is not None:
+        headers, rows = projection.rows(headers, rows)
+        rows = list(rows)
+    if schema is not None:
+        rows = schema.convert_rows(rows, len(headers))
+    return headers, rows
+
+def _json_fragment(headers:list[str], text:str, splitter:str, schema:Schema=None, projection:Projection=None) -> tuple[bytes, int]:
+    headers, rows = _fragment_rows(headers, text, splitter, schema, projection)
+    rows = [orjson.dumps(dict(zip(headers, row)), option=orjson.OPT_INDENT_2) for row in rows]
+    return b',\n'.join(rows), len(rows)
+
+def _ndjson_fragment(headers:list[str], text:str, splitter:str, schema:Schema=None, projection:Projection=None) -> tuple[bytes, int]:
+    headers, rows = _fragment_rows(headers, text, splitter, schema, projection)
+    rows = [orjson.dumps(dict(zip(headers, row))) for row in rows]
+    return b'\n'.join(rows), len(rows)
+
+def _convert_shard(source:Path, start:int, end:int, fragment:Path, headers:list[str], splitter:str, result_type:str, encoding:str, schema:Schema=None,
+                   projection:Projection=None):
+    'Выполняется в дочернем процессе: конвертирует свой диапазон строк источника во фрагмент результата.'
+    serializer = ShardedTable.serializers[result_type]
+    rows = 0
+    with open(fragment, 'wb') as file:
+        for text in _iter_text_blocks(source, start, end, encoding):
+            data, count = serializer(headers, text, splitter, schema, projection)
+            if not count:
+                continue
+            if rows:
+                file.write(ShardedTable.separators[result_type])
+            file.write(data)
+            rows += count
+    return rows
+
+class ShardedTable():
+    '''Параллельная конвертация csv: файл делится на диапазоны байт по границам строк,
+    каждый диапазон конвертируется в отдельном процессе, затем фрагменты склеиваются по порядку.'''
+    encoding = 'utf-8'
+    serializers = {'json': _json_fragment, 'ndjson': _ndjson_fragment}
+    separators = {'json': b',\n', 'ndjson': b'\n'}
+    prefixes = {'json': b'[\n', 'ndjson': b''}
+    suffixes = {'json': b'\n]', 'ndjson': b'\n'}
+
+    def __init__(self, source:Path, headers:list[str], data_start:int, splitter:str=',', msg_cb:message_callback=None, progress:raw_progress_callback=None, workers:int=None,
+                 schema:Schema=None, projection:Projection=None):
+        self.schema = schema
+        self.projection = projection
+        self.source = source
+        self.headers = headers
+        self.data_start = data_start
+        self.splitter = splitter
+        self.msg_cb = msg_cb
+        self.progress = progress
+        self.workers = workers or os.cpu_count() or 1
+
+    @classmethod
+    def read(cls, data:Path, source_type:modes=None, splitter:str=None, msg_cb:message_callback=None, progress:raw_progress_callback=None, workers:int=None,
+             infer_types:bool=False, columns:list[str]=None, where:str=None):
+        if isinstance(data, str):
+            data = Path(data)
+        if source_type is None:
+            source_type = file_type(data)
+        if source_type != 'csv':
+            raise AttributeError(f'Параллельная конвертация не поддерживает источник {source_type}')
+        if compression_of(data):
+            raise AttributeError('Параллельная конвертация не поддерживает сжатый источник')
+        if splitter is None:
+            splitter = ','
+        with open(data, 'r', encoding=cls.encoding, newline='') as file:
+            header = read_record(file)
+            sample = file.read(MIN_SHARD_SIZE) if infer_types else ''
+        data_start = len(header.encode(cls.encoding))
+        headers = next(iter(parse_block(header, splitter)), [])
+        projection = Projection.create(columns, where)
+        schema = None
+        if infer_types:
+            # Типы определяются один раз по началу файла и передаются всем процессам, чтобы части результата совпадали
+            names, rows = _fragment_rows(headers, sample[:safe_cut(sample)] or sample, splitter, projection=projection)
+            schema = Schema.infer_rows(rows, len(names))
+        elif projection is not None:
+            # Неизвестные колонки проверяются до запуска процессов
+            projection.names(headers)
+        return cls(data, headers, data_start, splitter, msg_cb, progress, workers, schema, projection)
+
+    def plan_shards(self) -> list[tuple[int, int]]:
+        '''Делит данные источника на диапазоны байт, границы которых стоят сразу после перевода строки вне кавычек.
+
+        Чётность числа кавычек до границы считается одним последовательным проходом по файлу. Если рядом с источником
+        сохранён индекс строк (см. `RowIndex`), границы берутся из него без чтения файла.'''
+        size = self.source.stat().st_size
+        data_size = size - self.data_start
+        count = max(1, min(self.workers * 4, data_size // MIN_SHARD_SIZE))
+        step = max(1, data_size // count)
+        targets = [self.data_start + num * step for num in range(1, count)]
+        bounds = [self.data_start]
+        index = RowIndex.load(self.source)
+        if index is not None and len(index):
+            for target in targets:
+                num = bisect_left(index.offsets, target)
+                if num < len(index) and bounds[-1] < index.offsets[num] < size:
+                    bounds.append(index.offsets[num])
+            bounds.append(size)
+            return list(zip(bounds[:-1], bounds[1:]))
+        offset = self.data_start
+        quotes = 0
+        with open(self.source, 'rb') as file:
+            file.seek(offset)
+            while targets:
+                block = file.read(SHARD_BLOCK_SIZE)
+                if not block:
+                    break
+                while targets and targets[0] < offset + len(block):
+                    pos = max(targets[0], bounds[-1]) - offset
+                    parity = quotes + block.count(b'"', 0, pos)
+                    bound = None
+                    while True:
+                        newline = block.find(b'\n', pos)
+                        if newline == -1:
+                            break
+                        parity += block.count(b'"', pos, newline)
+                        if parity % 2 == 0:
+                            bound = offset + newline + 1
+                            break
+                        pos = newline + 1
+                    if bound is None:
+                        targets[0] = offset + len(block)
+                        break
+                    targets.pop(0)
+                    if bound < size and bound > bounds[-1]:
+                        bounds.append(bound)
+                quotes += block.count(b'"')
+                offset += len(block)
+        bounds.append(size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def save(self, dest:Path, result_type:modes=None, splitter:str=None, msg_cb:message_callback=None, token:CancelToken=None,
+             compress_threads:int=0):
+        'Фрагменты пишутся без сжатия, при склейке результат сжимается, если этого требует расширение `dest`.'
+        if result_type is None:
+            result_type = file_type(dest)
+        if result_type not in self.serializers:
+            raise AttributeError(f'Параллельная конвертация в {result_type} не поддерживается')
+        shards = self.plan_shards()
+        fragments = [dest.with_name(f'.{dest.name}.part{num}') for num in range(len(shards))]
+        total = shards[-1][1] - shards[0][0]
+        done = 0
+        rows = [0] * len(shards)
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(shards))) as pool:
+                futures = {}
+                for num, ((start, end), fragment) in enumerate(zip(shards, fragments)):
+                    future = pool.submit(_convert_shard, self.source, start, end, fragment, self.headers, self.splitter, result_type, self.encoding, self.schema,
+                                         self.projection)
+                    futures[future] = num
+                for future in as_completed(futures):
+                    if token is not None and token.cancelled:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        token.check()
+                    num = futures[future]
+                    rows[num] = future.result()
+                    start, end = shards[num]
+                    done += end - start
+                    if self.progress:
+                        self.progress(total, done)
+            self._concat(dest, result_type, fragments, rows, compress_threads)
+        finally:
+            for fragment in fragments:
+                fragment.unlink(missing_ok=True)
+
+    def _concat(self, dest:Path, result_type:str, fragments:list[Path], rows:list[int], compress_threads:int=0):
+        written = False
+        with open_target(dest, 'wb', threads=compress_threads) as file:
+            file.write(self.prefixes[result_type])
+            for fragment, count in zip(fragments, rows):
+                if not count:
+                    continue
+                if written:
+                    file.write(self.separators[result_type])
+                with open(fragment, 'rb') as part:
+                    shutil.copyfileobj(part, file, SHARD_BLOCK_SIZE)
+                written = True
+            file.write(self.suffixes[result_type])
@@ -1,5 +1,13 @@
 from .models import ConverterParams
 from pathlib import Path
+from .objects.sharded_table import ShardedTable
+from .objects._arrow import ARROW_TYPES, arrow_available
+from .objects._compression import COMPRESSIBLE, compression_of, zstd_available
+from .objects._projection import parse_where
+from .objects._join import parse_join_on
+from .objects._aggregate import parse_aggregates
+from .objects._manifest import Manifest
+from .src.batch import batch_files
 
 class Errors():
     class ValidationError(Exception):
@@ -28,23 +36,182 @@ class Errors():
             super().__init__(*args)
             self.msg = 'Для оптимизированного режима необходим файл источник данных.'
 
+    class ParallelSourcePath(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для параллельного режима необходим csv файл источник данных.'
+
+    class ParallelTarget(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Параллельный режим поддерживает только конвертацию в json и ndjson.'
+
+    class AsyncSourcePath(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для асинхронного режима необходим файл источник и файл результата.'
+
+    class Incremental(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Инкрементальная конвертация поддерживается в оптимизированном режиме для json, ndjson и csv без сжатия.'
+
+    class RowIndex(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Индекс строк сохраняется в оптимизированном режиме для результата json, ndjson и csv без сжатия.'
+
+    class BatchSource(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для пакетной конвертации необходима папка или шаблон файлов источников.'
+
+    class BatchEmpty(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'По указанной папке или шаблону не найдено файлов источников.'
+
+    class BatchParallel(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Пакетная конвертация уже распределяет файлы по процессам, выберите быстрый или оптимизированный режим.'
+
+    class ArrowMissing(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для форматов parquet и feather необходим пакет pyarrow.'
+
+    class ArrowText(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Форматы parquet и feather поддерживаются только для файлов.'
+
+    class CompressedType(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Сжатие файлов поддерживается только для json, ndjson, csv и startrek.'
+
+    class ZstdMissing(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для сжатия zstd необходим пакет zstandard.'
+
+    class ParallelCompressed(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Параллельный режим не поддерживает сжатый файл источник.'
+
+    class WhereSyntax(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Условие отбора строк должно иметь вид "колонка оператор значение", условия разделяются ";". Операторы: = != > < >= <= ~.'
+
+    class Stages(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Дедупликация, соединение, группировка и сортировка выполняются в оптимизированном режиме без инкрементальной конвертации.'
+
+    class JoinPath(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Файл справочника для соединения не существует.'
+
+    class JoinOn(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Для соединения необходимы колонки через запятую: "id" или "id = user_id", если в справочнике колонка называется иначе.'
+
+    class Aggregates(ValidationError):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.msg = 'Агрегаты задаются через ";" в виде "функция(колонка)", функции: count, sum, min, max, mean, distinct.'
+
     class NotImplemented(ValidationError):
         def __init__(self, *args):
             super().__init__(*args)
             self.msg = 'Работа конвертера с выбранными параметрами на данный момент невозможна.'
 
 def validate_params(params: ConverterParams):
-    if params.source_type == params.target_type:
+    # Дедупликация, соединение, группировка и сортировка имеют смысл и без смены формата, но не с записью поверх источника
+    same_file = params.batch or not params.source_path or params.source_path == params.target_path
+    if params.source_type == params.target_type and (not has_stages(params) or same_file):
         raise Errors.TypeSourceTarget()
+    validate_arrow_params(params)
+    validate_where(params)
+    validate_stages(params)
+    if params.incremental and (params.type != 'Оптимизированный' or params.source_type not in Manifest.sources or params.target_type not in Manifest.targets):
+        raise Errors.Incremental()
+    if params.row_index and (params.type != 'Оптимизированный' or params.target_type not in ('json', 'ndjson', 'csv')):
+        raise Errors.RowIndex()
+    if params.batch:
+        return validate_batch_params(params)
     if params.source_path is None and not params.source_text:
         raise Errors.EmptySource()
-    if params.source_type == 'startrek':
-        raise NotImplementedError()
-    if params.type == 'Оптимизированный' and params.source_type == 'startrek':
-        raise NotImplementedError()
-    if params.type == 'Оптимизированный' and params.target_type == 'startrek':
-        raise NotImplementedError()
+    if params.type == 'Быстрый' and params.source_text and (params.source_type in ARROW_TYPES or params.target_type in ARROW_TYPES):
+        raise Errors.ArrowText()
+    validate_compression_params(params)
+    if params.incremental and (compression_of(params.source_path) or compression_of(params.target_path)):
+        raise Errors.Incremental()
+    if params.row_index and compression_of(params.target_path):
+        raise Errors.RowIndex()
     if params.type == 'Оптимизированный' and not params.source_path:
         raise Errors.OptSourcePath()
+    if params.type == 'Асинхронный' and (not params.source_path or not params.target_path):
+        raise Errors.AsyncSourcePath()
+    if params.type == 'Параллельный' and (not params.source_path or params.source_type != 'csv'):
+        raise Errors.ParallelSourcePath()
+    if params.type == 'Параллельный' and compression_of(params.source_path):
+        raise Errors.ParallelCompressed()
+    if params.type == 'Параллельный' and params.target_type not in ShardedTable.serializers:
+        raise Errors.ParallelTarget()
     if params.source_path and not Path(params.source_path).exists():
-        raise Errors.SourcePathNotExists()
\ No newline at end of file
+        raise Errors.SourcePathNotExists()
+
+def validate_arrow_params(params: ConverterParams):
+    if (params.source_type in ARROW_TYPES or params.target_type in ARROW_TYPES) and not arrow_available():
+        raise Errors.ArrowMissing()
+
+def validate_where(params: ConverterParams):
+    if not params.where:
+        return
+    try:
+        parse_where(params.where)
+    except AttributeError:
+        raise Errors.WhereSyntax()
+
+def has_stages(params: ConverterParams) -> bool:
+    return bool(params.unique or params.join_path or params.group_by or params.aggregates.strip() or params.sort_by)
+
+def validate_stages(params: ConverterParams):
+    if not has_stages(params):
+        return
+    if params.type != 'Оптимизированный' or params.incremental:
+        raise Errors.Stages()
+    if params.join_path:
+        if not Path(params.join_path).is_file():
+            raise Errors.JoinPath()
+        try:
+            parse_join_on(params.join_on)
+        except AttributeError:
+            raise Errors.JoinOn()
+    if params.aggregates.strip():
+        try:
+            parse_aggregates(params.aggregates)
+        except AttributeError:
+            raise Errors.Aggregates()
+
+def validate_compression_params(params: ConverterParams):
+    for path, type in ((params.source_path, params.source_type), (params.target_path, params.target_type)):
+        compression = compression_of(path)
+        if compression and type not in COMPRESSIBLE:
+            raise Errors.CompressedType()
+        if compression == 'zstd' and not zstd_available():
+            raise Errors.ZstdMissing()
+
+def validate_batch_params(params: ConverterParams):
+    if not params.batch_source:
+        raise Errors.BatchSource()
+    if params.type == 'Параллельный':
+        raise Errors.BatchParallel()
+    if not batch_files(params.batch_source, params.source_type):
+        raise Errors.BatchEmpty()
@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Array
+from pathlib import Path
+from glob import glob
+import os
+from ..models import ConverterParams
+from ..objects._types import message_callback, raw_progress_callback
+from ..objects._checkpoint import Checkpoint
+from ..objects._cancel import CancelToken
+from ..objects._compression import file_type, with_type
+from . import script
+
+_progress = None
+
+def batch_files(source:Path|str, source_type:str) -> list[Path]:
+    'Файлы источники: все файлы формата `source_type` (в т.ч. сжатые) в папке или файлы, подходящие под glob-шаблон.'
+    source = Path(source)
+    if source.is_dir():
+        return sorted(path for path in source.glob(f'*.{source_type}*') if path.is_file() and file_type(path) == source_type)
+    return sorted(Path(path) for path in glob(str(source), recursive=True) if Path(path).is_file())
+
+def batch_target(source:Path, params:ConverterParams) -> Path:
+    target_dir = Path(params.batch_target) if params.batch_target else source.parent
+    return target_dir / with_type(source, params.target_type).name
+
+def is_up_to_date(source:Path, target:Path) -> bool:
+    'Результат новее источника и не остался от прерванной конвертации.'
+    if not target.exists() or Checkpoint.sidecar(target).exists():
+        return False
+    return target.stat().st_mtime >= source.stat().st_mtime
+
+def _init_worker(progress):
+    global _progress
+    _progress = progress
+
+def _report(index:int, size:int, max_value:int|float, value:int|float):
+    if max_value:
+        _progress[index] = int(size * min(value / max_value, 1))
+
+def _convert_file(params:ConverterParams, index:int, size:int) -> list[str]:
+    'Выполняется в дочернем процессе: конвертирует один файл и возвращает сообщения конвертера.'
+    messages = []
+    script.main(params, messages.append, lambda: None, lambda max_value, value: _report(index, size, max_value, value))
+    return messages
+
+def batch_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    '''Конвертирует все файлы из папки или glob-шаблона `params.batch_source` в пуле процессов.
+
+    Каждый файл конвертируется через `script.main` выбранным типом конвертации. Файлы, результат которых новее
+    источника, пропускаются. Прогресс считается в байтах источников по всем файлам сразу.'''
+    sources = batch_files(params.batch_source, params.source_type)
+    jobs:list[tuple[Path, Path]] = []
+    skipped = 0
+    for source in sources:
+        target = batch_target(source, params)
+        if is_up_to_date(source, target):
+            skipped += 1
+        else:
+            jobs.append((source, target))
+    if params.batch_target:
+        Path(params.batch_target).mkdir(parents=True, exist_ok=True)
+    sizes = [source.stat().st_size for source, _ in jobs]
+    total = sum(sizes)
+    failed = 0
+    if jobs:
+        progress = Array('q', len(jobs), lock=False)
+        workers = min(len(jobs), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(progress,)) as pool:
+            futures = {}
+            for index, ((source, target), size) in enumerate(zip(jobs, sizes)):
+                file_params = params.model_copy(update={'batch': False, 'source_path': source, 'target_path': target, 'source_text': ''})
+                futures[pool.submit(_convert_file, file_params, index, size)] = index
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                if token is not None and token.cancelled:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    token.check()
+                for future in done:
+                    index = futures[future]
+                    progress[index] = sizes[index]
+                    try:
+                        for message in future.result():
+                            msg_cb(f'{jobs[index][0].name}: {message}')
+                    except Exception as e:
+                        failed += 1
+                        msg_cb(f'{jobs[index][0].name}: {e}')
+                        target = jobs[index][1]
+                        if not Checkpoint.sidecar(target).exists():
+                            # Неполный результат был бы новее источника и пропускался бы при повторном запуске
+                            target.unlink(missing_ok=True)
+                if progress_cb and total:
+                    progress_cb(total, sum(progress))
+    msg_cb(f'Пакетная конвертация: сконвертировано {len(jobs) - failed}, пропущено {skipped} (результат новее источника), с ошибками {failed}.')
+    done_cb()
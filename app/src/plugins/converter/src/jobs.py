@@ -0,0 +1,167 @@
+import asyncio
+from collections import deque
+from itertools import count
+from threading import Thread, Condition
+from typing import Callable
+from pathlib import Path
+from ..models import ConverterParams, Settings
+from ..objects._cancel import CancelToken, JobCancelled
+from ..objects._types import message_callback
+from ....utils.singleton import singleton
+from ....utils.progress import ProgressCounter
+from .script import main, async_convert
+
+class JobStatus():
+    queued = 'В очереди'
+    running = 'Выполняется'
+    done = 'Готово'
+    cancelled = 'Отменено'
+    failed = 'Ошибка'
+
+class ConverterJob():
+    '''Одна конвертация в очереди `JobScheduler`. Параметры копируются при создании задачи.'''
+    _ids = count(1)
+
+    def __init__(self, params:ConverterParams, owner:str, msg_cb:message_callback, changed_cb:Callable[['ConverterJob'], None]=None):
+        self.id = next(self._ids)
+        self.params = params.model_copy()
+        self.owner = owner
+        self.msg_cb = msg_cb
+        self.changed_cb = changed_cb
+        self.token = CancelToken()
+        self.progress = ProgressCounter()
+        self.status = JobStatus.queued
+        self.error:str|None = None
+
+    @property
+    def title(self) -> str:
+        if self.params.batch:
+            return f'{Path(self.params.batch_source).name} (пакет) → {self.params.target_type}'
+        source = self.params.source_path.name if self.params.source_path else 'текст'
+        target = self.params.target_path.name if self.params.target_path else 'текст'
+        return f'{source} → {target}'
+
+    @property
+    def is_async(self) -> bool:
+        return self.params.type == 'Асинхронный' and not self.params.batch
+
+    @property
+    def active(self) -> bool:
+        return self.status in (JobStatus.queued, JobStatus.running)
+
+    def set_status(self, status:str, error:str=None):
+        self.status = status
+        self.error = error
+        if self.changed_cb is not None:
+            self.changed_cb(self)
+
+@singleton
+class JobScheduler():
+    '''Очередь конвертаций с ограниченным числом рабочих потоков.
+
+    У каждого владельца (клиента интерфейса) своя очередь, а потоки забирают задачи из очередей по кругу,
+    поэтому много файлов от одного пользователя не задерживают задачи остальных.
+
+    Асинхронные задачи не занимают рабочие потоки: они выполняются в цикле событий, из которого отправлены,
+    и ограничиваются собственным семафором на `max_workers` одновременных конвертаций.'''
+    history_size = 100
+
+    def __init__(self, max_workers:int=None):
+        self.max_workers = max_workers or Settings.get_max_jobs()
+        self.queues:dict[str, deque[ConverterJob]] = {}
+        self.owners:deque[str] = deque()
+        self.jobs:deque[ConverterJob] = deque(maxlen=self.history_size)
+        self.condition = Condition()
+        self.threads:list[Thread] = []
+        self.async_slots:asyncio.Semaphore|None = None
+        self.tasks:set[asyncio.Task] = set()
+
+    def submit(self, job:ConverterJob) -> ConverterJob:
+        if job.is_async:
+            return self._submit_async(job)
+        with self.condition:
+            if job.owner not in self.queues:
+                self.queues[job.owner] = deque()
+                self.owners.append(job.owner)
+            self.queues[job.owner].append(job)
+            self.jobs.append(job)
+            if len(self.threads) < self.max_workers:
+                thread = Thread(target=self._worker, name=f'converter_worker_{len(self.threads)}', daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return job
+
+    def _submit_async(self, job:ConverterJob) -> ConverterJob:
+        'Вызывается из цикла событий: задача запускается в нём же.'
+        if self.async_slots is None:
+            self.async_slots = asyncio.Semaphore(self.max_workers)
+        self.jobs.append(job)
+        task = asyncio.get_running_loop().create_task(self._run_async(job))
+        # Цикл событий хранит только слабые ссылки на задачи
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    def cancel(self, job:ConverterJob):
+        'Отменяет задачу: ожидающая убирается из очереди, выполняющаяся остановится после текущей пачки строк.'
+        job.token.cancel()
+        with self.condition:
+            queue = self.queues.get(job.owner)
+            if queue is None or job not in queue:
+                return
+            queue.remove(job)
+            if not queue:
+                self._drop_owner(job.owner)
+        job.set_status(JobStatus.cancelled)
+
+    def owner_jobs(self, owner:str) -> list[ConverterJob]:
+        return [job for job in self.jobs if job.owner == owner]
+
+    def _drop_owner(self, owner:str):
+        del self.queues[owner]
+        self.owners.remove(owner)
+
+    def _next_job(self) -> ConverterJob:
+        with self.condition:
+            while not self.owners:
+                self.condition.wait()
+            owner = self.owners.popleft()
+            queue = self.queues[owner]
+            job = queue.popleft()
+            if queue:
+                self.owners.append(owner)
+            else:
+                del self.queues[owner]
+            return job
+
+    def _worker(self):
+        while True:
+            self._run(self._next_job())
+
+    def _run(self, job:ConverterJob):
+        if job.token.cancelled:
+            return job.set_status(JobStatus.cancelled)
+        job.set_status(JobStatus.running)
+        try:
+            main(job.params, job.msg_cb, lambda: None, job.progress, job.token)
+        except JobCancelled:
+            job.set_status(JobStatus.cancelled)
+        except Exception as e:
+            job.set_status(JobStatus.failed, str(e))
+        else:
+            job.set_status(JobStatus.done)
+
+    async def _run_async(self, job:ConverterJob):
+        async with self.async_slots:
+            if job.token.cancelled:
+                return job.set_status(JobStatus.cancelled)
+            job.set_status(JobStatus.running)
+            try:
+                await async_convert(job.params, job.msg_cb, lambda: None, job.progress, job.token)
+            except JobCancelled:
+                job.set_status(JobStatus.cancelled)
+            except Exception as e:
+                job.set_status(JobStatus.failed, str(e))
+            else:
+                job.set_status(JobStatus.done)
@@ -1,82 +1,270 @@
-import orjson
-import openpyxl as excl
+'''Асинхронная потоковая конвертация в цикле событий сервера.
+
+Чтение и запись связаны ограниченной очередью `asyncio.Queue` из `QUEUE_SIZE` пачек: читатель не уходит
+далеко вперёд медленной записи, а в памяти одновременно находится не больше нескольких пачек.
+Файловые операции выполняются через aiofiles, а разбор и сериализация — прямо в цикле событий, пока блок
+небольшой, и в маленьком пуле `PARSE_WORKERS` потоков, если блок тяжёлый. Так конвертация не занимает
+отдельный поток на всё время работы и чередуется с другими запросами сервера на каждом `await`.
+
+csv и ndjson читаются и разбираются здесь же. Остальные форматы читаются синхронными генераторами
+оптимизированного режима, каждая пачка которых получается в пуле разбора. Продолжение по checkpoint
+в асинхронном режиме не поддерживается.'''
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, suppress
+from functools import partial
 from pathlib import Path
-import aiofiles
-from aiofiles.base import AiofilesContextManager
-from typing import AsyncGenerator, TextIO, TypeAlias, Callable, Any
-
-progress_callback:TypeAlias = Callable[[int|float], None]
-message_callback:TypeAlias = Callable[[str], None]
-
-def json_read_gen(file:TextIO, progress:progress_callback=None):
-    result = ''
-    square_braces = 0
-    curly_braces = 0
-    read_progress = 0
+from typing import AsyncIterator, Callable, Any, IO
+import orjson
+from aiofiles.threadpool import wrap
+from ..objects._types import modes, table_batch, message_callback, raw_progress_callback
+from ..objects._csv import safe_cut, format_rows, MAX_PENDING_BLOCKS
+from ..objects._generators import CsvRows, BATCH_SIZE
+from ..objects._projection import Projection
+from ..objects._startrek import StWildcards, format_st_row
+from ..objects._xlsx import XlsxWriter
+from ..objects._arrow import ArrowWriter, ARROW_TYPES
+from ..objects._compression import open_source, open_target, source_position, file_type
+from ..objects._cancel import CancelToken
+from ..objects._checkpoint import unfinished_removed
+from ..objects.optimized_table import OptimizedTable
+
+READ_CHUNK_SIZE = 1024 * 1024
+QUEUE_SIZE = 4
+PARSE_WORKERS = 2
+# Блоки меньше этого размера разбираются прямо в цикле событий: передача в пул стоит дороже самого разбора
+HEAVY_CHUNK_SIZE = 256 * 1024
+HEAVY_BATCH_SIZE = 2000
+ENCODING = 'utf-8'
+
+_executor:ThreadPoolExecutor = None
+_DONE = object()
+
+def parse_executor() -> ThreadPoolExecutor:
+    'Общий для всех асинхронных конвертаций пул разбора. Создаётся при первой тяжёлой пачке.'
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(PARSE_WORKERS, thread_name_prefix='converter_parse')
+    return _executor
+
+async def offload(heavy:bool, func:Callable, *args, **kwargs) -> Any:
+    'Вызывает `func` в пуле разбора, если работа тяжёлая, иначе сразу.'
+    if not heavy:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(parse_executor(), partial(func, *args, **kwargs))
+
+async def open_async(opener:Callable[..., IO], *args, **kwargs) -> tuple[IO, Any]:
+    '''Открывает файл через `opener` (`open_source` или `open_target`) в пуле потоков aiofiles.
+    Возвращает сам файл, по которому считается позиция, и его асинхронную обёртку.'''
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(None, partial(opener, *args, **kwargs))
+    return file, wrap(file, loop=loop)
+
+def _report(progress:raw_progress_callback|None, total:int, file:IO):
+    if progress is not None:
+        progress(total, source_position(file))
+
+async def _chunks(file, cut:Callable[[bytes], int], chunk_size:int=READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    'Читает файл блоками, каждый блок заканчивается на границе записи, найденной `cut`.'
+    tail = b''
     while True:
-        line = file.readline()
-        if '[' in line and square_braces == 0:
-            square_braces += 1
-            continue
-        if ']' in line and square_braces == 1 and curly_braces == 0:
-            break
-        if '{' in line and square_braces == 0:
-            continue
-        if '{' in line and square_braces == 1:
-            curly_braces += 1
-        if '}' in line:
-            curly_braces -= 1
-        if '},' in line and curly_braces == 0:
-            line = line.replace('},', '}')
-        result += line.strip()
-        read_progress += 1
-        if result.endswith('}'):
-            res:dict = orjson.loads(result)
-            if progress != None:
-                progress(read_progress)
-            yield res
-            result = ''
-
-async def json_loader(obj:str|Path, optimized:bool=False, *args, **kwargs) -> list[dict]|AsyncGenerator[dict, Any, None]:
-
-    if isinstance(obj, Path) and not optimized:
-        async with aiofiles.open(obj, 'r', encoding='utf-8') as f:
-            return orjson.loads(await f.read())
-
-    elif isinstance(obj, str):
-        return orjson.loads(obj)
-
-    elif isinstance(obj, Path) and optimized:
-        async with aiofiles.open(obj, 'r', encoding='utf-8') as f:
-            return json_read_gen(f)
-
-    else:
-        raise NotImplementedError(f'Unknown object type and optimized combination: {type(obj)}, {optimized}')
-
-def _fast_csv_reader(data:list[str], splitter:str=','):
-    keys = data[0].split(splitter)
-    data = data[1:]
-    return [dict(zip(keys, row.split(splitter))) for row in data]
-
-async def csv_read_gen(file:AiofilesContextManager, splitter:str=','):
-    keys = None
-    async for row in file:
-        row: str
-        if not keys:
-            keys = row.split(splitter)
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            if tail:
+                yield tail
+            return
+        data = tail + chunk
+        end = cut(data)
+        if end == 0 and len(data) > chunk_size * MAX_PENDING_BLOCKS:
+            end = data.rfind(b'\n') + 1
+        if end == 0:
+            tail = data
             continue
-        yield dict(zip(keys, row.split(splitter)))
+        tail = data[end:]
+        yield data[:end]
 
-async def csv_loader(obj:str|Path, optimized:bool=False, splitter:str=',', *args, **kwargs) -> list[dict]|AsyncGenerator[dict, Any, None]:
+def _csv_batches(parser:CsvRows, data:bytes, batch_size:int) -> list[table_batch]:
+    rows = parser.parse(data.decode(ENCODING))
+    return [parser.batch(rows[start:start + batch_size]) for start in range(0, len(rows), batch_size)]
 
-    if isinstance(obj, Path) and not optimized:
-        async with aiofiles.open(obj, 'r', encoding='utf-8') as f:
-            data = await f.readlines()
-            return _fast_csv_reader(data, splitter=splitter)
+async def csv_read_agen(path:Path, splitter:str=',', progress:raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                        infer_types:bool=False, projection:Projection=None) -> AsyncIterator[table_batch]:
+    'Асинхронно читает csv. Блок разбирается тем же `CsvRows`, что и в оптимизированном режиме.'
+    parser = CsvRows(splitter, infer_types, projection)
+    total = path.stat().st_size
+    raw, file = await open_async(open_source, path, 'rb')
+    try:
+        async for data in _chunks(file, safe_cut):
+            for batch in await offload(len(data) >= HEAVY_CHUNK_SIZE, _csv_batches, parser, data, batch_size):
+                yield batch
+            _report(progress, total, raw)
+    finally:
+        await file.close()
 
-    elif isinstance(obj, str):
-        return _fast_csv_reader(obj.splitlines(), splitter=splitter)
+def _ndjson_batches(data:bytes, batch_size:int, projection:Projection=None) -> list[table_batch]:
+    pick, check = projection.compile_dicts() if projection is not None else (None, None)
+    rows = [orjson.loads(line) for line in data.split(b'\n') if line and not line.isspace()]
+    if check is not None:
+        rows = [row for row in rows if check(row)]
+    if pick is not None:
+        rows = [pick(row) for row in rows]
+    return [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+
+async def ndjson_read_agen(path:Path, progress:raw_progress_callback=None, batch_size:int=BATCH_SIZE,
+                           projection:Projection=None) -> AsyncIterator[table_batch]:
+    'Асинхронно читает json lines блоками из целых строк.'
+    total = path.stat().st_size
+    raw, file = await open_async(open_source, path, 'rb')
+    try:
+        async for data in _chunks(file, lambda data: data.rfind(b'\n') + 1):
+            for batch in await offload(len(data) >= HEAVY_CHUNK_SIZE, _ndjson_batches, data, batch_size, projection):
+                yield batch
+            _report(progress, total, raw)
+    finally:
+        await file.close()
+
+async def sync_read_agen(path:Path, source_type:modes, splitter:str=None, msg_cb:message_callback=None, progress:raw_progress_callback=None,
+                         batch_size:int=BATCH_SIZE, infer_types:bool=False, projection:Projection=None, sheets:list[str]=None) -> AsyncIterator[table_batch]:
+    '''Форматы без асинхронного читателя: синхронный генератор оптимизированного режима выполняется в пуле разбора
+    по одной пачке. Чтение файла и разбор пачки происходят в одном вызове, цикл событий при этом свободен.'''
+    columns, where = (projection.columns, projection.where) if projection is not None else (None, None)
+    table = await offload(True, OptimizedTable.read, path, source_type, splitter, msg_cb, progress, batch_size,
+                          infer_types=infer_types, columns=columns, where=where, sheets=sheets)
+    try:
+        while (batch := await offload(True, next, table.batches, None)) is not None:
+            yield batch
+    finally:
+        # Если задача отменена во время чтения пачки, генератор ещё выполняется в пуле и закрыть его нельзя
+        with suppress(ValueError):
+            await offload(True, table.batches.close)
+        if table.source_file is not None:
+            await offload(True, table.source_file.close)
+
+def read_agen(path:Path, source_type:modes=None, splitter:str=None, msg_cb:message_callback=None, progress:raw_progress_callback=None,
+              batch_size:int=BATCH_SIZE, infer_types:bool=False, projection:Projection=None, sheets:list[str]=None) -> AsyncIterator[table_batch]:
+    if source_type is None:
+        source_type = file_type(path)
+    match source_type:
+        case 'csv':
+            return csv_read_agen(path, splitter or ',', progress, batch_size, infer_types, projection)
+        case 'ndjson':
+            return ndjson_read_agen(path, progress, batch_size, projection)
+        case 'json' | 'xlsx' | 'startrek' | 'parquet' | 'feather':
+            return sync_read_agen(path, source_type, splitter, msg_cb, progress, batch_size, infer_types, projection, sheets)
+        case _:
+            raise AttributeError(f'Неизвестный источник {source_type}')
+
+def _json_bytes(batch:table_batch, first:bool) -> bytes:
+    dumped = orjson.dumps(batch, option=orjson.OPT_INDENT_2)
+    return dumped[1:-2] if first else b',' + dumped[1:-2]
+
+def _ndjson_bytes(batch:table_batch, first:bool) -> bytes:
+    return b''.join([orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in batch])
+
+def _csv_bytes(batch:table_batch, first:bool, splitter:str=',') -> bytes:
+    rows = (row.values() for row in batch)
+    if first:
+        rows = (batch[0].keys(), *rows)
+    return format_rows(rows, splitter).encode(ENCODING)
+
+def _st_bytes(batch:table_batch, first:bool) -> bytes:
+    text = ''.join([format_st_row(row.values()) for row in batch])
+    if first:
+        text = format_st_row(batch[0].keys()) + text
+    return text.encode(ENCODING)
+
+async def text_write(dest:Path, batches:AsyncIterator[table_batch], serialize:Callable[[table_batch, bool], bytes],
+                     prefix:bytes=b'', suffix:Callable[[int], bytes]=None, compress_threads:int=0) -> int:
+    '''Пишет пачки в текстовый формат. `serialize` получает пачку и признак первой пачки,
+    `suffix` — число записанных строк. Возвращает число записанных строк.'''
+    rows = 0
+    _, file = await open_async(open_target, dest, 'wb', threads=compress_threads)
+    try:
+        await file.write(prefix)
+        async for batch in batches:
+            if not batch:
+                continue
+            await file.write(await offload(len(batch) >= HEAVY_BATCH_SIZE, serialize, batch, not rows))
+            rows += len(batch)
+        if suffix is not None:
+            await file.write(suffix(rows))
+    finally:
+        await file.close()
+    return rows
+
+async def sync_write(make:Callable[[list], Any], append:Callable[[Any, table_batch], None], batches:AsyncIterator[table_batch]) -> int:
+    '''Форматы без асинхронной записи (xlsx, parquet, feather): их писатели вызываются в пуле разбора.
+    Писатель создаётся `make` по колонкам первой пачки.'''
+    writer = None
+    rows = 0
+    try:
+        async for batch in batches:
+            if not batch:
+                continue
+            if writer is None:
+                writer = await offload(True, make, list(batch[0].keys()))
+            await offload(True, append, writer, batch)
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            await offload(True, writer.close)
+    return rows
+
+async def write(dest:Path, target_type:modes, batches:AsyncIterator[table_batch], splitter:str=None, compress_threads:int=0) -> int:
+    match target_type:
+        case 'json':
+            return await text_write(dest, batches, _json_bytes, b'[', lambda rows: b'\n]' if rows else b']', compress_threads)
+        case 'ndjson':
+            return await text_write(dest, batches, _ndjson_bytes, compress_threads=compress_threads)
+        case 'csv':
+            return await text_write(dest, batches, partial(_csv_bytes, splitter=splitter or ','), compress_threads=compress_threads)
+        case 'startrek':
+            return await text_write(dest, batches, _st_bytes, f'{StWildcards.start_table}\n'.encode(ENCODING),
+                                    lambda rows: f'{StWildcards.end_table}\n'.encode(ENCODING), compress_threads)
+        case 'xlsx':
+            return await sync_write(partial(XlsxWriter, dest), lambda writer, batch: writer.append_rows(row.values() for row in batch), batches)
+        case kind if kind in ARROW_TYPES:
+            return await sync_write(partial(ArrowWriter, dest, kind), ArrowWriter.append_batch, batches)
+        case _:
+            raise AttributeError(f'Неизвестный тип {target_type}')
+
+async def _produce(batches:AsyncIterator[table_batch], queue:asyncio.Queue):
+    'Читатель: кладёт пачки в очередь, при заполненной очереди ждёт запись. Ошибка чтения передаётся через очередь.'
+    try:
+        async with aclosing(batches):
+            async for batch in batches:
+                await queue.put(batch)
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(_DONE)
+
+async def _consume(queue:asyncio.Queue, token:CancelToken=None) -> AsyncIterator[table_batch]:
+    while True:
+        item = await queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+        if token is not None:
+            token.check()
 
-    elif isinstance(obj, Path) and optimized:
-        async with aiofiles.open(obj, 'r', encoding='utf-8') as f:
-            return await csv_read_gen(f, splitter=splitter)
\ No newline at end of file
+async def convert(source:Path, dest:Path, source_type:modes=None, target_type:modes=None, splitter:str=None, msg_cb:message_callback=None,
+                  progress:raw_progress_callback=None, batch_size:int=BATCH_SIZE, infer_types:bool=False, columns:list[str]=None, where:str=None,
+                  token:CancelToken=None, compress_threads:int=0, queue_size:int=QUEUE_SIZE, sheets:list[str]=None) -> int:
+    '''Конвертирует `source` в `dest`: чтение и запись выполняются параллельными задачами цикла событий,
+    связанными очередью из `queue_size` пачек. Отмена через `token` проверяется после каждой записанной пачки.
+    Возвращает число записанных строк.'''
+    source, dest = Path(source), Path(dest)
+    if target_type is None:
+        target_type = file_type(dest)
+    reader = read_agen(source, source_type, splitter, msg_cb, progress, batch_size, infer_types, Projection.create(columns, where), sheets)
+    queue = asyncio.Queue(queue_size)
+    producer = asyncio.create_task(_produce(reader, queue))
+    try:
+        with unfinished_removed(dest):
+            return await write(dest, target_type, _consume(queue, token), splitter, compress_threads)
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
@@ -2,32 +2,114 @@ from ..models import ConverterParams
 from ..objects._types import message_callback, raw_progress_callback
 from ..objects.fast_table import FastTable
 from ..objects.optimized_table import OptimizedTable
+from ..objects.sharded_table import ShardedTable
+from ..objects._checkpoint import Checkpoint
+from ..objects._manifest import Manifest
+from ..objects._cancel import CancelToken
+from ..objects._projection import Projection
+from ..objects._join import parse_join_on
+from ..objects._aggregate import parse_aggregates
+from ..objects._compression import file_type
 import orjson
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+TEXT_RESULT_LIMIT = 1024 * 1024
 
 def text_to_text_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback):
     if params.source_type == 'csv':
         data = params.source_text.splitlines()
     elif params.source_type == 'json':
         data = orjson.loads(params.source_text)
-    table = FastTable.read(data, params.source_type, params.splitter, msg_cb)
-    result = table.save(None, params.target_type, params.splitter, msg_cb)
-    params.target_text =result
+    elif params.source_type == 'ndjson':
+        data = params.source_text.splitlines()
+    elif params.source_type == 'startrek':
+        data = (params.source_text,)
+    table = FastTable.read(data, params.source_type, params.splitter, msg_cb, params.infer_types, params.columns, params.where)
+    if len(params.source_text) > TEXT_RESULT_LIMIT:
+        # Большой результат не отправляется в поле браузера целиком, а пишется в файл для постраничного просмотра
+        handle, path = tempfile.mkstemp(prefix='converter_', suffix=f'.{params.target_type}')
+        os.close(handle)
+        params.preview_path = Path(path)
+        table.save(params.preview_path, params.target_type, params.splitter, msg_cb)
+        params.target_text = ''
+    else:
+        params.target_text = table.save(None, params.target_type, params.splitter, msg_cb)
+    done_cb()
+
+def apply_stages(table: OptimizedTable, params: ConverterParams, msg_cb: message_callback) -> OptimizedTable:
+    '''Этапы между чтением и записью: сначала из источника убираются повторы, затем он соединяется со справочником
+    и группируется, последней идёт сортировка, так что сортировать можно и по значениям агрегатов.'''
+    if params.unique:
+        table = table.unique(params.unique, params.stage_memory_rows)
+    if params.join_path:
+        left_on, right_on = parse_join_on(params.join_on)
+        other = OptimizedTable.read(params.join_path, file_type(params.join_path), params.splitter, msg_cb, batch_size=params.batch_size,
+                                    infer_types=params.infer_types)
+        table = table.join(other, left_on, right_on, params.join_how, params.stage_memory_rows)
+    if params.group_by or params.aggregates.strip():
+        table = table.aggregate(params.group_by, parse_aggregates(params.aggregates), params.stage_memory_rows)
+    if params.sort_by:
+        table = table.sort(params.sort_by, params.sort_descending, params.stage_memory_rows)
+    return table
+
+def optimized_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    checkpoint = None
+    projection = Projection.create(params.columns, params.where)
+    stages = bool(params.unique or params.join_path or params.group_by or params.aggregates.strip() or params.sort_by)
+    if params.incremental and Manifest.supports(params.source_type, params.target_type, params.source_path, params.target_path):
+        checkpoint = Manifest.load(params.source_path, params.target_path, params.source_type, params.target_type, params.splitter,
+                                   projection, params.infer_types)
+        if checkpoint.resumable:
+            msg_cb(f'Источник {params.source_path.name} не изменился до позиции {checkpoint.input_offset} байт, '
+                   f'строк из прошлой конвертации: {checkpoint.rows}. Конвертируется только остаток.')
+    elif not stages and Checkpoint.supports(params.source_type, params.target_type, params.source_path, params.target_path):
+        # Строки после этапов не соответствуют позициям в источнике, продолжать по checkpoint нечего
+        checkpoint = Checkpoint.load(params.source_path, params.target_path, params.source_type, params.target_type, params.splitter,
+                                     projection, params.infer_types)
+        if checkpoint.resumable:
+            msg_cb(f'Продолжение прерванной конвертации {params.source_path.name}, уже записано строк: {checkpoint.rows}.')
+    table = OptimizedTable.read(params.source_path, params.source_type, params.splitter, msg_cb, progress_cb, params.batch_size, checkpoint, params.infer_types,
+                                params.columns, params.where, params.sheets)
+    if stages:
+        table = apply_stages(table, params, msg_cb)
+    table.save(params.target_path, params.target_type, params.splitter, msg_cb, token, params.compress_threads, params.row_index)
+    done_cb()
+
+def fast_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    table = FastTable.read(params.source_path, params.source_type, params.splitter, msg_cb, params.infer_types, params.columns, params.where,
+                           params.sheets)
+    if token is not None:
+        token.check()
+    table.save(params.target_path, params.target_type, params.splitter, msg_cb, params.compress_threads)
     done_cb()
 
-def optimized_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback):
-    table = OptimizedTable.read(params.source_path, params.source_type, params.splitter, msg_cb, progress_cb)
-    table.save(params.target_path, params.target_type, params.splitter, msg_cb)
+def parallel_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    table = ShardedTable.read(params.source_path, params.source_type, params.splitter, msg_cb, progress_cb, infer_types=params.infer_types,
+                              columns=params.columns, where=params.where)
+    table.save(params.target_path, params.target_type, params.splitter, msg_cb, token, params.compress_threads)
     done_cb()
 
-def fast_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback):
-    table = FastTable.read(params.source_path, params.source_type, params.splitter, msg_cb)
-    table.save(params.target_path, params.target_type, params.splitter, msg_cb)
+async def async_convert(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    from .loaders import convert
+    await convert(params.source_path, params.target_path, params.source_type, params.target_type, params.splitter, msg_cb, progress_cb,
+                  params.batch_size, params.infer_types, params.columns, params.where, token, params.compress_threads, sheets=params.sheets)
     done_cb()
 
-def main(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback):
+def main(params: ConverterParams, msg_cb: message_callback, done_cb, progress_cb: raw_progress_callback, token: CancelToken=None):
+    if params.batch:
+        from .batch import batch_convert
+        return batch_convert(params, msg_cb, done_cb, progress_cb, token)
     if params.type.lower() == 'быстрый':
         if params.source_text:
             return text_to_text_convert(params, msg_cb, done_cb, progress_cb)
-        return fast_convert(params, msg_cb, done_cb, progress_cb)
+        return fast_convert(params, msg_cb, done_cb, progress_cb, token)
+    elif params.type.lower() == 'параллельный':
+        return parallel_convert(params, msg_cb, done_cb, progress_cb, token)
+    elif params.type.lower() == 'асинхронный':
+        # Вне цикла событий сервера, например в процессах пакетной конвертации
+        return asyncio.run(async_convert(params, msg_cb, done_cb, progress_cb, token))
     else:
-        return optimized_convert(params, msg_cb, done_cb, progress_cb)
+        return optimized_convert(params, msg_cb, done_cb, progress_cb, token)
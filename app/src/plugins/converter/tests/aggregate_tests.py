@@ -0,0 +1,38 @@
+from ..objects._projection import _number, Projection
+from ..objects._aggregate import GroupBy, parse_aggregates
+
+def test_number():
+    assert _number('557') == 557 and type(_number('557')) is int
+    assert _number('-12') == -12
+    assert _number('1.5') == 1.5
+    assert _number('1e3') == 1000.0
+    assert _number(str(2 ** 63 + 1)) == 2 ** 63 + 1
+    assert _number(7) == 7 and _number(2.5) == 2.5
+    for value in ('1_000', 'inf', '-inf', 'nan', 'NaN', 'Infinity', '1e400', '', 'abc', None, True, False, float('nan'), float('inf')):
+        assert _number(value) is None, value
+
+def run(rows:list[dict], columns:list[str], aggregates:str) -> list[dict]:
+    stage = GroupBy(columns, parse_aggregates(aggregates))
+    return [row for batch in stage.run([rows]) for row in batch]
+
+def test_integer_sums_stay_exact():
+    big = 2 ** 53 + 1
+    rows = [{'g': 'a', 'v': str(big)}, {'g': 'a', 'v': '1'}, {'g': 'b', 'v': '2'}, {'g': 'b', 'v': '3'}]
+    result = run(rows, ['g'], 'sum(v); mean(v)')
+    assert result == [{'g': 'a', 'sum_v': big + 1, 'mean_v': (big + 1) / 2}, {'g': 'b', 'sum_v': 5, 'mean_v': 2.5}]
+    assert type(result[1]['sum_v']) is int
+
+def test_non_numbers_skipped():
+    rows = [{'v': '1'}, {'v': 'nan'}, {'v': 'inf'}, {'v': '1_000'}, {'v': '2.5'}, {'v': ''}, {'v': None}]
+    assert run(rows, [], 'sum(v); mean(v); count(v)') == [{'sum_v': 3.5, 'mean_v': 1.75, 'count_v': 5}]
+
+def test_where_numbers():
+    _, check = Projection.create(None, 'v > 100').compile_dicts()
+    assert check({'v': '557'})
+    assert not check({'v': '99'})
+    assert check({'v': str(2 ** 60)})
+    _, check = Projection.create(None, 'v = nan').compile_dicts()
+    assert check({'v': 'nan'})
+    _, check = Projection.create(None, 'v = 1_000').compile_dicts()
+    assert check({'v': '1_000'})
+    assert not check({'v': '1000'})
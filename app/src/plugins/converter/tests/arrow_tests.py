@@ -0,0 +1,58 @@
+from datetime import date
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from ..objects._arrow import ArrowWriter, arrow_rows, read_arrow_columns, iter_arrow_batches
+from ..objects.fast_table import FastTable
+from ..objects.optimized_table import OptimizedTable
+
+ROWS = [{'id': num, 'name': f'name {num}', 'price': num / 4, 'flag': num % 2 == 0, 'nested': {'a': num} if num % 3 else None, 'empty': None}
+        for num in range(50)]
+# Вложенные объекты и колонки без значений записываются строками
+EXPECTED = [{**row, 'nested': None if row['nested'] is None else f'{{"a":{row["id"]}}}'} for row in ROWS]
+
+@pytest.fixture(autouse=True)
+def small_groups(monkeypatch):
+    monkeypatch.setattr(ArrowWriter, 'row_group_size', 7)
+
+@pytest.mark.parametrize('kind', ['parquet', 'feather'])
+def test_optimized_round_trip(tmp_path, kind):
+    dest = tmp_path / f'result.{kind}'
+    OptimizedTable(batches=iter([ROWS[:20], ROWS[20:]])).save(dest)
+    assert arrow_rows(dest, kind) == len(ROWS)
+    batches = list(OptimizedTable.read(dest, batch_size=5).batches)
+    assert all(len(batch) <= 5 for batch in batches)
+    assert [row for batch in batches for row in batch] == EXPECTED
+
+@pytest.mark.parametrize('kind', ['parquet', 'feather'])
+def test_fast_round_trip(tmp_path, kind):
+    dest = tmp_path / f'result.{kind}'
+    table = FastTable(cols=['day', 'value'], columns=[[date(2024, 1, 1), None, date(2024, 2, 29)], [1.5, None, 3]])
+    table.save(dest)
+    result = FastTable.read(dest)
+    assert result.cols == ['day', 'value']
+    assert result.columns == [[date(2024, 1, 1), None, date(2024, 2, 29)], [1.5, None, 3.0]]
+
+@pytest.mark.parametrize('kind', ['parquet', 'feather'])
+def test_projection(tmp_path, kind):
+    dest = tmp_path / f'result.{kind}'
+    with ArrowWriter(dest, kind, ['a', 'b', 'c']) as writer:
+        writer.append_batch([{'a': num, 'b': str(num), 'c': num * 2} for num in range(10)])
+    assert read_arrow_columns(dest, kind, ['c', 'a']) == (['c', 'a'], [[num * 2 for num in range(10)], list(range(10))])
+    assert [batch.num_rows for batch in iter_arrow_batches(dest, kind, 4, ['b'])] == [4, 4, 2]
+    with pytest.raises(AttributeError):
+        read_arrow_columns(dest, kind, ['missing'])
+
+def test_schema_from_first_group(tmp_path):
+    dest = tmp_path / 'mixed.parquet'
+    with ArrowWriter(dest, 'parquet', ['x']) as writer:
+        writer.row_group_size = 2
+        writer.append_batch([{'x': None}, {'x': 1}, {'x': 's'}])
+        writer.append_batch([{}, {'x': 2.5}])
+    assert read_arrow_columns(dest, 'parquet') == (['x'], [[None, '1', 's', None, '2.5']])
+    writer = ArrowWriter(tmp_path / 'typed.parquet', 'parquet', ['x'])
+    writer.row_group_size = 2
+    writer.append_batch([{'x': 1}, {'x': 2}])
+    with pytest.raises(AttributeError):
+        writer.append_batch([{'x': 'a'}, {'x': 'b'}])
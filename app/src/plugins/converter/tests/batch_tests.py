@@ -0,0 +1,66 @@
+from pathlib import Path
+import os
+import gzip
+import orjson
+
+from ..models import ConverterParams
+from ..objects._checkpoint import Checkpoint
+from ..src.batch import batch_files, batch_target, is_up_to_date, batch_convert
+
+def write_json(path:Path, rows:int=10) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(orjson.dumps([{'id': num, 'name': f'name {num}'} for num in range(rows)]))
+    return path
+
+def age(path:Path, seconds:int):
+    'Сдвигает время изменения файла в прошлое.'
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - seconds * 10**9))
+
+def test_batch_files(tmp_path):
+    first = write_json(tmp_path / 'a.json')
+    second = tmp_path / 'b.json.gz'
+    second.write_bytes(gzip.compress(first.read_bytes()))
+    nested = write_json(tmp_path / 'sub' / 'c.json')
+    (tmp_path / 'd.csv').write_text('id\n1\n')
+    (tmp_path / 'e.jsonl').write_text('{}\n')
+    assert batch_files(tmp_path, 'json') == [first, second]
+    assert batch_files(tmp_path / '**' / '*.json', 'json') == [first, nested]
+
+def test_batch_target(tmp_path):
+    source = tmp_path / 'in' / 'a.json.gz'
+    params = ConverterParams(source_type='json', target_type='csv')
+    assert batch_target(source, params) == tmp_path / 'in' / 'a.csv.gz'
+    params = ConverterParams(source_type='json', target_type='xlsx', batch_target=tmp_path / 'out')
+    assert batch_target(source, params) == tmp_path / 'out' / 'a.xlsx'
+
+def test_is_up_to_date(tmp_path):
+    source = write_json(tmp_path / 'a.json')
+    target = tmp_path / 'a.csv'
+    assert not is_up_to_date(source, target)
+    target.write_text('id\n')
+    assert is_up_to_date(source, target)
+    age(target, 10)
+    assert not is_up_to_date(source, target)
+    target.touch()
+    Checkpoint.sidecar(target).write_bytes(b'{}')
+    assert not is_up_to_date(source, target)
+
+def run_batch(params:ConverterParams) -> list[str]:
+    messages = []
+    batch_convert(params, messages.append, lambda: None, None)
+    return messages
+
+def test_batch_convert_skips_up_to_date(tmp_path):
+    sources = [write_json(tmp_path / 'in' / f'{name}.json', rows) for name, rows in (('a', 10), ('b', 20), ('c', 30))]
+    for source in sources:
+        age(source, 10)
+    params = ConverterParams(type='Оптимизированный', source_type='json', target_type='csv', batch=True,
+                             batch_source=tmp_path / 'in', batch_target=tmp_path / 'out')
+    assert run_batch(params)[-1].startswith('Пакетная конвертация: сконвертировано 3, пропущено 0')
+    targets = [tmp_path / 'out' / f'{name}.csv' for name in 'abc']
+    assert [len(target.read_text().splitlines()) for target in targets] == [11, 21, 31]
+    assert run_batch(params)[-1].startswith('Пакетная конвертация: сконвертировано 0, пропущено 3')
+    write_json(sources[1], 5)
+    assert run_batch(params)[-1].startswith('Пакетная конвертация: сконвертировано 1, пропущено 2')
+    assert len(targets[1].read_text().splitlines()) == 6
@@ -0,0 +1,110 @@
+from pathlib import Path
+import orjson
+import pytest
+
+from ..objects import _csv, _generators
+from ..objects._cancel import CancelToken, JobCancelled
+from ..objects._checkpoint import Checkpoint
+from ..objects.optimized_table import OptimizedTable
+
+ROWS = [{'id': num, 'name': f'name "{num}"\nline' if num % 7 == 0 else f'name {num}', 'value': num / 4} for num in range(3000)]
+
+class CountdownToken(CancelToken):
+    'Отмена после `checks` проверок, то есть после стольких же записанных пачек.'
+    def __init__(self, checks:int):
+        super().__init__()
+        self.checks = checks
+
+    @property
+    def cancelled(self) -> bool:
+        self.checks -= 1
+        if self.checks < 0:
+            self.cancel()
+        return super().cancelled
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    'Блоки csv по 4 КБ и сохранение checkpoint после каждой пачки, чтобы небольшие файлы прерывались посередине.'
+    monkeypatch.setattr(_generators, 'iter_blocks', lambda file: _csv.iter_blocks(file, 4096))
+    monkeypatch.setattr(Checkpoint, 'interval', 0)
+
+def convert(source:Path, dest:Path, source_type:str, target_type:str, cancel_after:int=None, infer_types:bool=False,
+            batch_size:int=100) -> bool:
+    'Конвертирует с продолжением по checkpoint, возвращает `False`, если конвертация отменена.'
+    checkpoint = Checkpoint.load(source, dest, source_type, target_type, ',', infer_types=infer_types)
+    table = OptimizedTable.read(source, source_type, ',', batch_size=batch_size, checkpoint=checkpoint, infer_types=infer_types)
+    token = CountdownToken(cancel_after) if cancel_after is not None else None
+    try:
+        table.save(dest, target_type, ',', token=token)
+    except JobCancelled:
+        return False
+    return True
+
+def read_ndjson(path:Path) -> list:
+    return [orjson.loads(line) for line in path.read_bytes().splitlines()]
+
+def write_source(path:Path, rows:list=ROWS) -> Path:
+    OptimizedTable(batches=iter([rows])).save(path)
+    return path
+
+@pytest.mark.parametrize('source_type, target_type', [('csv', 'json'), ('csv', 'ndjson'), ('json', 'csv'), ('ndjson', 'json'), ('json', 'ndjson')])
+def test_resume_matches_uninterrupted(tmp_path, source_type, target_type):
+    source = write_source(tmp_path / f'source.{source_type}')
+    dest = tmp_path / f'result.{target_type}'
+    reference = tmp_path / f'reference.{target_type}'
+    OptimizedTable.read(source, source_type, ',').save(reference, target_type, ',')
+    resumed = []
+    for cancel_after in (5, 8):
+        assert not convert(source, dest, source_type, target_type, cancel_after=cancel_after)
+        checkpoint = Checkpoint.load(source, dest, source_type, target_type, ',')
+        assert checkpoint.resumable
+        assert dest.stat().st_size >= checkpoint.output_offset
+        resumed.append(checkpoint.rows)
+    assert resumed[0] < resumed[1] < len(ROWS)
+    assert convert(source, dest, source_type, target_type)
+    assert not Checkpoint.sidecar(dest).exists()
+    assert dest.read_bytes() == reference.read_bytes()
+
+def test_changed_source_restarts(tmp_path):
+    source = write_source(tmp_path / 'source.json')
+    dest = tmp_path / 'result.ndjson'
+    assert not convert(source, dest, 'json', 'ndjson', cancel_after=5)
+    assert Checkpoint.load(source, dest, 'json', 'ndjson', ',').resumable
+    rows = ROWS[::-1]
+    write_source(source, rows)
+    assert not Checkpoint.load(source, dest, 'json', 'ndjson', ',').resumable
+    assert convert(source, dest, 'json', 'ndjson')
+    assert read_ndjson(dest) == rows
+
+def test_shorter_target_restarts(tmp_path):
+    source = write_source(tmp_path / 'source.json')
+    dest = tmp_path / 'result.ndjson'
+    assert not convert(source, dest, 'json', 'ndjson', cancel_after=5)
+    checkpoint = Checkpoint.load(source, dest, 'json', 'ndjson', ',')
+    with open(dest, 'r+b') as file:
+        file.truncate(checkpoint.output_offset - 1)
+    assert not Checkpoint.load(source, dest, 'json', 'ndjson', ',').resumable
+    assert convert(source, dest, 'json', 'ndjson')
+    assert read_ndjson(dest) == ROWS
+
+def test_infer_types_is_part_of_key(tmp_path):
+    source = write_source(tmp_path / 'source.csv')
+    dest = tmp_path / 'result.ndjson'
+    assert not convert(source, dest, 'csv', 'ndjson', cancel_after=3, infer_types=False)
+    assert Checkpoint.load(source, dest, 'csv', 'ndjson', ',', infer_types=False).resumable
+    assert not Checkpoint.load(source, dest, 'csv', 'ndjson', ',', infer_types=True).resumable
+    assert convert(source, dest, 'csv', 'ndjson', infer_types=True)
+    rows = read_ndjson(dest)
+    assert len(rows) == len(ROWS)
+    assert all(type(row['id']) is int for row in rows)
+
+@pytest.mark.parametrize('target_type', ['json', 'ndjson', 'csv'])
+def test_cancel_before_first_checkpoint_removes_target(tmp_path, target_type):
+    'Пачки внутри блока csv не имеют известной позиции: отмена до конца первого блока не сохраняет checkpoint.'
+    source = write_source(tmp_path / 'source.csv')
+    dest = tmp_path / f'result.{target_type}'
+    assert not convert(source, dest, 'csv', target_type, cancel_after=2, batch_size=10)
+    assert not Checkpoint.sidecar(dest).exists()
+    assert not dest.exists()
+    assert convert(source, dest, 'csv', target_type)
+    assert [str(row['id']) for batch in OptimizedTable.read(dest).batches for row in batch] == [str(row['id']) for row in ROWS]
@@ -0,0 +1,63 @@
+from pathlib import Path
+import zipfile
+import pytest
+
+from ..objects._compression import open_source, open_target, source_position, compression_of, strip_compression, with_type, file_type, file_formats, \
+    zstd_available
+from ..objects._checkpoint import Checkpoint
+from ..objects.fast_table import FastTable
+from ..objects.optimized_table import OptimizedTable
+
+SUFFIXES = ['gz', 'bz2', 'xz', 'zip', pytest.param('zst', marks=pytest.mark.skipif(not zstd_available(), reason='zstandard не установлен'))]
+ROWS = [{'id': str(num), 'name': f'name "{num}"\nline' if num % 7 == 0 else f'name {num}'} for num in range(2000)]
+
+def test_names():
+    assert compression_of(Path('a.csv.gz')) == 'gzip' and compression_of(Path('a.csv')) is None and compression_of(None) is None
+    assert strip_compression(Path('a.b.csv.zst')) == Path('a.b.csv')
+    assert file_type(Path('a.b.csv.zst')) == 'csv'
+    assert with_type(Path('a.csv.gz'), 'json') == Path('a.json.gz')
+    assert with_type(Path('a.csv.gz'), 'xlsx') == Path('a.xlsx')
+    assert file_formats('csv')[:2] == ['csv', 'csv.gz']
+    assert file_formats('parquet') == ['parquet']
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+def test_stream_round_trip(tmp_path, suffix):
+    path = tmp_path / f'data.txt.{suffix}'
+    text = ''.join(f'строка {num}\n' for num in range(50000))
+    with open_target(path, 'w', encoding='utf-8', newline='') as file:
+        file.write(text)
+    with open_source(path, 'r', encoding='utf-8', newline='') as file:
+        assert file.read(10) == text[:10]
+        assert 0 < source_position(file) <= path.stat().st_size
+        assert file.read() == text[10:]
+    with open_source(path) as file:
+        assert file.read() == text.encode('utf-8')
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+@pytest.mark.parametrize('target_type', ['csv', 'json', 'ndjson'])
+def test_table_round_trip(tmp_path, suffix, target_type):
+    dest = tmp_path / f'result.{target_type}.{suffix}'
+    OptimizedTable(batches=iter([ROWS[:500], ROWS[500:]])).save(dest)
+    progress = []
+    rows = [row for batch in OptimizedTable.read(dest, progress=lambda max_value, value: progress.append((max_value, value))).batches for row in batch]
+    assert rows == ROWS
+    assert progress[-1][0] == dest.stat().st_size
+    fast = tmp_path / f'fast.{target_type}.{suffix}'
+    FastTable.read(dest).save(fast)
+    assert [str(value) for value in FastTable.read(fast).columns[0]] == [row['id'] for row in ROWS]
+
+def test_zip_member(tmp_path):
+    path = tmp_path / 'data.csv.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('export_2024.csv', 'a,b\n1,2\n')
+    with open_source(path, 'r') as file:
+        assert file.read() == 'a,b\n1,2\n'
+    with zipfile.ZipFile(path, 'a') as archive:
+        archive.writestr('other.csv', 'c\n')
+    with pytest.raises(AttributeError):
+        open_source(path)
+
+def test_no_checkpoint_for_compressed(tmp_path):
+    assert not Checkpoint.supports('csv', 'json', tmp_path / 'a.csv.gz', tmp_path / 'b.json')
+    assert not Checkpoint.supports('csv', 'json', tmp_path / 'a.csv', tmp_path / 'b.json.gz')
+    assert Checkpoint.supports('csv', 'json', tmp_path / 'a.csv', tmp_path / 'b.json')
@@ -0,0 +1,125 @@
+import csv
+import io
+import pytest
+
+from ..objects._csv import MAX_PENDING_BLOCKS, safe_cut, read_record, iter_blocks, iter_buffer_blocks, parse_block, iter_rows, make_writer, format_rows
+
+TRICKY_ROWS = [
+    ['id', 'name', 'comment'],
+    ['1', 'plain', 'no quotes'],
+    ['2', 'say "hi"', 'doubled "" quotes'],
+    ['3', 'multi\nline', 'with, comma'],
+    ['4', '', '"starts and ends with quote"'],
+    ['5', 'empty\n\nline inside', 'x'],
+    ['6', 'crlf\r\ninside', 'y'],
+]
+
+def reference(text:str, splitter:str=',') -> list[list[str]]:
+    'Разбор модулем `csv` без пустых строк, как его делает `parse_block`.'
+    return [row for row in csv.reader(io.StringIO(text, newline=''), delimiter=splitter) if row]
+
+def min_block(rows:list[list[str]], splitter:str=',') -> int:
+    '''Наименьший блок, при котором самая длинная запись не режется запасным путём по MAX_PENDING_BLOCKS:
+    недочитанная запись вместе с очередным блоком должна уложиться в MAX_PENDING_BLOCKS блоков.'''
+    longest = max(len(format_rows([row], splitter)) for row in rows)
+    return longest // (MAX_PENDING_BLOCKS - 1) + 1
+
+def read_all(text:str, block_size:int, splitter:str=',') -> list[list[str]]:
+    return [row for rows in iter_rows(io.StringIO(text, newline=''), splitter, block_size) for row in rows]
+
+def test_safe_cut():
+    assert safe_cut('a,b\nc,d') == 4
+    assert safe_cut('a,b') == 0
+    assert safe_cut('a,"b\nc",d\ne') == 10
+    assert safe_cut('a,"b\nc') == 0
+    assert safe_cut(b'a,"b\nc",d\ne') == 10
+    assert safe_cut('a,"b""\n""c') == 0
+
+def test_read_record():
+    file = io.StringIO('"a\nb",c\nd,"e""\n""f"\ng\n', newline='')
+    assert read_record(file) == '"a\nb",c\n'
+    assert read_record(file) == 'd,"e""\n""f"\n'
+    assert read_record(file) == 'g\n'
+    assert read_record(file) == ''
+    assert read_record(io.StringIO('"open\nend')) == '"open\nend'
+
+def test_quoted_fields_across_block_boundaries():
+    text = format_rows(TRICKY_ROWS)
+    expected = reference(text)
+    assert expected == TRICKY_ROWS
+    for block_size in range(min_block(TRICKY_ROWS), len(text) + 2):
+        assert read_all(text, block_size) == expected, block_size
+
+def test_blocks_end_on_record_boundary():
+    text = format_rows(TRICKY_ROWS)
+    for block_size in (min_block(TRICKY_ROWS), 7, 16):
+        blocks = list(iter_blocks(io.StringIO(text, newline=''), block_size))
+        assert ''.join(blocks) == text
+        for block in blocks:
+            assert block.count('"') % 2 == 0
+            assert block.endswith('\n')
+
+def test_buffer_blocks_match_text_blocks():
+    rows = TRICKY_ROWS + [['7', 'юникод "в" кавычках', 'ё\nж']]
+    text = format_rows(rows)
+    data = text.encode('utf-8')
+    expected = reference(text)
+    for block_size in range(min_block(rows) * 2, len(data) + 2):
+        rows = [row for block in iter_buffer_blocks(data, 'utf-8', block_size) for row in parse_block(block)]
+        assert rows == expected, block_size
+
+def test_crlf_input():
+    text = format_rows(TRICKY_ROWS).replace('\n', '\r\n')
+    expected = reference(text)
+    for block_size in (min_block(TRICKY_ROWS) + 1, 5, 64, 4096):
+        assert read_all(text, block_size) == expected, block_size
+    plain = 'a,b\r\n1,2\r\n3,4\r\n'
+    assert read_all(plain, 3) == [['a', 'b'], ['1', '2'], ['3', '4']]
+
+def test_blank_lines_skipped():
+    text = '\na,b\n\n\n1,2\n\n"3","x\n\ny"\n\n'
+    expected = [['a', 'b'], ['1', '2'], ['3', 'x\n\ny']]
+    for block_size in range(1, len(text) + 2):
+        assert read_all(text, block_size) == expected, block_size
+    assert parse_block('\r\n\r\na,b\r\n\r\n') == [['a', 'b']]
+
+@pytest.mark.parametrize('splitter', [';', '\t', '||'])
+def test_other_splitters(splitter):
+    rows = [['a', 'b', 'c'], ['1', '2', '3'], ['x', '', 'z']]
+    text = format_rows(rows, splitter)
+    assert read_all(text, 4, splitter) == rows
+
+def test_unbalanced_quote_fallback():
+    'Одиночная кавычка не должна копить весь файл в памяти: блок режется после MAX_PENDING_BLOCKS блоков.'
+    block_size = 8
+    lines = ['a,b'] + [f'{num},v{num}' for num in range(200)]
+    lines.insert(2, '1,"broken')
+    text = '\n'.join(lines) + '\n'
+    blocks = list(iter_blocks(io.StringIO(text), block_size))
+    assert ''.join(blocks) == text
+    assert len(blocks) > 1
+    limit = block_size * (MAX_PENDING_BLOCKS + 1)
+    assert all(len(block) <= limit for block in blocks)
+    buffer_blocks = list(iter_buffer_blocks(text.encode(), 'utf-8', block_size))
+    assert ''.join(buffer_blocks) == text
+    assert len(buffer_blocks) > 1
+    # Строки после отрезанного блока разбираются как обычно
+    rows = [row for block in blocks for row in parse_block(block)]
+    assert rows[-1] == ['199', 'v199']
+
+@pytest.mark.parametrize('splitter', [',', ';'])
+def test_writer_reader_round_trip(splitter):
+    rows = TRICKY_ROWS + [['8', f'has {splitter} splitter', 'tail "q"']]
+    buffer = io.StringIO(newline='')
+    writer = make_writer(buffer, splitter)
+    writer.writerow(rows[0])
+    writer.writerows(rows[1:])
+    text = buffer.getvalue()
+    assert text == format_rows(rows, splitter)
+    for block_size in (min_block(rows, splitter), 5, 13, 1024):
+        assert read_all(text, block_size, splitter) == rows, block_size
+
+def test_multichar_writer():
+    buffer = io.StringIO()
+    make_writer(buffer, '||').writerows([['a', None, 1], ['b', 'c', 2.5]])
+    assert buffer.getvalue() == 'a||||1\nb||c||2.5\n'
@@ -0,0 +1,21 @@
+import orjson
+
+from ..objects.fast_table import FastTable
+
+RAGGED = [{'a': 1}, {'a': 2, 'b': 'x'}, {'c': True, 'a': 3}]
+
+def test_ragged_json_keeps_all_keys():
+    table = FastTable.from_json(orjson.dumps(RAGGED).decode())
+    assert table.cols == ['a', 'b', 'c']
+    assert orjson.loads(table.to_json()) == [
+        {'a': 1, 'b': None, 'c': None},
+        {'a': 2, 'b': 'x', 'c': None},
+        {'a': 3, 'b': None, 'c': True},
+    ]
+
+def test_ragged_ndjson_keeps_all_keys(tmp_path):
+    source = tmp_path / 'ragged.ndjson'
+    source.write_bytes(b''.join(orjson.dumps(row) + b'\n' for row in RAGGED))
+    table = FastTable.from_ndjson(source)
+    assert table.cols == ['a', 'b', 'c']
+    assert [row['b'] for row in table.rows] == [None, 'x', None]
@@ -0,0 +1,106 @@
+import random
+import pytest
+
+from ..objects import _spill
+from ..objects._join import Dedup, HashJoin, parse_join_on
+
+random.seed(1)
+LEFT = [{'id': random.randint(0, 2000), 'kind': random.choice('abc'), 'value': num} for num in range(6000)]
+RIGHT = [{'id': str(num % 1500), 'name': f'name {num}', 'value': -num} for num in range(1800)]
+
+def batches(rows:list[dict], size:int=250):
+    return (rows[start:start + size] for start in range(0, len(rows), size))
+
+def collect(stage_batches) -> list[dict]:
+    return [row for batch in stage_batches for row in batch]
+
+@pytest.fixture
+def spills(tmp_path, monkeypatch) -> list:
+    'Временные папки, созданные этапами при сбросе на диск.'
+    created = []
+    def spill_directory(directory=None):
+        created.append(_spill.tempfile.TemporaryDirectory(prefix='converter_', dir=tmp_path))
+        return created[-1]
+    monkeypatch.setattr(_spill, 'spill_directory', spill_directory)
+    return created
+
+def dedup_reference(rows:list[dict], columns:list[str]) -> list[dict]:
+    seen, result = set(), []
+    for row in rows:
+        key = tuple(str(row[column]) for column in columns)
+        if key not in seen:
+            seen.add(key)
+            result.append(row)
+    return result
+
+def join_reference(how:str) -> list[dict]:
+    index = {}
+    for row in RIGHT:
+        index.setdefault(row['id'], []).append(row)
+    result = []
+    for row in LEFT:
+        found = index.get(str(row['id']))
+        if found:
+            result += [{**row, 'name': other['name'], 'value_right': other['value']} for other in found]
+        elif how == 'left':
+            result.append({**row, 'name': None, 'value_right': None})
+    return result
+
+def by_value(row:dict) -> tuple:
+    return row['value'], row['name'] or ''
+
+@pytest.mark.parametrize('columns', [['id'], ['id', 'kind']])
+@pytest.mark.parametrize('memory_rows', [10 ** 6, 500, 20])
+def test_dedup(tmp_path, spills, columns, memory_rows):
+    result = collect(Dedup(columns, memory_rows).run(batches(LEFT)))
+    expected = dedup_reference(LEFT, columns)
+    if memory_rows > len(LEFT):
+        # Без сброса порядок источника сохраняется
+        assert result == expected and not spills
+    else:
+        assert sorted(result, key=lambda row: row['value']) == expected and spills
+    assert not list(tmp_path.iterdir())
+
+@pytest.mark.parametrize('how', ['inner', 'left'])
+@pytest.mark.parametrize('memory_rows', [10 ** 6, 300, 10])
+def test_hash_join(tmp_path, spills, how, memory_rows):
+    result = collect(HashJoin(['id'], None, how, memory_rows).run(batches(LEFT), batches(RIGHT)))
+    expected = join_reference(how)
+    if memory_rows > len(RIGHT):
+        assert result == expected and not spills
+    else:
+        assert sorted(result, key=by_value) == sorted(expected, key=by_value) and spills
+    assert all(list(row) == ['id', 'kind', 'value', 'name', 'value_right'] for row in result)
+    assert not list(tmp_path.iterdir())
+
+def test_join_single_key(tmp_path, spills):
+    'Раздел с одним ключом не делится, после `max_level` уровней он соединяется в памяти.'
+    left = [{'id': 1, 'value': num} for num in range(3)] + [{'id': 2, 'value': 3}]
+    right = [{'key': '1', 'name': f'name {num}'} for num in range(200)]
+    result = collect(HashJoin(['id'], ['key'], 'left', 10).run(batches(left, 2), batches(right, 7)))
+    assert len(result) == 3 * 200 + 1 and spills
+    assert {row['name'] for row in result if row['id'] == 1} == {f'name {num}' for num in range(200)}
+    assert [row for row in result if row['id'] == 2] == [{'id': 2, 'value': 3, 'name': None}]
+    assert not list(tmp_path.iterdir())
+
+def test_stopped_early(tmp_path, spills):
+    'Временные файлы удаляются, даже если результат не дочитан.'
+    stage = Dedup(['value'], 100).run(batches(LEFT))
+    for _ in range(5):
+        next(stage)
+    assert spills and list(tmp_path.iterdir())
+    stage.close()
+    assert not list(tmp_path.iterdir())
+
+def test_errors():
+    with pytest.raises(AttributeError):
+        collect(Dedup(['missing']).run(batches(LEFT)))
+    with pytest.raises(AttributeError):
+        collect(HashJoin(['id'], ['missing']).run(batches(LEFT), batches(RIGHT)))
+    with pytest.raises(AttributeError):
+        HashJoin(['id'], how='outer')
+    with pytest.raises(AttributeError):
+        HashJoin(['id', 'kind'], ['id'])
+    assert parse_join_on(' id , kind = type ,') == (['id', 'kind'], ['id', 'type'])
+    with pytest.raises(AttributeError):
+        parse_join_on(' , ')
@@ -0,0 +1,94 @@
+import io
+import json
+import orjson
+import pytest
+
+from ..objects._generators import json_read_gen, _json_guess_object, ReadState
+
+CHUNK_SIZES = list(range(1, 40)) + [64, 127, 1024, 1024 * 1024]
+
+FLAT_ROWS = [
+    {'id': 1, 'name': 'plain', 'value': 1.5},
+    {'id': 2, 'name': 'escaped \\"quote\\" inside', 'value': None},
+    {'id': 3, 'name': 'brackets } ] { [ inside', 'value': True},
+    {'id': 4, 'name': 'ends with backslash \\', 'value': '},'},
+    {'id': 5, 'name': 'quote then brace "}', 'value': '"]'},
+    {'id': 6, 'name': 'юникод и   символы', 'value': ''},
+]
+
+NESTED_ROWS = [
+    {'id': 1, 'nested': {'a': {'b': [1, 2, {'c': '}]'}]}}, 'tail': 'x'},
+    {'id': 2, 'nested': {}, 'list': [], 'tail': '\\'},
+    {'id': 3, 'nested': {'deep': [[[{'x': '"{"'}]]]}, 'tail': None},
+]
+
+MIXED_ROWS = FLAT_ROWS[:2] + NESTED_ROWS + FLAT_ROWS[2:]
+
+def dumps(rows:list, indent:bool) -> bytes:
+    if indent:
+        return json.dumps(rows, indent=2, ensure_ascii=False).encode('utf-8')
+    return orjson.dumps(rows)
+
+def read_all(data:bytes, chunk_size:int, batch_size:int=2, **kwargs) -> list:
+    rows = []
+    for batch in json_read_gen(io.BytesIO(data), chunk_size=chunk_size, batch_size=batch_size, **kwargs):
+        assert batch
+        rows.extend(batch)
+    return rows
+
+@pytest.mark.parametrize('indent', [False, True], ids=['minified', 'indented'])
+@pytest.mark.parametrize('rows', [FLAT_ROWS, NESTED_ROWS, MIXED_ROWS], ids=['flat', 'nested', 'mixed'])
+def test_chunk_sizes(rows, indent):
+    data = dumps(rows, indent)
+    for chunk_size in CHUNK_SIZES:
+        assert read_all(data, chunk_size) == rows, chunk_size
+
+def test_whitespace_between_objects():
+    data = b'\n [ \r\n\t{"a": 1}\n ,\n\n{"a": "]"}  ,{"a":{"b":"}"}}\n ]\n'
+    for chunk_size in CHUNK_SIZES:
+        assert read_all(data, chunk_size) == [{'a': 1}, {'a': ']'}, {'a': {'b': '}'}}], chunk_size
+
+@pytest.mark.parametrize('data', [b'[]', b'[ ]', b'\n[\n]\n', b''])
+def test_empty_array(data):
+    for chunk_size in (1, 2, 1024):
+        assert read_all(data, chunk_size) == []
+
+def test_not_array():
+    with pytest.raises(AttributeError):
+        read_all(b'{"a": 1}', 1024)
+
+def test_guess_object():
+    buffer = bytearray(b'[{"a": "}, "}, {"b": 1}]')
+    assert _json_guess_object(buffer, 1) is None
+    row, end = _json_guess_object(buffer, 15)
+    assert row == {'b': 1} and buffer[end:] == b']'
+    assert _json_guess_object(bytearray(b'{"a": {"b": 1}, "c": 2}'), 0) is None
+
+@pytest.mark.parametrize('indent', [False, True], ids=['minified', 'indented'])
+def test_resume(indent):
+    rows = MIXED_ROWS * 3
+    data = dumps(rows, indent)
+    for chunk_size in (1, 7, 64, 1024 * 1024):
+        state = ReadState()
+        reader = json_read_gen(io.BytesIO(data), chunk_size=chunk_size, batch_size=4, state=state)
+        first = next(reader)
+        reader.close()
+        assert state.rows == len(first) == 4
+        assert state.offset is not None
+        file = io.BytesIO(data)
+        file.seek(state.offset)
+        rest = [row for batch in json_read_gen(file, chunk_size=chunk_size, batch_size=4, resume=True) for row in batch]
+        assert first + rest == rows, chunk_size
+
+def test_state_offsets_at_object_boundaries():
+    data = dumps(MIXED_ROWS, True)
+    state = ReadState()
+    offsets = []
+    for _ in json_read_gen(io.BytesIO(data), chunk_size=5, batch_size=1, state=state):
+        offsets.append(state.offset)
+    assert state.rows == len(MIXED_ROWS)
+    for num, offset in enumerate(offsets[:-1]):
+        file = io.BytesIO(data)
+        file.seek(offset)
+        rest = [row for batch in json_read_gen(file, chunk_size=3, resume=True) for row in batch]
+        assert rest == MIXED_ROWS[num + 1:]
@@ -0,0 +1,66 @@
+from functools import partial
+import asyncio
+import pytest
+
+from ..objects._cancel import CancelToken, JobCancelled
+from ..objects.optimized_table import OptimizedTable
+from ..src import loaders
+
+ROWS = [{'id': str(num), 'name': f'name "{num}",\nline' if num % 7 == 0 else f'name {num}', 'status': 'done' if num % 3 == 0 else 'new'}
+        for num in range(3000)]
+PAIRS = [('csv', 'json'), ('json', 'csv'), ('ndjson', 'ndjson.gz'), ('csv.gz', 'startrek'), ('xlsx', 'ndjson'), ('startrek', 'xlsx')]
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    'Блоки по 1 КБ, чтобы записи резались между блоками.'
+    monkeypatch.setattr(loaders, '_chunks', partial(loaders._chunks, chunk_size=1024))
+
+def read_rows(path) -> list[dict]:
+    return [row for batch in OptimizedTable.read(path).batches for row in batch]
+
+@pytest.mark.parametrize('heavy', [False, True], ids=['loop', 'executor'])
+@pytest.mark.parametrize('source_kind, target_kind', PAIRS)
+def test_round_trip(tmp_path, monkeypatch, source_kind, target_kind, heavy):
+    if heavy:
+        # Разбор и сериализация всех блоков и пачек в пуле потоков
+        monkeypatch.setattr(loaders, 'HEAVY_CHUNK_SIZE', 0)
+        monkeypatch.setattr(loaders, 'HEAVY_BATCH_SIZE', 0)
+    source = tmp_path / f'source.{source_kind}'
+    dest = tmp_path / f'result.{target_kind}'
+    OptimizedTable(batches=iter([ROWS])).save(source)
+    progress = []
+    written = asyncio.run(loaders.convert(source, dest, batch_size=100, queue_size=2,
+                                          progress=lambda max_value, value: progress.append((max_value, value))))
+    assert written == len(ROWS)
+    assert 0 < progress[-1][1] <= progress[-1][0]
+    if source_kind != 'xlsx':
+        # Прогресс xlsx считается в байтах разметки листов
+        assert progress[-1][0] == source.stat().st_size
+    expected = [{key: value.replace('\n', ' ') for key, value in row.items()} for row in ROWS] if 'startrek' in (source_kind, target_kind) else ROWS
+    assert read_rows(dest) == expected
+
+def test_projection(tmp_path):
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.ndjson'
+    OptimizedTable(batches=iter([ROWS])).save(source)
+    written = asyncio.run(loaders.convert(source, dest, columns=['id'], where='status = done', batch_size=50))
+    assert written == len(ROWS[::3])
+    assert read_rows(dest) == [{'id': row['id']} for row in ROWS[::3]]
+
+def test_cancel_removes_target(tmp_path):
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.json'
+    OptimizedTable(batches=iter([ROWS])).save(source)
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(JobCancelled):
+        asyncio.run(loaders.convert(source, dest, batch_size=100, token=token))
+    assert not dest.exists()
+
+def test_unknown_column(tmp_path):
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.json'
+    OptimizedTable(batches=iter([ROWS])).save(source)
+    with pytest.raises(AttributeError):
+        asyncio.run(loaders.convert(source, dest, columns=['missing']))
+    assert not dest.exists()
@@ -0,0 +1,94 @@
+from pathlib import Path
+import pytest
+
+from ..objects import _csv, _generators
+from ..objects._checkpoint import Checkpoint
+from ..objects._manifest import Manifest
+from ..objects.optimized_table import OptimizedTable
+
+def rows(start:int, end:int) -> list[dict]:
+    return [{'id': num, 'name': f'name "{num}"\nline' if num % 7 == 0 else f'name {num}', 'value': num / 4} for num in range(start, end)]
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    'Блоки манифеста и csv по 4 КБ и сохранение манифеста после каждой пачки.'
+    monkeypatch.setattr(_generators, 'iter_blocks', lambda file: _csv.iter_blocks(file, 4096))
+    monkeypatch.setattr(Manifest, 'chunk_size', 4096)
+    monkeypatch.setattr(Checkpoint, 'interval', 0)
+
+def convert(source:Path, dest:Path, source_type:str, target_type:str, infer_types:bool=True) -> tuple[int, int]:
+    'Инкрементальная конвертация, возвращает число строк и позицию в источнике, с которых она продолжилась.'
+    manifest = Manifest.load(source, dest, source_type, target_type, ',', infer_types=infer_types)
+    resumed = manifest.rows, manifest.input_offset
+    OptimizedTable.read(source, source_type, ',', batch_size=100, checkpoint=manifest, infer_types=infer_types).save(dest, target_type, ',')
+    return resumed
+
+def full(source:Path, dest:Path, source_type:str, target_type:str, infer_types:bool=True) -> bytes:
+    reference = dest.with_name(f'reference.{target_type}')
+    OptimizedTable.read(source, source_type, ',', infer_types=infer_types).save(reference, target_type, ',')
+    return reference.read_bytes()
+
+def append(source:Path, source_type:str, new_rows:list[dict]):
+    'Дописывает строки в конец источника. Массив json перезаписывается целиком, его начало не меняется.'
+    if source_type == 'json':
+        OptimizedTable(batches=iter([rows(0, new_rows[-1]['id'] + 1)])).save(source)
+        return
+    tail = source.with_name(f'tail.{source_type}')
+    OptimizedTable(batches=iter([new_rows])).save(tail)
+    data = tail.read_bytes()
+    if source_type == 'csv':
+        data = data.split(b'\n', 1)[1]
+    with open(source, 'ab') as file:
+        file.write(data)
+
+@pytest.mark.parametrize('source_type, target_type', [('csv', 'json'), ('ndjson', 'csv'), ('json', 'ndjson'), ('csv', 'ndjson')])
+def test_append_converts_tail(tmp_path, source_type, target_type):
+    source = tmp_path / f'source.{source_type}'
+    dest = tmp_path / f'result.{target_type}'
+    OptimizedTable(batches=iter([rows(0, 2000)])).save(source)
+    assert convert(source, dest, source_type, target_type) == (0, 0)
+    assert Manifest.sidecar(dest).exists()
+    append(source, source_type, rows(2000, 2500))
+    resumed, _ = convert(source, dest, source_type, target_type)
+    # Продолжение с последней точки не дальше, чем за блок манифеста до конца прошлого источника
+    assert 1500 < resumed <= 2000
+    assert dest.read_bytes() == full(source, dest, source_type, target_type)
+    assert convert(source, dest, source_type, target_type)[0] == 2500
+    assert dest.read_bytes() == full(source, dest, source_type, target_type)
+
+def test_changed_middle(tmp_path):
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.ndjson'
+    OptimizedTable(batches=iter([rows(0, 2000)])).save(source)
+    convert(source, dest, 'csv', 'ndjson')
+    data = bytearray(source.read_bytes())
+    position = data.index(b'name 1000')
+    data[position:position + 4] = b'NAME'
+    source.write_bytes(bytes(data))
+    resumed, offset = convert(source, dest, 'csv', 'ndjson')
+    assert 0 < offset <= position
+    assert 0 < resumed <= 1000
+    assert dest.read_bytes() == full(source, dest, 'csv', 'ndjson')
+
+def test_unfinished_last_line(tmp_path):
+    'Если прошлый источник не заканчивался переводом строки, дописанные данные продолжают его последнюю строку.'
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.json'
+    OptimizedTable(batches=iter([rows(0, 2000)])).save(source)
+    source.write_bytes(source.read_bytes().rstrip(b'\n'))
+    convert(source, dest, 'csv', 'json')
+    with open(source, 'ab') as file:
+        file.write(b' more\n2000,tail,1\n')
+    resumed, _ = convert(source, dest, 'csv', 'json')
+    assert 0 < resumed < 2000
+    assert dest.read_bytes() == full(source, dest, 'csv', 'json')
+
+def test_changed_params_restart(tmp_path):
+    source = tmp_path / 'source.csv'
+    dest = tmp_path / 'result.json'
+    OptimizedTable(batches=iter([rows(0, 500)])).save(source)
+    convert(source, dest, 'csv', 'json', infer_types=True)
+    assert not Manifest.load(source, dest, 'csv', 'json', ',', infer_types=False).resumable
+    assert not Manifest.sidecar(dest).exists()
+    convert(source, dest, 'csv', 'json', infer_types=False)
+    assert dest.read_bytes() == full(source, dest, 'csv', 'json', infer_types=False)
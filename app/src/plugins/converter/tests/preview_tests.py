@@ -0,0 +1,69 @@
+import pytest
+
+from ..objects import _preview
+from ..objects._preview import FilePreview, read_rows
+from ..objects.optimized_table import OptimizedTable
+
+ROWS = [{'id': num, 'name': f'name "{num}"\nline' if num % 7 == 0 else f'name {num}', 'value': num / 4} for num in range(1234)]
+STARTS = [0, 99, 100, 101, 550, 1200, 1230, 1234, 2000]
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    'Индекс на каждую сотую строку и чтение csv блоками по 1 КБ.'
+    monkeypatch.setattr(FilePreview, 'step', 100)
+    monkeypatch.setattr(_preview, 'PREVIEW_CHUNK_SIZE', 1024)
+
+def reference(path) -> list[dict]:
+    return [row for batch in OptimizedTable.read(path).batches for row in batch]
+
+@pytest.mark.parametrize('kind', ['csv', 'ndjson', 'json', 'csv.gz', 'xlsx'])
+def test_pages(tmp_path, kind):
+    path = tmp_path / f'source.{kind}'
+    OptimizedTable(batches=iter([ROWS[:500], ROWS[500:]])).save(path)
+    expected = reference(path)
+    preview = FilePreview(path)
+    try:
+        assert preview.indexed == (kind in ('csv', 'ndjson', 'json'))
+        # Страницы доступны до построения индекса
+        assert preview.page(550, 10) == expected[550:560]
+        assert preview.page(0, 5) == expected[:5]
+        preview.build_index()
+        if preview.indexed:
+            assert preview.total == len(ROWS)
+            assert len(preview.index) >= len(ROWS) // 100
+        for start in STARTS:
+            assert preview.page(start, 50) == expected[start:start + 50], start
+        # Без индекса число строк известно после чтения до конца файла
+        assert preview.total == len(ROWS)
+    finally:
+        preview.close()
+
+def test_total_after_last_page(tmp_path):
+    path = tmp_path / 'source.ndjson'
+    OptimizedTable(batches=iter([ROWS])).save(path)
+    preview = FilePreview(path)
+    assert preview.total is None
+    assert len(preview.page(1200, 100)) == 34
+    assert preview.total == len(ROWS)
+
+def test_blank_lines(tmp_path):
+    path = tmp_path / 'source.csv'
+    path.write_bytes(b'a,b\r\n1,2\r\n\r\n"x\ny",3\r\n4,5\r\n')
+    preview = FilePreview(path)
+    preview.step = 1
+    preview.build_index()
+    assert preview.total == 3
+    assert preview.page(1, 10) == [{'a': 'x\ny', 'b': '3'}, {'a': '4', 'b': '5'}]
+    path = tmp_path / 'source.ndjson'
+    path.write_bytes(b'{"a":1}\n\n{"a":2}\n{"a":3}')
+    preview = FilePreview(path)
+    preview.step = 1
+    preview.build_index()
+    assert preview.total == 3
+    assert preview.page(1, 10) == [{'a': 2}, {'a': 3}]
+
+def test_read_rows(tmp_path):
+    path = tmp_path / 'source.json'
+    OptimizedTable(batches=iter([ROWS])).save(path)
+    assert read_rows(path, 1000, 1010) == ROWS[1000:1010]
+    assert read_rows(path, 1230) == ROWS[1230:]
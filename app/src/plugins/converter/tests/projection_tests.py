@@ -0,0 +1,80 @@
+from importlib.util import find_spec
+import orjson
+import pytest
+
+from ..objects._projection import Projection, Condition, parse_where
+from ..objects.fast_table import FastTable
+from ..objects.optimized_table import OptimizedTable
+
+ROWS = [{'id': num, 'name': f'Name {num}', 'status': 'done' if num % 3 == 0 else 'new', 'amount': num * 1.5, 'note': None} for num in range(300)]
+COLUMNS = ['amount', 'id']
+WHERE = 'status = done; amount >= 300'
+EXPECTED = [{'amount': row['amount'], 'id': row['id']} for row in ROWS if row['status'] == 'done' and row['amount'] >= 300]
+FORMATS = ['json', 'ndjson', 'csv', 'csv.gz', 'xlsx', 'startrek',
+           *(pytest.param(kind, marks=pytest.mark.skipif(find_spec('pyarrow') is None, reason='pyarrow не установлен')) for kind in ('parquet', 'feather'))]
+
+def normalized(rows:list[dict]) -> list[dict]:
+    'Текстовые форматы отдают значения строками.'
+    return [{'amount': float(row['amount']), 'id': int(row['id'])} for row in rows]
+
+def test_parse_where():
+    conditions = parse_where(' name = " a b " ; ; x!=1;y~Q ')
+    assert [(c.column, c.op, c.value) for c in conditions] == [('name', '=', ' a b '), ('x', '!=', '1'), ('y', '~', 'Q')]
+    assert [(c.column, c.op, c.value) for c in parse_where('a >= 2; b<=3; c > x; d < "y"')] == \
+        [('a', '>=', '2'), ('b', '<=', '3'), ('c', '>', 'x'), ('d', '<', 'y')]
+    with pytest.raises(AttributeError):
+        parse_where('name')
+    with pytest.raises(AttributeError):
+        Condition('a', '==', '1')
+
+def test_condition_compare():
+    assert Condition('a', '>', '9').test('10')
+    assert Condition('a', '>', '9').test(10.5)
+    assert not Condition('a', '>', 'b').test('ab')
+    assert Condition('a', '=', '1').test(1.0)
+    assert Condition('a', '=', '').test(None)
+    assert Condition('a', '=', 'true').test(True)
+    # bool не считается числом: True не равно 1
+    assert Condition('a', '!=', '1').test(True)
+    assert Condition('a', '~', 'ИМЯ').test('Моё имя')
+    assert Condition('a', '!=', '1').test('1_0')
+
+def test_projection_rows():
+    assert Projection.create() is None and Projection.create([], ' ') is None
+    projection = Projection(['c', 'a', 'c'], 'b > 1')
+    assert projection.key == [['c', 'a'], 'b > 1']
+    assert projection.required == ['c', 'a', 'b']
+    names, rows = projection.rows(['a', 'b', 'c'], [[1, 2, 3], [4, 1, 6], [7, 8]])
+    assert names == ['c', 'a']
+    assert list(rows) == [[3, 1], [None, 7]]
+    with pytest.raises(AttributeError):
+        projection.rows(['a', 'b'], [])
+    names, rows = Projection(where='b = 1').rows(['a', 'b'], [[1, 1], [2, 2]])
+    assert names == ['a', 'b'] and list(rows) == [[1, 1]]
+
+def test_projection_dicts():
+    projection = Projection(['b', 'x'], 'a ~ y')
+    rows = [{'a': 'xyz', 'b': 1}, {'a': 'q', 'b': 2}, {'b': 3}]
+    assert list(projection.dicts(rows)) == [{'b': 1, 'x': None}]
+
+@pytest.mark.parametrize('kind', FORMATS)
+def test_readers(tmp_path, kind):
+    source = tmp_path / f'source.{kind}'
+    OptimizedTable(batches=iter([ROWS])).save(source)
+    dest = tmp_path / 'optimized.json'
+    OptimizedTable.read(source, columns=COLUMNS, where=WHERE, batch_size=7).save(dest)
+    rows = orjson.loads(dest.read_bytes())
+    assert list(rows[0]) == COLUMNS
+    assert normalized(rows) == EXPECTED
+    table = FastTable.read(source, columns=COLUMNS, where=WHERE)
+    assert table.cols == COLUMNS
+    assert normalized(table.rows) == EXPECTED
+
+@pytest.mark.parametrize('kind', ['csv', 'xlsx', 'startrek'])
+def test_unknown_column(tmp_path, kind):
+    source = tmp_path / f'source.{kind}'
+    OptimizedTable(batches=iter([ROWS[:10]])).save(source)
+    with pytest.raises(AttributeError):
+        OptimizedTable.read(source, columns=['missing']).save(tmp_path / 'result.json')
+    with pytest.raises(AttributeError):
+        FastTable.read(source, where='missing = 1')
@@ -0,0 +1,98 @@
+import io
+import os
+import pytest
+
+from ..objects import sharded_table
+from ..objects._row_index import RowIndex, record_offsets
+from ..objects._preview import FilePreview
+from ..objects.optimized_table import OptimizedTable
+from ..objects.sharded_table import ShardedTable
+
+ROWS = [{'id': num, 'name': f'name "{num}"\nline' if num % 7 == 0 else f'name {num}', 'value': num / 4} for num in range(2345)]
+CSV = b'a,b\r\n1,2\r\n\r\n"x\ny",3\r\n4,"5"\r\n\n6,7'
+
+def test_locate_and_truncate():
+    index = RowIndex(10)
+    assert index.locate(5) == (0, 0)
+    for row, offset in ((0, 0), (10, 100), (20, 210), (20, 999), (15, 150), (30, 320)):
+        index.add(row, offset)
+    assert list(index.rows) == [10, 20, 30] and list(index.offsets) == [100, 210, 320]
+    assert index.locate(9) == (0, 0)
+    assert index.locate(10) == (10, 100)
+    assert index.locate(29) == (20, 210)
+    assert index.locate(1000) == (30, 320)
+    index.total = 35
+    index.truncate(25)
+    assert list(index.rows) == [10, 20] and index.total is None
+    index.truncate(20)
+    assert len(index) == 2
+    index.truncate(0)
+    assert len(index) == 0
+
+@pytest.mark.parametrize('step', [1, 2, 3])
+def test_record_offsets(step):
+    'Пустые строки пропускаются, перевод строки в кавычках не разделяет записи csv, заголовок не считается.'
+    # Начала строк 1, 2 и 3, строка 0 в индексе не хранится
+    starts = [12, 21, 29]
+    expected = [(row, starts[row - 1]) for row in range(step, 4, step) if row <= len(starts)] + [(4, len(CSV))]
+    for block_size in range(1, len(CSV) + 2):
+        assert list(record_offsets(io.BytesIO(CSV), step, quoted=True, skip=1, block_size=block_size)) == expected, block_size
+    lines = b'{"a":1}\n\n{"a":2}\r\n{"a":3}'
+    for block_size in range(1, len(lines) + 2):
+        assert list(record_offsets(io.BytesIO(lines), 1, block_size=block_size)) == [(1, 9), (2, 18), (3, len(lines))], block_size
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / 'data.ndjson'
+    path.write_bytes(b'{}\n' * 30)
+    index = RowIndex(10)
+    index.add(10, 30)
+    index.add(20, 60)
+    index.total = 30
+    index.save(path, 'ndjson')
+    loaded = RowIndex.load(path)
+    assert (loaded.step, list(loaded.rows), list(loaded.offsets), loaded.total) == (10, [10, 20], [30, 60], 30)
+    with open(path, 'ab') as file:
+        file.write(b'{}\n')
+    assert RowIndex.load(path) is None
+    assert RowIndex.load(path, check=False) is not None
+    assert RowIndex.load(path, size=90) is not None
+    assert RowIndex.load(path, size=93) is None
+    RowIndex.remove(path)
+    assert RowIndex.load(path, check=False) is None
+    sparse = RowIndex(10)
+    sparse.add(15, 45)
+    with pytest.raises(AttributeError):
+        sparse.save(path, 'ndjson')
+
+@pytest.mark.parametrize('kind', ['csv', 'ndjson', 'json'])
+def test_written_with_conversion(tmp_path, kind):
+    path = tmp_path / f'data.{kind}'
+    OptimizedTable(batches=iter([ROWS[:1000], ROWS[1000:1001], ROWS[1001:]])).save(path, row_index=True)
+    index = RowIndex.load(path)
+    assert index is not None and index.total == len(ROWS) and len(index) == len(ROWS) // index.step
+    reference = [row for batch in OptimizedTable.read(path).batches for row in batch]
+    preview = FilePreview(path)
+    built = preview.index = RowIndex()
+    preview.build_index()
+    assert list(built.offsets)[:len(index)] == list(index.offsets)
+    preview.index = index
+    for row in index.rows:
+        assert preview.page(row, 2) == reference[row:row + 2]
+    # Без row_index устаревший индекс удаляется
+    OptimizedTable(batches=iter([ROWS[:10]])).save(path)
+    assert not RowIndex.sidecar(path).exists()
+
+def test_not_written_for_compressed(tmp_path):
+    path = tmp_path / 'data.csv.gz'
+    OptimizedTable(batches=iter([ROWS])).save(path, row_index=True)
+    assert not RowIndex.sidecar(path).exists()
+
+def test_shards_from_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharded_table, 'MIN_SHARD_SIZE', 1)
+    path = tmp_path / 'data.csv'
+    OptimizedTable(batches=iter([ROWS])).save(path, row_index=True)
+    offsets = set(RowIndex.load(path).offsets)
+    shards = ShardedTable.read(path, workers=2).plan_shards()
+    assert len(shards) > 1
+    assert all(start in offsets for start, _ in shards[1:])
+    assert shards[-1][1] == os.path.getsize(path)
@@ -0,0 +1,21 @@
+from ..objects._schema import Schema, infer_kind
+
+def test_infer_kind():
+    assert infer_kind(['1', '-2', '']) == 'int'
+    assert infer_kind(['1.5', '2e3', '7']) == 'float'
+    assert infer_kind(['007']) == 'string'
+    assert infer_kind(['', None]) == 'null'
+    assert infer_kind(['true', 'FALSE']) == 'bool'
+    assert infer_kind(['2024-01-31']) == 'date'
+
+def test_overflowing_float_is_not_a_number():
+    assert infer_kind(['1e400']) == 'string'
+    assert infer_kind(['1.5', '-1e400']) == 'string'
+    schema = Schema(['float'])
+    assert schema.convert(0, ['1.5', '1e400', '', '-2e308']) == [1.5, '1e400', None, '-2e308']
+    assert schema.convert(0, ['1e308']) == [1e308]
+
+def test_convert_rows_keeps_unparsed_values():
+    schema = Schema.infer_rows([['1', '2.5', 'x'], ['2', '3', 'y']], 3)
+    assert schema.kinds == ['int', 'float', 'string']
+    assert schema.convert_rows([['3', 'oops', 'z'], ['4']], 3) == [(3, 'oops', 'z'), (4, None, None)]
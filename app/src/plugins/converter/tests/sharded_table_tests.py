@@ -0,0 +1,47 @@
+from pathlib import Path
+import orjson
+import pytest
+
+from ..objects import sharded_table
+from ..objects._csv import format_rows, parse_block
+from ..objects.sharded_table import ShardedTable
+
+HEADERS = ['id', 'name', 'comment']
+ROWS = [[str(num), f'name "{num}"\nline' if num % 3 == 0 else f'name {num}', 'a,\n\nb' if num % 5 == 0 else '"'] for num in range(2000)]
+
+@pytest.fixture
+def source(tmp_path, monkeypatch) -> Path:
+    'Файл csv, в котором переводы строк внутри кавычек попадают на целевые границы частей и на границы блоков чтения.'
+    monkeypatch.setattr(sharded_table, 'MIN_SHARD_SIZE', 1)
+    monkeypatch.setattr(sharded_table, 'SHARD_BLOCK_SIZE', 1000)
+    path = tmp_path / 'source.csv'
+    path.write_text(format_rows([HEADERS] + ROWS), 'utf-8', newline='')
+    return path
+
+def test_shards_end_on_record_boundaries(source):
+    table = ShardedTable.read(source, workers=8)
+    shards = table.plan_shards()
+    data = source.read_bytes()
+    assert len(shards) > 8
+    assert shards[0][0] == table.data_start and shards[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in zip(shards, shards[1:]))
+    for start, end in shards:
+        assert data[start - 1:start] == b'\n'
+        assert data[:start].count(b'"') % 2 == 0
+    rows = [row for start, end in shards for row in parse_block(data[start:end].decode('utf-8'))]
+    assert rows == ROWS
+
+@pytest.mark.parametrize('result_type', ['json', 'ndjson'])
+def test_save_matches_source(source, result_type):
+    dest = source.with_name(f'result.{result_type}')
+    ShardedTable.read(source, workers=2).save(dest)
+    if result_type == 'json':
+        result = orjson.loads(dest.read_bytes())
+    else:
+        result = [orjson.loads(line) for line in dest.read_bytes().splitlines()]
+    assert result == [dict(zip(HEADERS, row)) for row in ROWS]
+    assert not list(source.parent.glob(f'.{dest.name}.part*'))
+
+def test_only_csv_source(tmp_path):
+    with pytest.raises(AttributeError):
+        ShardedTable.read(tmp_path / 'source.json')
@@ -0,0 +1,60 @@
+import random
+import pytest
+
+from ..objects import _spill
+from ..objects._sort import ExternalSort, sort_key
+
+random.seed(2)
+VALUES = [None, '', 0, 1, 2.5, '10', '9', 'abc', 'Abc', True, 'nan', -3]
+ROWS = [{'a': random.choice(VALUES), 'b': random.randint(0, 50), 'i': num} for num in range(5000)]
+
+def batches(rows:list[dict], size:int=333):
+    return (rows[start:start + size] for start in range(0, len(rows), size))
+
+@pytest.fixture
+def spills(tmp_path, monkeypatch) -> list:
+    'Временные папки, созданные сортировкой при сбросе на диск.'
+    created = []
+    def spill_directory(directory=None):
+        created.append(_spill.tempfile.TemporaryDirectory(prefix='converter_', dir=tmp_path))
+        return created[-1]
+    monkeypatch.setattr(_spill, 'spill_directory', spill_directory)
+    return created
+
+def test_sort_key():
+    values = ['b', None, '10', 9, '', 'A', -1.5, 'nan']
+    assert sorted(values, key=lambda value: sort_key(['a'])({'a': value})) == [None, '', -1.5, 9, '10', 'A', 'b', 'nan']
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('columns', [['a'], ['b', 'a']])
+@pytest.mark.parametrize('memory_rows', [10 ** 6, 1000, 7])
+def test_sort(tmp_path, spills, columns, descending, memory_rows):
+    result = list(ExternalSort(columns, descending, memory_rows, batch_size=500).run(batches(ROWS)))
+    assert all(len(batch) == 500 for batch in result[:-1])
+    # Сортировка устойчива и при слиянии отрезков с диска
+    assert [row for batch in result for row in batch] == sorted(ROWS, key=sort_key(columns), reverse=descending)
+    assert bool(spills) == (memory_rows < len(ROWS))
+    assert not list(tmp_path.iterdir())
+
+def test_merge_in_groups(tmp_path, spills, monkeypatch):
+    'Если отрезков больше `max_runs`, они сливаются группами в несколько проходов.'
+    monkeypatch.setattr(ExternalSort, 'max_runs', 3)
+    merged = []
+    merge_runs = ExternalSort._merge_runs
+    monkeypatch.setattr(ExternalSort, '_merge_runs', lambda self, runs: merged.append(len(runs)) or merge_runs(self, runs))
+    result = [row for batch in ExternalSort(['b'], memory_rows=100).run(batches(ROWS)) for row in batch]
+    assert result == sorted(ROWS, key=sort_key(['b']))
+    assert merged and max(merged) == 3
+    assert not list(tmp_path.iterdir())
+
+def test_stopped_early(tmp_path, spills):
+    'Временные файлы удаляются, даже если результат не дочитан.'
+    stage = ExternalSort(['a'], memory_rows=100, batch_size=10).run(batches(ROWS))
+    next(stage)
+    assert spills and list(tmp_path.iterdir())
+    stage.close()
+    assert not list(tmp_path.iterdir())
+
+def test_unknown_column():
+    with pytest.raises(AttributeError):
+        list(ExternalSort(['missing']).run(batches(ROWS)))
@@ -0,0 +1,55 @@
+import io
+import pytest
+
+from ..objects._startrek import iter_st_rows, format_st_row
+from ..objects._generators import st_read_gen, st_write_gen
+
+TEXT = ('Текст до таблицы: | || # |\n'
+        '#|\n'
+        '|| id | name | comment ||\n'
+        '|| 1 | multi\nline | x ||\n'
+        '||2|crlf\r\ninside|  spaces  ||\n'
+        '|| 3 |  | ||\n'
+        '|#\n'
+        'После таблицы #| || skipped || |#')
+EXPECTED = [['id', 'name', 'comment'], ['1', 'multi line', 'x'], ['2', 'crlf inside', 'spaces'], ['3', '', '']]
+
+def chunks(text:str, size:int) -> list[str]:
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+def test_chunk_boundaries():
+    'Маркеры `#|`, `||` и `|#` разрезаются между блоками на всех возможных позициях.'
+    for size in range(1, len(TEXT) + 2):
+        assert list(iter_st_rows(chunks(TEXT, size))) == EXPECTED, size
+
+def test_rows_on_separate_lines():
+    text = '#|\n||\nh1|h2\n||\n||\nv1|v2\n||\n|#'
+    for size in (1, 2, 3, 1024):
+        assert list(iter_st_rows(chunks(text, size))) == [['h1', 'h2'], ['v1', 'v2']], size
+
+@pytest.mark.parametrize('text', ['', 'без таблицы', '#|\n|#', '#| || a'])
+def test_no_complete_rows(text):
+    for size in (1, 2, 1024):
+        assert list(iter_st_rows(chunks(text, size))) == []
+
+def test_format_round_trip():
+    rows = [['id', 'name'], [1, None], [2.5, 'a\r\nb\nc']]
+    text = '#|\n' + ''.join(map(format_st_row, rows)) + '|#'
+    assert format_st_row(rows[1]) == '|| 1 |  ||\n'
+    assert list(iter_st_rows(chunks(text, 3))) == [['id', 'name'], ['1', ''], ['2.5', 'a b c']]
+
+def test_read_gen_batches():
+    for chunk_size in (1, 5, 1024):
+        batches = list(st_read_gen(io.StringIO(TEXT), batch_size=2, chunk_size=chunk_size))
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert [list(row.values()) for batch in batches for row in batch] == EXPECTED[1:]
+        assert all(list(row) == EXPECTED[0] for batch in batches for row in batch)
+
+def test_write_read_round_trip():
+    rows = [{'id': num, 'name': f'name\n{num}' if num % 3 == 0 else f'name {num}'} for num in range(10)]
+    file = io.StringIO()
+    for _ in st_write_gen(file, [rows[:4], [], rows[4:]]):
+        pass
+    file.seek(0)
+    result = [row for batch in st_read_gen(file, batch_size=3, chunk_size=7, infer_types=True) for row in batch]
+    assert result == [{'id': row['id'], 'name': row['name'].replace('\n', ' ')} for row in rows]
@@ -0,0 +1,102 @@
+from datetime import datetime, date, time
+from openpyxl import load_workbook, Workbook
+import pytest
+
+from ..objects._xlsx import XlsxWriter, XlsxReader, sheet_names, EXCEL_MAX_CELL_LENGTH
+from ..objects._projection import Projection
+from ..objects.optimized_table import OptimizedTable
+
+HEADERS = ['int', 'float', 'str', 'bool', 'datetime', 'date']
+
+def typed_row(num:int) -> list:
+    return [num, num / 4, f'<&> "{num}"\x01', num % 2 == 0, datetime(2024, 1, 2, 3, 4, num), date(2020, 5, num + 1)]
+
+def sheet_values(path) -> dict[str, list[list]]:
+    book = load_workbook(path)
+    return {sheet.title: [[cell.value for cell in row] for row in sheet.iter_rows()] for sheet in book}
+
+def test_typed_cells(tmp_path):
+    path = tmp_path / 'typed.xlsx'
+    with XlsxWriter(path, HEADERS) as writer:
+        writer.append_rows(typed_row(num) for num in range(3))
+        writer.append([None, float('nan'), 'x' * (EXCEL_MAX_CELL_LENGTH + 10), False, time(12, 30), None])
+    rows = sheet_values(path)['Data_1']
+    assert rows[0] == HEADERS
+    for num, row in enumerate(rows[1:4]):
+        expected = typed_row(num)
+        # Ячейку с форматом даты openpyxl читает как datetime в полночь
+        expected[-1] = datetime.combine(expected[-1], time())
+        # Управляющие символы, недопустимые в xml, убираются
+        expected[2] = expected[2][:-1]
+        assert row == expected
+    assert rows[4] == [None, 'nan', 'x' * EXCEL_MAX_CELL_LENGTH, False, time(12, 30), None]
+
+def test_sheet_rollover(tmp_path):
+    path = tmp_path / 'rollover.xlsx'
+    with XlsxWriter(path, HEADERS, max_rows=4) as writer:
+        writer.append_rows(typed_row(num) for num in range(7))
+    sheets = sheet_values(path)
+    assert list(sheets) == ['Data_1', 'Data_2', 'Data_3']
+    assert all(rows[0] == HEADERS for rows in sheets.values())
+    assert [len(rows) for rows in sheets.values()] == [4, 4, 2]
+    assert [row[0] for rows in sheets.values() for row in rows[1:]] == list(range(7))
+
+def test_empty_book(tmp_path):
+    path = tmp_path / 'empty.xlsx'
+    XlsxWriter(path, HEADERS).close()
+    assert sheet_values(path) == {'Data_1': [HEADERS]}
+    path = tmp_path / 'no_headers.xlsx'
+    XlsxWriter(path).close()
+    assert sheet_values(path) == {'Data_1': []}
+
+def write_sheets(path, rows:int=35, max_rows:int=10):
+    with XlsxWriter(path, HEADERS, max_rows=max_rows) as writer:
+        writer.append_rows(typed_row(num % 28) for num in range(rows))
+    return path
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_reader_joins_sheets(tmp_path, workers):
+    path = write_sheets(tmp_path / 'sheets.xlsx')
+    assert sheet_names(path) == ['Data_1', 'Data_2', 'Data_3', 'Data_4']
+    expected = [row for rows in sheet_values(path).values() for row in rows[1:]]
+    reader = XlsxReader(path, workers=workers)
+    try:
+        assert reader.names == HEADERS
+        assert list(reader.rows()) == expected
+        assert reader.position == reader.size
+    finally:
+        reader.close()
+
+def test_reader_selection_and_projection(tmp_path):
+    path = write_sheets(tmp_path / 'sheets.xlsx')
+    reader = XlsxReader(path, ['Data_3', 'Data_2'], Projection(['str', 'int'], 'bool = true'), workers=2)
+    try:
+        assert reader.names == ['str', 'int']
+        expected = [[row[2], row[0]] for row in map(typed_row, range(9, 27)) if row[3]]
+        assert list(reader.rows()) == [[value.replace('\x01', ''), num] for value, num in expected]
+    finally:
+        reader.close()
+    with pytest.raises(AttributeError):
+        XlsxReader(path, ['missing'])
+
+def test_reader_different_headers(tmp_path):
+    'Колонки листов сопоставляются по имени, пустой лист пропускается, пропущенная в разметке строка остаётся пустой, как в openpyxl.'
+    path = tmp_path / 'headers.xlsx'
+    book = Workbook()
+    first = book.active
+    first.title = 'A'
+    for row in (['a', 'b'], [1, 'x'], [2, 'y']):
+        first.append(row)
+    second = book.create_sheet('B')
+    for row in (['b', 'c'], ['z', datetime(2020, 5, 5)], [], ['q', 3]):
+        second.append(row)
+    book.create_sheet('C')
+    book.save(path)
+    batches = OptimizedTable.read(path, batch_size=2).batches
+    assert [row for batch in batches for row in batch] == [
+        {'a': 1, 'b': 'x', 'c': None},
+        {'a': 2, 'b': 'y', 'c': None},
+        {'a': None, 'b': 'z', 'c': datetime(2020, 5, 5)},
+        {'a': None, 'b': None, 'c': None},
+        {'a': None, 'b': 'q', 'c': 3},
+    ]
@@ -94,7 +94,7 @@ class LocalFilePicker(ui.dialog):
         if not self.show_hidden_files:
             paths = [p for p in paths if not p.name.startswith('.')]
         if self.allowed_fmts:
-            paths = [p for p in paths if p.suffix in self.allowed_fmts or p.is_dir()]
+            paths = [p for p in paths if p.name.endswith(tuple(self.allowed_fmts)) or p.is_dir()]
         paths.sort(key=lambda p: p.name.lower())
         paths.sort(key=lambda p: not p.is_dir())
         self.navbar_update()
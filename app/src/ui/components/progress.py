@@ -1,7 +1,14 @@
 from nicegui import ui, Event
 from ...utils.eta import ETATracker
+from ...utils.progress import ProgressCounter
 
 class LinearProgress(ui.linear_progress):
+    '''Прогресс-бар с ETA.
+
+    Значение можно передавать через `change_event` или, из рабочего потока, через `counter`:
+    после `start()` счётчик опрашивается таймером из цикла событий каждые `sample_interval` секунд.'''
+    sample_interval = 0.1
+
     def __init__(self, value = 0, max_value = 100, *, size = None, color = 'primary', badge_classes = 'absolute-center'):
         self.real_value = value
         self.max_value = max_value
@@ -12,8 +19,34 @@ class LinearProgress(ui.linear_progress):
             self.badge = ui.badge('0%').classes(badge_classes)
         self.change_event.subscribe(self.change_handler)
         self.eta = ETATracker()
+        self.counter = ProgressCounter()
+        self.timer = ui.timer(self.sample_interval, self.sample, active=False)
+
+    def start(self, counter:ProgressCounter=None):
+        '''Начинает опрос счётчика. Можно передать счётчик, который уже заполняет рабочий поток:
+        бар сразу показывает его текущее значение.'''
+        self.clear()
+        if counter is not None:
+            self.counter = counter
+            if counter.max_value:
+                self.change_handler(counter.max_value, counter.value)
+        self.timer.activate()
+
+    def stop(self):
+        'Останавливает опрос счётчика, значение бара сохраняется.'
+        self.timer.deactivate()
+
+    def sample(self):
+        state = self.counter.sample()
+        if state is None:
+            return
+        max_value, value = state
+        if max_value:
+            self.change_handler(max_value, value)
 
     def clear(self):
+        self.timer.deactivate()
+        self.counter.reset()
         self.eta.reset()
         self.set_value(0)
         self.badge.set_text('0%')
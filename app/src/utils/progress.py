@@ -0,0 +1,36 @@
+class ProgressCounter:
+    """
+    Общий счётчик прогресса между рабочим потоком и интерфейсом.
+
+    Рабочий код вызывает экземпляр как обычный callback `(max_value, value)`, вызов только
+    перезаписывает два атрибута и не создаёт событий. Интерфейс сам читает счётчик с нужной
+    частотой через `sample`, поэтому частые вызовы из рабочего потока почти ничего не стоят.
+    """
+
+    def __init__(self):
+        self.max_value = 0
+        self.value = 0
+        self._sampled = (0, 0)
+
+    def __call__(self, max_value: int | float, value: int | float) -> None:
+        self.max_value = max_value
+        self.value = value
+
+    def sample(self) -> tuple[int | float, int | float] | None:
+        """
+        Получить текущее состояние счётчика.
+
+        Returns:
+            Пара `(max_value, value)` или None, если с прошлого вызова ничего не изменилось
+        """
+        current = (self.max_value, self.value)
+        if current == self._sampled:
+            return None
+        self._sampled = current
+        return current
+
+    def reset(self) -> None:
+        """Сбросить счётчик."""
+        self.max_value = 0
+        self.value = 0
+        self._sampled = (0, 0)